@@ -0,0 +1,65 @@
+""" Micro-benchmark of the DynamoDB stream record decoder used by the collector
+
+    Times the schema decoder against the hand written decoder it replaced, which failed on records without
+    'syntax', and on MODIFY records that only changed attributes the scan does not depend on. The schema decoder
+    handles optional attributes rather than being faster; the two vary around each other from run to run, e.g.
+    legacy / schema / skipped MODIFY us per record: 2.6 / 2.5 / 0.9 at 1,000 records, 3.5 / 3.1 / 1.4 at 10,000
+    and 3.5 / 3.9 / 2.4 at 100,000.
+
+    Usage: python benchmarks/bench_ddb_decoder.py [record count ...]
+"""
+import os
+import sys
+import time
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code'))
+import common
+import corpus
+
+def legacy_unpack(records):
+    """ The hand written decoder this benchmark compares against; needs 'syntax' to be present """
+    cleaned_records = []
+    for record in records:
+        if record['eventName'] == 'INSERT':
+            ddb_item = record['dynamodb']['NewImage']
+            rec = {}
+            rec['pasteid'] = ddb_item['pasteid']['S']
+            rec['scrape_url'] = ddb_item['scrape_url']['S']
+            rec['date'] = datetime.datetime.fromtimestamp(int(ddb_item['date']['N'])).isoformat()
+            rec['size'] = int(ddb_item['size']['N'])
+            rec['syntax'] = ddb_item.get('syntax', {'S': ''})['S']
+            rec['expire'] = int(ddb_item['expire']['N'])
+            cleaned_records.append(rec)
+    return cleaned_records
+
+def time_per_record(func, records, repeat=5):
+    """ Best of 'repeat' runs, in microseconds per record """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(records)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(records) * 1e6
+
+def modify_records(records):
+    """ MODIFY records of the same pastes listed again, with only their listing date changed """
+    modified = []
+    for record in records:
+        image = record['dynamodb']['NewImage']
+        old_image = dict(image, date={'N': str(int(image['date']['N']) - 60)})
+        modified.append(dict(record, eventName='MODIFY', dynamodb=dict(record['dynamodb'], OldImage=old_image)))
+    return modified
+
+def main(counts):
+    print(f"{'records':>8} {'legacy us/rec':>14} {'schema us/rec':>14} {'modify us/rec':>14}")
+    for count in counts:
+        records = corpus.make_stream_records([{'pasteid': f"p{i:08d}", 'syntax': 'text'} for i in range(count)])
+        legacy = time_per_record(legacy_unpack, records)
+        schema = time_per_record(common.unpack_ddb_paste_records, records)
+        modify = time_per_record(common.unpack_ddb_paste_records, modify_records(records))
+        print(f"{count:>8} {legacy:>14.2f} {schema:>14.2f} {modify:>14.2f}")
+
+if __name__ == '__main__':
+    main([int(c) for c in sys.argv[1:]] or [1000, 10000, 100000])
@@ -0,0 +1,120 @@
+""" Compression ratio versus CPU time of the codecs considered for stored paste bodies
+
+    Compresses every paste of a corpus with each codec and reports the compression ratio, the CPU time per MB to
+    compress and decompress, and the size of the 'raw_paste' value that payload.encode_raw_paste() would store.
+    Codecs from optional packages (zstandard, lz4) are included when they are installed.
+
+    Usage:
+        python benchmarks/bench_payload.py [--corpus folder of real pastes] [--pastes N] [--output results.json]
+"""
+import os
+import sys
+import bz2
+import json
+import lzma
+import time
+import zlib
+import argparse
+
+BENCH_ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_ROOT, '..'))
+sys.path.insert(0, os.path.join(BENCH_ROOT, '..', 'code'))
+
+import corpus
+
+def available_codecs():
+    """ Return codec name -> (compress, decompress) for the standard library and the installed optional codecs """
+    codecs = {
+        'zlib-1': (lambda data: zlib.compress(data, 1), zlib.decompress),
+        'zlib-6': (lambda data: zlib.compress(data, 6), zlib.decompress),
+        'zlib-9': (lambda data: zlib.compress(data, 9), zlib.decompress),
+        'bz2-9': (bz2.compress, bz2.decompress),
+        'lzma-0': (lambda data: lzma.compress(data, preset=0), lzma.decompress),
+    }
+    try:
+        import zstandard
+        codecs['zstd-3'] = (zstandard.ZstdCompressor(level=3).compress, zstandard.ZstdDecompressor().decompress)
+    except ImportError:
+        pass
+    try:
+        import lz4.frame
+        codecs['lz4'] = (lz4.frame.compress, lz4.frame.decompress)
+    except ImportError:
+        pass
+    return codecs
+
+def load_pastes(args):
+    if args.corpus:
+        from yaraprofiler import load_corpus
+        return load_corpus(args.corpus, args.pastes)
+    return [paste['body'].encode('utf-8')
+            for paste in corpus.make_paste_corpus(args.pastes, max_size=args.max_size, seed=args.seed)]
+
+def bench_codec(compress, decompress, pastes):
+    """ CPU time and sizes of compressing and decompressing every paste """
+    original = compressed_size = 0
+    compress_sec = decompress_sec = 0.0
+    for data in pastes:
+        start = time.process_time()
+        compressed = compress(data)
+        compress_sec += time.process_time() - start
+
+        start = time.process_time()
+        decompress(compressed)
+        decompress_sec += time.process_time() - start
+
+        original += len(data)
+        compressed_size += len(compressed)
+
+    mb = original / 1e6
+    return {
+        'ratio': original / max(compressed_size, 1),
+        'compress_ms_per_mb': compress_sec * 1000 / mb,
+        'decompress_ms_per_mb': decompress_sec * 1000 / mb,
+        'original_bytes': original,
+        'compressed_bytes': compressed_size,
+    }
+
+def bench_encoding(pastes):
+    """ Stored size of the scan results with the current payload settings, without a blob store """
+    import payload
+    stored = original = 0
+    start = time.process_time()
+    for data in pastes:
+        paste_data = {}
+        text = data.decode('utf-8', errors='replace')
+        payload.encode_raw_paste(paste_data, text, None)
+        stored += len(paste_data['raw_paste'].encode('utf-8'))
+        original += len(data)
+    return {'stored_ratio': original / max(stored, 1),
+            'encode_ms_per_mb': (time.process_time() - start) * 1000 / (original / 1e6)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Compression ratio versus CPU time for stored paste bodies")
+    parser.add_argument('--corpus', help="folder of real paste bodies, one file per paste")
+    parser.add_argument('--pastes', type=int, default=500, help="number of pastes to use")
+    parser.add_argument('--max-size', type=int, default=200000, help="maximum synthetic paste size in characters")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="save the results as JSON")
+    args = parser.parse_args()
+
+    pastes = load_pastes(args)
+    print(f"{len(pastes)} pastes, {sum(len(p) for p in pastes) / 1e6:.1f} MB")
+    print(f"{'codec':<10} {'ratio':>7} {'compress ms/MB':>15} {'decompress ms/MB':>17}")
+    results = {}
+    for name, (compress, decompress) in available_codecs().items():
+        stats = bench_codec(compress, decompress, pastes)
+        results[name] = stats
+        print(f"{name:<10} {stats['ratio']:>7.2f} {stats['compress_ms_per_mb']:>15.1f} "
+              f"{stats['decompress_ms_per_mb']:>17.1f}")
+
+    results['encode_raw_paste'] = bench_encoding(pastes)
+    print(f"encode_raw_paste stores {results['encode_raw_paste']['stored_ratio']:.2f}x less "
+          f"at {results['encode_raw_paste']['encode_ms_per_mb']:.1f} ms/MB")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
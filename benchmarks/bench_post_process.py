@@ -0,0 +1,168 @@
+""" CPU time of the PasteHunter post process modules against their native replacements
+
+    Runs every module of postregistry.NATIVE_POST_MODULES over a corpus, once with the original PasteHunter module
+    (or a reference copy of its computation when the submodule is not checked out) and once with the native
+    replacement, checks both give the same result on every paste and reports the CPU time per MB of each.
+    Modules selected by rules are run as if their rules matched every paste. The base64 span scan of postb64 is
+    also checked and timed against the base64 pattern of the PasteHunter 'post_b64' module.
+
+    Usage:
+        python benchmarks/bench_post_process.py [--corpus folder of real pastes] [--pastes N] [--output results.json]
+"""
+import os
+import sys
+import re
+import gzip
+import json
+import math
+import time
+import base64
+import hashlib
+import logging
+import argparse
+import importlib
+from collections import Counter
+
+BENCH_ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_ROOT, '..'))
+sys.path.insert(0, os.path.join(BENCH_ROOT, '..', 'code'))
+
+import corpus
+import postregistry
+
+def _reference_entropy(results, raw_paste_data, paste_object):
+    # computation of the PasteHunter 'post_entropy' module
+    p, lns = Counter(raw_paste_data), float(len(raw_paste_data))
+    paste_object["Shannon Entropy"] = -sum(count / lns * math.log(count / lns, 2) for count in p.values())
+    return paste_object
+
+def _reference_b64(results, raw_paste_data, paste_object):
+    # computation of the PasteHunter 'post_b64' module, without sandboxes
+    for rule in results:
+        if len(raw_paste_data) > 0:
+            if rule == 'b64_gzip':
+                try:
+                    uncompressed = gzip.decompress(base64.b64decode(raw_paste_data))
+                    paste_object["decompressed_stream"] = uncompressed.encode('utf-8')
+                except Exception:
+                    pass
+            if rule == 'b64_exe':
+                try:
+                    raw_exe = base64.b64decode(raw_paste_data)
+                    paste_object["exe_size"] = len(raw_exe)
+                    paste_object["exe_md5"] = hashlib.md5(raw_exe).hexdigest()
+                    paste_object["exe_sha256"] = hashlib.sha256(raw_exe).hexdigest()
+                    paste_object["VT"] = 'https://www.virustotal.com/#/file/{0}'.format(paste_object["exe_md5"])
+                except Exception:
+                    pass
+    return paste_object
+
+REFERENCE_RUNS = {'postprocess.post_entropy': _reference_entropy, 'postprocess.post_b64': _reference_b64}
+# configuration the reference copies run with, given to the native modules as well
+REFERENCE_CONF = {'sandboxes': {}}
+
+# rules the modules are run with, as if they matched every paste
+MODULE_RESULTS = {'postprocess.post_b64': ['b64_exe', 'b64_gzip']}
+
+# base64 pattern of the PasteHunter 'post_b64' module, on bytes so span offsets are byte offsets
+BASE64_RE = re.compile(rb'(?:[A-Za-z0-9+/]{4}){3,}(?:[A-Za-z0-9+/]{2}==|[A-Za-z0-9+/]{3}=)?')
+
+def original_run(module_name):
+    """ Return the run() of the original PasteHunter module, or of its reference copy """
+    try:
+        return importlib.import_module(module_name).run, module_name
+    except ImportError:
+        return REFERENCE_RUNS[module_name], 'reference'
+
+def load_pastes(args):
+    if args.corpus:
+        from yaraprofiler import load_corpus
+        return [data.decode('utf-8', errors='replace') for data in load_corpus(args.corpus, args.pastes)]
+    return [paste['body'] for paste in corpus.make_paste_corpus(args.pastes, max_size=args.max_size, seed=args.seed)]
+
+def bench_module(run, pastes, native, results=()):
+    """ CPU time of running the module on every paste and the post processed results """
+    post_results = []
+    elapsed = 0.0
+    for text in pastes:
+        # the scanner encodes the paste for hashing anyway, so encoding is not part of the native module cost
+        encoded = text.encode('utf-8', errors='surrogatepass')
+        start = time.process_time()
+        if native:
+            paste_object = run(list(results), text, {'pasteid': 'bench'}, encoded=encoded)
+        else:
+            paste_object = run(list(results), text, {'pasteid': 'bench'})
+        elapsed += time.process_time() - start
+        post_results.append(paste_object)
+    return elapsed, post_results
+
+def bench_base64_spans(pastes):
+    """ CPU time of the base64 pattern of 'post_b64' against the vectorized span scan of postb64 """
+    import postb64
+    regex_sec = native_sec = 0.0
+    identical = True
+    for text in pastes:
+        encoded = text.encode('utf-8', errors='surrogatepass')
+        start = time.process_time()
+        expected = [[m.start(), m.end() - m.start()] for m in BASE64_RE.finditer(encoded)]
+        regex_sec += time.process_time() - start
+        start = time.process_time()
+        spans = postb64.base64_spans(encoded, limit=len(encoded))
+        native_sec += time.process_time() - start
+        identical = identical and spans == expected
+    return regex_sec, native_sec, identical
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU time of the original versus the native post process modules")
+    parser.add_argument('--corpus', help="folder of real paste bodies, one file per paste")
+    parser.add_argument('--pastes', type=int, default=500, help="number of pastes to use")
+    parser.add_argument('--max-size', type=int, default=200000, help="maximum synthetic paste size in characters")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="save the results as JSON")
+    args = parser.parse_args()
+
+    # both post_b64 implementations log an error for every gzip stream and every paste that is not base64
+    logging.disable(logging.ERROR)
+    pastes = load_pastes(args)
+    mb = sum(len(text.encode('utf-8', errors='surrogatepass')) for text in pastes) / 1e6
+    print(f"{len(pastes)} pastes, {mb:.1f} MB")
+    print(f"{'module':<26} {'original':>10} {'ms/MB':>9} {'native ms/MB':>13} {'speedup':>8} {'identical':>10}")
+    results = {}
+    for module_name, native_name in postregistry.NATIVE_POST_MODULES.items():
+        run, source = original_run(module_name)
+        native = importlib.import_module(native_name)
+        if source == 'reference' and hasattr(native, 'get_conf'):
+            native._conf = REFERENCE_CONF
+        module_results = MODULE_RESULTS.get(module_name, ())
+        original_sec, original_results = bench_module(run, pastes, False, module_results)
+        native_sec, native_results = bench_module(native.run, pastes, True, module_results)
+        stats = {
+            'original': source,
+            'original_ms_per_mb': original_sec * 1000 / mb,
+            'native_ms_per_mb': native_sec * 1000 / mb,
+            'speedup': original_sec / max(native_sec, 1e-9),
+            'identical': original_results == native_results,
+        }
+        results[module_name] = stats
+        print(f"{module_name:<26} {source:>10} {stats['original_ms_per_mb']:>9.1f} "
+              f"{stats['native_ms_per_mb']:>13.1f} {stats['speedup']:>7.1f}x {str(stats['identical']):>10}")
+
+    # the span scan alone, without the span limit, against the regular expression it replaces
+    regex_sec, native_sec, identical = bench_base64_spans(pastes)
+    stats = {
+        'original': 'regex',
+        'original_ms_per_mb': regex_sec * 1000 / mb,
+        'native_ms_per_mb': native_sec * 1000 / mb,
+        'speedup': regex_sec / max(native_sec, 1e-9),
+        'identical': identical,
+    }
+    results['base64_spans'] = stats
+    print(f"{'base64_spans':<26} {'regex':>10} {stats['original_ms_per_mb']:>9.1f} "
+          f"{stats['native_ms_per_mb']:>13.1f} {stats['speedup']:>7.1f}x {str(stats['identical']):>10}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+""" Synthetic paste corpora and DynamoDB stream events for the offline benchmarks """
+import math
+import time
+import random
+import string
+
+DEFAULT_SYNTAX_MIX = {'text': 0.6, 'python': 0.1, 'bash': 0.1, 'json': 0.1, 'php': 0.1}
+
+# strings the benchmark rule set looks for, see BENCHMARK_RULES
+KEYWORDS = ['hacked by', 'enable password', 'BEGIN RSA PRIVATE KEY', 'aws_secret_access_key', 'Nmap scan report for']
+
+BENCHMARK_RULES = {
+    'keywords.yar': '''
+rule keywords
+{
+    strings:
+        $hacked = "hacked by" wide ascii nocase
+        $enable_pass = "enable password" wide ascii nocase
+        $nmap_scan = "Nmap scan report for" wide ascii nocase
+    condition:
+        any of them
+}
+''',
+    'secrets.yar': '''
+rule private_key
+{
+    strings:
+        $rsa = "BEGIN RSA PRIVATE KEY"
+    condition:
+        $rsa
+}
+
+rule aws_keys
+{
+    strings:
+        $secret = "aws_secret_access_key" nocase
+        $key_id = /AKIA[0-9A-Z]{16}/
+    condition:
+        any of them
+}
+''',
+    'email_filter.yar': '''
+rule email_list
+{
+    strings:
+        $email = /[\\w\\.\\-]+@[\\w\\-]+\\.[a-z]{2,6}/ nocase
+    condition:
+        #email > 20
+}
+''',
+    'blacklist.yar': '''
+rule blacklist
+{
+    strings:
+        $spam = "free bitcoin generator" nocase
+    condition:
+        $spam
+}
+''',
+}
+
+_WORDS = ['the', 'user', 'config', 'server', 'value', 'error', 'return', 'import', 'print', 'data', 'name', 'port',
+          'host', 'list', 'true', 'false', 'null', 'token', 'admin', 'select', 'from', 'where', 'echo', 'function']
+
+def _body(rnd, size, syntax):
+    """ Text of roughly the given size made of code-like words and lines """
+    words = []
+    length = 0
+    while length < size:
+        word = rnd.choice(_WORDS)
+        if syntax == 'json' and rnd.random() < 0.2:
+            word = '"{0}": {1},'.format(word, rnd.randint(0, 10000))
+        elif rnd.random() < 0.05:
+            word = ''.join(rnd.choice(string.ascii_letters + string.digits) for _ in range(rnd.randint(8, 40)))
+        words.append(word)
+        length += len(word) + 1
+        if rnd.random() < 0.1:
+            words.append('\n')
+    return ' '.join(words)[:size]
+
+def make_paste_corpus(count, min_size=40, max_size=200000, keyword_rate=0.05, duplicate_rate=0.1,
+                      syntax_mix=None, seed=1):
+    """
+    Generate paste items with a body, size, syntax and id
+
+    :param count: number of pastes
+    :param min_size: minimum body size in characters
+    :param max_size: maximum body size; sizes are log-uniformly distributed like real paste sizes
+    :param keyword_rate: share of pastes containing one of the benchmark rule keywords
+    :param duplicate_rate: share of pastes reposting the body of an earlier paste
+    :param syntax_mix: syntax -> share mapping
+    :param seed: random seed, so corpora are identical between benchmark runs
+    :returns: list of {'pasteid', 'syntax', 'body'} dictionaries
+    """
+    rnd = random.Random(seed)
+    syntax_mix = syntax_mix or DEFAULT_SYNTAX_MIX
+    syntaxes, weights = zip(*syntax_mix.items())
+
+    pastes = []
+    for i in range(count):
+        syntax = rnd.choices(syntaxes, weights)[0]
+        if pastes and rnd.random() < duplicate_rate:
+            body = rnd.choice(pastes)['body']
+        else:
+            size = int(math.exp(rnd.uniform(math.log(min_size), math.log(max_size))))
+            body = _body(rnd, size, syntax)
+            if rnd.random() < keyword_rate:
+                position = rnd.randint(0, len(body))
+                body = body[:position] + ' ' + rnd.choice(KEYWORDS) + ' ' + body[position:]
+        pastes.append({'pasteid': f"p{i:08d}", 'syntax': syntax, 'body': body})
+    return pastes
+
+def make_stream_records(pastes, scrape_url='https://scrape.pastebin.com/api_scrape_item.php?i={0}', seed=1):
+    """ Generate DynamoDB stream INSERT records for paste items, shaped like the items written by the scrapers """
+    rnd = random.Random(seed)
+    now = int(time.time())
+    records = []
+    for sequence, paste in enumerate(pastes):
+        pasteid = paste['pasteid']
+        image = {
+            'pasteid': {'S': pasteid},
+            'key': {'S': pasteid},
+            'scrape_url': {'S': scrape_url.format(pasteid)},
+            'full_url': {'S': f"https://pastebin.com/{pasteid}"},
+            'date': {'N': str(now - rnd.randint(0, 120))},
+            'size': {'N': str(len(paste.get('body', '')) or rnd.randint(10, 500000))},
+            'expire': {'N': str(rnd.choice([0, now + 600, now + 86400]))},
+            'confname': {'S': 'pastebin'},
+            'pastesite': {'S': 'pastebin.com'},
+        }
+        # the scraper drops empty syntax, title and user values
+        if paste.get('syntax'):
+            image['syntax'] = {'S': paste['syntax']}
+        if rnd.random() < 0.3:
+            image['title'] = {'S': 'Untitled'}
+        records.append({
+            'eventID': str(sequence),
+            'eventName': 'INSERT',
+            'dynamodb': {'NewImage': image, 'SequenceNumber': str(100000000 + sequence)},
+        })
+    return records
+
+def make_listing(pastes, scrape_url='https://scrape.pastebin.com/api_scrape_item.php?i={0}'):
+    """ Pastebin scraping API listing entries for paste items """
+    now = int(time.time())
+    return [{
+        'scrape_url': scrape_url.format(paste['pasteid']),
+        'full_url': f"https://pastebin.com/{paste['pasteid']}",
+        'date': str(now),
+        'key': paste['pasteid'],
+        'size': str(len(paste['body'])),
+        'expire': '0',
+        'title': '',
+        'syntax': paste['syntax'],
+        'user': '',
+    } for paste in pastes]
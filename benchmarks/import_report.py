@@ -0,0 +1,114 @@
+""" Import time report for the Lambda handler modules
+
+    Imports each handler in a fresh interpreter with 'python -X importtime' and reports the cumulative import cost
+    of the modules it pulls in, which dominates the init phase of a cold start. Third party packages are summed
+    per top level package so the heavy dependencies (boto3, yara, requests) stand out.
+
+    Usage:
+        python benchmarks/import_report.py [--handler pastebin_scraper] [--top 15] [--repeat 3] [--output report.json]
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+BENCH_ROOT = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.abspath(os.path.join(BENCH_ROOT, '..'))
+CODE_ROOT = os.path.join(REPO_ROOT, 'code')
+
+HANDLERS = ('pastebin_scraper', 'pastebin_collector')
+
+def import_times(module):
+    """
+    Import a module in a fresh interpreter and parse the '-X importtime' output
+
+    :param module: name of the module to import, relative to the 'code' folder
+    :returns: list of (name, depth, self_us, cumulative_us) tuples in import completion order
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([CODE_ROOT, REPO_ROOT, env.get('PYTHONPATH', '')])
+    # handler modules read these at import time
+    env.setdefault('PASTEBIN_TABLE_NAME', 'pastes')
+    env.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+                            cwd=CODE_ROOT, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        imports.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return imports
+
+def handler_report(module, repeat=3):
+    """
+    Build the import report of a handler, keeping the fastest of 'repeat' runs to limit noise
+
+    :param module: handler module name
+    :param repeat: number of fresh interpreter runs
+    :returns: dictionary with the total import time and the per top level package cost in milliseconds
+    """
+    best = None
+    for _ in range(repeat):
+        imports = import_times(module)
+        total = next(cumulative for name, depth, _, cumulative in imports if name == module and depth == 0)
+        if best is None or total < best[0]:
+            best = (total, imports)
+
+    total, imports = best
+    # the handler's own imports are nested one level below it and complete before it, summed per top level package
+    packages = {}
+    children = []
+    for name, depth, _, cumulative in imports:
+        if depth == 0:
+            if name == module:
+                break
+            children = []
+        elif depth == 1:
+            children.append((name, cumulative))
+    for name, cumulative in children:
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0) + cumulative
+
+    return {
+        'module': module,
+        'total_ms': total / 1000,
+        'modules_loaded': len(imports),
+        'packages_ms': {name: us / 1000 for name, us in sorted(packages.items(), key=lambda p: -p[1])},
+    }
+
+def log_report(report, top):
+    print(f"{report['module']}: {report['total_ms']:.1f} ms, {report['modules_loaded']} modules")
+    for name, elapsed in list(report['packages_ms'].items())[:top]:
+        print(f"    {name:<30} {elapsed:>9.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the import time of the Lambda handler modules")
+    parser.add_argument('--handler', action='append', choices=HANDLERS,
+                        help="handler module to report on, all handlers by default")
+    parser.add_argument('--top', type=int, default=15, help="number of packages listed per handler")
+    parser.add_argument('--repeat', type=int, default=3, help="fresh interpreter runs per handler")
+    parser.add_argument('--output', help="save the report as JSON")
+    args = parser.parse_args()
+
+    reports = []
+    for module in args.handler or HANDLERS:
+        try:
+            report = handler_report(module, args.repeat)
+        except RuntimeError as e:
+            print(f"{module}: import failed - {e}")
+            continue
+        log_report(report, args.top)
+        reports.append(report)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(reports, f, indent=2)
+
+if __name__ == '__main__':
+    main()
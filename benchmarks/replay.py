@@ -0,0 +1,430 @@
+""" Local end-to-end replay of recorded Pastebin traffic through the real scraper and collector handlers
+
+    The archive's listings are served by the local stand-in server at their recorded times, compressed by the speed
+    factor. Each listing triggers a run of 'pastebin_scraper.main', which writes to an in-memory table. The table
+    feeds an in-memory stream that is polled in batches by 'pastebin_collector.main', like the Lambda event
+    source mapping does. The collector fetches the paste bodies from the stand-in server and scans them. Throughput,
+    stream depth and latency percentiles show whether the pipeline keeps up at the given rate.
+
+    Archive format, a JSON file:
+        {"pastes": {"<pasteid>": "<body>", ...},
+         "listings": [{"offset_sec": <seconds since the first listing>, "entries": [<scraping API entries>]}, ...]}
+
+    Usage:
+        python benchmarks/replay.py --archive archive.json --speed 10
+        python benchmarks/replay.py --synthetic-minutes 30 --pastes-per-min 120 --speed 20 --save-archive a.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+from collections import deque
+
+BENCH_ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_ROOT, '..', 'code'))
+
+import corpus
+from stub_server import PasteStubServer
+from run_benchmarks import setup_environment
+
+PASTEBIN_LISTING_SIZE = 250
+STREAM_POLL_INTERVAL_SEC = 0.25
+
+class MemoryStream:
+    """ Stand-in for a DynamoDB stream shard, handing out records in write order """
+
+    def __init__(self):
+        self._records = deque()
+        self._lock = threading.Lock()
+        self._sequence = 100000000
+
+    def append(self, event_name, image, old_image=None):
+        with self._lock:
+            self._sequence += 1
+            dynamodb = {'NewImage': image, 'SequenceNumber': str(self._sequence)}
+            if old_image is not None:
+                dynamodb['OldImage'] = old_image
+            record = {'eventID': str(self._sequence), 'eventName': event_name, 'dynamodb': dynamodb}
+            self._records.append((record, time.perf_counter()))
+
+    def read_batch(self, batch_size):
+        """ Remove and return up to batch_size (record, append time) tuples """
+        with self._lock:
+            return [self._records.popleft() for _ in range(min(batch_size, len(self._records)))]
+
+    def requeue(self, entries):
+        """ Put records back at the head of the stream, used for the failed records of a batch """
+        with self._lock:
+            self._records.extendleft(reversed(entries))
+
+    def __len__(self):
+        return len(self._records)
+
+class MemoryTable:
+    """
+    Stand-in for the DynamoDB service resource used by the scraper, keeping items in memory and publishing
+    INSERT and MODIFY records to the stream
+
+    :param stream: MemoryStream receiving the change records
+    :param key: partition key attribute of the paste table
+    """
+
+    def __init__(self, stream, key='key'):
+        from boto3.dynamodb.types import TypeSerializer
+        self._serializer = TypeSerializer()
+        self.stream = stream
+        self.key = key
+        self.items = {}
+        self._lock = threading.Lock()
+
+    def batch_write_item(self, RequestItems):
+        for table_name, requests in RequestItems.items():
+            for request in requests:
+                item = request['PutRequest']['Item']
+                image = {name: self._serializer.serialize(value) for name, value in item.items()}
+                with self._lock:
+                    old_image = self.items.get(item[self.key])
+                    self.items[item[self.key]] = image
+                self.stream.append('INSERT' if old_image is None else 'MODIFY', image, old_image)
+        return {'UnprocessedItems': {}}
+
+class ReplayContext:
+    """ Lambda context stand-in for the collector invocations """
+
+    function_name = 'pastebin_collector'
+
+    def __init__(self, timeout_sec):
+        self._deadline = time.perf_counter() + timeout_sec
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self._deadline - time.perf_counter()) * 1000))
+
+def load_archive(path):
+    with open(path, 'r') as f:
+        archive = json.load(f)
+    archive['listings'].sort(key=lambda listing: listing['offset_sec'])
+    return archive
+
+def make_synthetic_archive(minutes, pastes_per_min, scrape_interval_sec=60, seed=1, **corpus_args):
+    """
+    Generate an archive of Poisson distributed pastes with the listings a scraper would have seen
+
+    :param minutes: recorded duration
+    :param pastes_per_min: mean paste creation rate
+    :param scrape_interval_sec: time between two listings, the scraper schedule
+    :param seed: random seed
+    :param corpus_args: extra arguments for corpus.make_paste_corpus()
+    :returns: archive dictionary, see the module docstring
+    """
+    rnd = random.Random(seed)
+    created = []
+    elapsed = 0.0
+    while True:
+        elapsed += rnd.expovariate(pastes_per_min / 60.0)
+        if elapsed > minutes * 60:
+            break
+        created.append(elapsed)
+
+    pastes = corpus.make_paste_corpus(len(created), seed=seed, **corpus_args)
+    entries = corpus.make_listing(pastes)
+    start = int(time.time())
+    for entry, offset in zip(entries, created):
+        entry['date'] = str(start + int(offset))
+
+    listings = []
+    offset = scrape_interval_sec
+    while offset <= minutes * 60:
+        visible = [entry for entry, paste_offset in zip(entries, created) if paste_offset <= offset]
+        listings.append({'offset_sec': offset, 'entries': visible[::-1][:PASTEBIN_LISTING_SIZE]})
+        offset += scrape_interval_sec
+
+    return {'pastes': {paste['pasteid']: paste['body'] for paste in pastes}, 'listings': listings}
+
+def percentiles(values, points=(50, 90, 99)):
+    """ Nearest rank percentiles of the values, plus the maximum """
+    if not values:
+        return {}
+    ordered = sorted(values)
+    stats = {f"p{point}": ordered[min(len(ordered) - 1, int(len(ordered) * point / 100))] for point in points}
+    stats['max'] = ordered[-1]
+    return stats
+
+def reset_handler_state(work_dir):
+    """ Drop the process level caches of the handler modules so every replay starts from a cold start """
+    import common
+    import deadletter
+    import outputsink
+    import resultcache
+    import retryqueue
+    import scrapestate
+
+    common._serverless_config = None
+    common.clear_yara_rules_cache()
+    deadletter._dead_letter_store = None
+    # scanned pastes go to the in-memory delivery stream stand-in to measure the output batching
+    os.environ[outputsink.OUTPUT_STREAM_ENV] = 'memory'
+    outputsink._delivery_stream = None
+    resultcache._result_cache = None
+    retryqueue._retry_queue = None
+    scrapestate._state_store = None
+    state_file = os.path.join(work_dir, 'scraper_state.json')
+    if os.path.exists(state_file):
+        os.remove(state_file)
+    os.environ[scrapestate.STATE_FILE_ENV] = state_file
+    os.environ.pop(scrapestate.STATE_TABLE_ENV, None)
+
+class Replay:
+    """
+    Replays an archive through the scraper and collector handlers
+
+    :param archive: archive dictionary, see the module docstring
+    :param speed: multiple of the recorded rate the listings are replayed at
+    :param batch_size: maximum number of stream records per collector invocation
+    :param concurrency: number of concurrent collector invocations polling the stream
+    :param latency_sec: response latency of the stand-in paste site
+    :param timeout_sec: collector timeout reported through the invocation context
+    """
+
+    def __init__(self, archive, speed=1.0, batch_size=100, concurrency=1, latency_sec=0.02, timeout_sec=60):
+        self.archive = archive
+        self.speed = speed
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.latency_sec = latency_sec
+        self.timeout_sec = timeout_sec
+        self.stream = MemoryStream()
+        self.table = MemoryTable(self.stream)
+        self.listed_at = {}
+        self.latencies = []
+        self.stream_waits = []
+        self.depth_samples = []
+        self.scraper_durations = []
+        self.collector_durations = []
+        self.counts = {'listed': 0, 'scanned': 0, 'deferred': 0, 'failed': 0, 'checkpointed': 0, 'replayed': 0,
+                       'timeouts': 0, 'errors': 0}
+        self._lock = threading.Lock()
+        self.backlog = 0
+        self._scraping = True
+
+    def _scrape(self, server, start):
+        try:
+            import pastebin_scraper
+
+            pastebin_scraper._ddb = self.table
+            for listing in self.archive['listings']:
+                delay = start + listing['offset_sec'] / self.speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+                entries = [dict(entry, scrape_url=server.scrape_url.format(entry['key']))
+                           for entry in listing['entries']]
+                now = time.perf_counter()
+                for entry in entries:
+                    if entry['key'] not in self.listed_at:
+                        self.listed_at[entry['key']] = now
+                        self.counts['listed'] += 1
+                server.listing = entries
+
+                # records still queued when the next listing arrives were not processed within the scrape interval
+                self.backlog = len(self.stream)
+                try:
+                    pastebin_scraper.main({}, None)
+                except Exception as e:
+                    print(f"Scraper run failed: {e}")
+                    self.counts['errors'] += 1
+                self.scraper_durations.append(time.perf_counter() - now)
+        finally:
+            # the collectors drain the stream and stop even when a listing fails to replay
+            self._scraping = False
+
+    def _collect(self):
+        import pastebin_collector
+
+        while self._scraping or len(self.stream) > 0:
+            entries = self.stream.read_batch(self.batch_size)
+            if not entries:
+                time.sleep(STREAM_POLL_INTERVAL_SEC)
+                continue
+
+            invoked = time.perf_counter()
+            try:
+                response = pastebin_collector.main({'Records': [record for record, _ in entries]},
+                                                   ReplayContext(self.timeout_sec))
+            except Exception as e:
+                print(f"Collector invocation failed: {e}")
+                with self._lock:
+                    self.counts['errors'] += 1
+                continue
+            done = time.perf_counter()
+
+            # like the event source mapping, later invocations resume from the lowest reported sequence number and
+            # replay every record after it, including the pastes already scanned
+            failures = [int(failure['itemIdentifier']) for failure in response.get('batchItemFailures', [])]
+            checkpoint = min(failures) if failures else None
+            requeued = [entry for entry in entries
+                        if checkpoint is not None and int(entry[0]['dynamodb']['SequenceNumber']) >= checkpoint]
+            self.stream.requeue(requeued)
+            requeued_sequence_numbers = {entry[0]['dynamodb']['SequenceNumber'] for entry in requeued}
+            with self._lock:
+                self.collector_durations.append(done - invoked)
+                if done - invoked > self.timeout_sec:
+                    self.counts['timeouts'] += 1
+                self.counts['scanned'] += response.get('paste_count', 0)
+                self.counts['deferred'] += response.get('deferred_count', 0)
+                self.counts['checkpointed'] += response.get('unprocessed_count', 0)
+                self.counts['failed'] += response.get('failed_count', 0)
+                self.counts['replayed'] += response.get('replayed_count', 0)
+                for record, appended in entries:
+                    if record['dynamodb']['SequenceNumber'] in requeued_sequence_numbers:
+                        continue
+                    pasteid = record['dynamodb']['NewImage']['pasteid']['S']
+                    self.stream_waits.append(invoked - appended)
+                    if pasteid in self.listed_at:
+                        self.latencies.append(done - self.listed_at[pasteid])
+
+    def _sample_depth(self, start, interval_sec=0.5):
+        while self._scraping or len(self.stream) > 0:
+            self.depth_samples.append((time.perf_counter() - start, len(self.stream)))
+            time.sleep(interval_sec)
+
+    def run(self):
+        """ Replay the whole archive and return the report dictionary """
+        pastes = [{'pasteid': pasteid, 'body': body} for pasteid, body in self.archive['pastes'].items()]
+        with PasteStubServer(pastes, latency_sec=self.latency_sec) as server:
+            # the scraper reads the listings from the stand-in server through the PasteHunter settings
+            import common
+            conf = common.parse_pastehunter_config()
+            conf['inputs']['pastebin'].update({'api_scrape': server.url + '/api_scraping.php',
+                                               'paste_limit': PASTEBIN_LISTING_SIZE})
+            common.store_pastehunter_config(conf)
+
+            start = time.perf_counter()
+            threads = [threading.Thread(target=self._scrape, args=(server, start)),
+                       threading.Thread(target=self._sample_depth, args=(start,))]
+            threads += [threading.Thread(target=self._collect) for _ in range(self.concurrency)]
+            for thread in threads:
+                thread.start()
+
+            threads[0].join()
+            replayed = time.perf_counter()
+            backlog = len(self.stream)
+            for thread in threads[1:]:
+                thread.join()
+            finished = time.perf_counter()
+
+        import outputsink
+        delivery_stream = outputsink.get_delivery_stream()
+        output_bytes = sum(len(record) for record in delivery_stream.records)
+        output_calls = max(delivery_stream.calls, 1)
+
+        depths = [depth for _, depth in self.depth_samples] or [0]
+        recorded_sec = self.archive['listings'][-1]['offset_sec'] if self.archive['listings'] else 0
+        return {
+            'speed': self.speed,
+            'batch_size': self.batch_size,
+            'concurrency': self.concurrency,
+            'counts': dict(self.counts),
+            'replay_sec': replayed - start,
+            'drain_sec': finished - replayed,
+            'offered_pastes_per_sec': self.counts['listed'] / max(recorded_sec / self.speed, 1e-9),
+            # pastes scanned again because they followed a checkpoint are not counted twice
+            'sustained_pastes_per_sec':
+                (self.counts['scanned'] - self.counts['replayed']) / max(finished - start, 1e-9),
+            'stream_depth': {'max': max(depths), 'mean': sum(depths) / len(depths), 'at_last_listing': self.backlog,
+                             'at_replay_end': backlog},
+            'latency_sec': percentiles(self.latencies),
+            'stream_wait_sec': percentiles(self.stream_waits),
+            'scraper_sec': percentiles(self.scraper_durations),
+            'output': {
+                'calls': delivery_stream.calls,
+                'records': len(delivery_stream.records),
+                'documents': sum(record.count(b'\n') for record in delivery_stream.records),
+                'records_per_call': len(delivery_stream.records) / output_calls,
+                'bytes_per_call': output_bytes / output_calls,
+            },
+            'collector_sec': percentiles(self.collector_durations),
+            # a backlog of more than one batch when the last listing arrives means the collector fell behind
+            'kept_up': self.backlog <= self.batch_size * self.concurrency,
+        }
+
+def log_report(report):
+    counts = report['counts']
+    print(f"speed x{report['speed']}: {counts['listed']} listed, {counts['scanned']} scanned, "
+          f"{counts['deferred']} deferred, {counts['checkpointed']} checkpointed, {counts['replayed']} replayed, "
+          f"{counts['failed']} failed, {counts['errors']} errors")
+    print(f"    offered {report['offered_pastes_per_sec']:.1f} pastes/s, "
+          f"sustained {report['sustained_pastes_per_sec']:.1f} pastes/s, kept up: {report['kept_up']}")
+    depth = report['stream_depth']
+    print(f"    stream depth max {depth['max']}, mean {depth['mean']:.1f}, at last listing {depth['at_last_listing']}, "
+          f"drained in {report['drain_sec']:.1f} s")
+    output = report['output']
+    print(f"    output {output['documents']} documents in {output['records']} records and {output['calls']} calls, "
+          f"{output['records_per_call']:.1f} records and {output['bytes_per_call'] / 1024:.1f} KiB per call")
+    for name in ('latency_sec', 'stream_wait_sec', 'collector_sec', 'scraper_sec'):
+        stats = ', '.join(f"{point} {value:.3f}" for point, value in report[name].items())
+        print(f"    {name:<16} {stats}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded Pastebin traffic through the local pipeline")
+    parser.add_argument('--archive', help="recorded archive JSON file")
+    parser.add_argument('--synthetic-minutes', type=float, default=10,
+                        help="duration of the synthetic archive generated when no archive is given")
+    parser.add_argument('--pastes-per-min', type=float, default=60, help="paste rate of the synthetic archive")
+    parser.add_argument('--scrape-interval-sec', type=float, default=60, help="listing interval of the synthetic archive")
+    parser.add_argument('--max-size', type=int, default=200000, help="maximum synthetic paste size in characters")
+    parser.add_argument('--save-archive', help="save the synthetic archive to this file")
+    parser.add_argument('--speed', type=float, action='append',
+                        help="multiple of the recorded rate, repeat to replay at several rates")
+    parser.add_argument('--batch-size', type=int, default=100, help="stream records per collector invocation")
+    parser.add_argument('--concurrency', type=int, default=1, help="concurrent collector invocations")
+    parser.add_argument('--latency-ms', type=float, default=20, help="stand-in paste site response latency")
+    parser.add_argument('--timeout-sec', type=float, default=60, help="collector timeout")
+    parser.add_argument('--rules', help="Yara rule folder to use instead of the built-in benchmark rules")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="save the reports as JSON")
+    args = parser.parse_args()
+
+    if args.archive:
+        archive = load_archive(args.archive)
+    else:
+        archive = make_synthetic_archive(args.synthetic_minutes, args.pastes_per_min, args.scrape_interval_sec,
+                                         seed=args.seed, max_size=args.max_size)
+        if args.save_archive:
+            with open(args.save_archive, 'w') as f:
+                json.dump(archive, f)
+
+    work_dir = tempfile.mkdtemp(prefix='pastehunter-replay-')
+    try:
+        _, rules_dir = setup_environment(work_dir, args.rules)
+        os.environ['PASTEBIN_TABLE_NAME'] = 'pastes'
+        # the scraper creates its DynamoDB resource on import, the replay swaps in the in-memory table
+        os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+        import common
+        import metrics
+        common.yara_index(rules_dir, True, False)
+        # the handlers' metric records are kept in memory instead of flooding the console
+        metrics.set_default_sink(metrics.MemorySink())
+
+        reports = []
+        for speed in args.speed or [1.0]:
+            reset_handler_state(work_dir)
+            replay = Replay(archive, speed, args.batch_size, args.concurrency, args.latency_ms / 1000.0,
+                            args.timeout_sec)
+            report = replay.run()
+            log_report(report)
+            reports.append(report)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(reports, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+""" Offline benchmark suite for the scan pipeline
+
+    Times the DynamoDB record decoder, rule loading, hashing, paste item preparation and post processing on
+    their own and end-to-end, with the paste fetch served by a local stand-in server. Results are saved as JSON
+    so runs on different commits can be compared.
+
+    Usage:
+        python benchmarks/run_benchmarks.py [--pastes N] [--output results.json] [--compare baseline.json]
+"""
+import os
+import sys
+import copy
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import datetime
+import tempfile
+import subprocess
+
+BENCH_ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_ROOT, '..', 'code'))
+
+import corpus
+from stub_server import PasteStubServer
+
+def setup_environment(work_dir, rule_path=None):
+    """ Lay out a PasteHunter root with settings and rules in the work folder and point the environment at it """
+    pastehunter_root = os.path.join(work_dir, 'PasteHunter')
+    rules_dir = os.path.join(pastehunter_root, 'YaraRules')
+    os.makedirs(os.path.join(work_dir, 'code'))
+    if rule_path:
+        shutil.copytree(rule_path, rules_dir)
+    else:
+        os.makedirs(rules_dir)
+        for filename, source in corpus.BENCHMARK_RULES.items():
+            with open(os.path.join(rules_dir, filename), 'w') as yar:
+                yar.write(source)
+
+    settings = {
+        'inputs': {'pastebin': {'enabled': True, 'store_all': False, 'fetch_concurrency': 16,
+                                'fetch_rate_per_sec': 0}},
+        'yara': {'rule_path': 'YaraRules', 'blacklist': True, 'test_rules': False},
+        'post_process': {},
+    }
+    with open(os.path.join(pastehunter_root, 'settings.json'), 'w') as f:
+        json.dump(settings, f)
+
+    os.environ['PH_SERVERLESS_ROOT'] = work_dir
+    os.environ['PASTEHUNTER_ROOT'] = pastehunter_root
+    return settings, rules_dir
+
+def measure(func, items, repeat=3):
+    """ Best of 'repeat' runs of func() over 'items' work units """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {'total_sec': best, 'items': items, 'per_item_us': best / max(items, 1) * 1e6}
+
+def run(args):
+    work_dir = tempfile.mkdtemp(prefix='pastehunter-bench-')
+    try:
+        conf, rules_dir = setup_environment(work_dir, args.rules)
+
+        import common
+        import fetcher
+        import resultcache
+        import pastescanner
+
+        pastes = corpus.make_paste_corpus(args.pastes, args.min_size, args.max_size, args.keyword_rate,
+                                          args.duplicate_rate, seed=args.seed)
+        bodies = [paste['body'] for paste in pastes]
+        results = {}
+
+        records = corpus.make_stream_records(pastes)
+        results['unpack_ddb_paste_records'] = measure(lambda: common.unpack_ddb_paste_records(records), len(records))
+
+        common.yara_index(rules_dir, True, False)
+
+        def cold_compile():
+            common.clear_yara_rules_cache()
+            common.load_yara_rules(rules_dir)
+        results['load_yara_rules_compile'] = measure(cold_compile, 1)
+
+        bundle_dir = os.path.join(work_dir, 'code')
+        common.save_yara_bundle(common.load_yara_rules(rules_dir), rules_dir, bundle_dir, True, False)
+
+        def cold_bundle_load():
+            common.clear_yara_rules_cache()
+            common.load_yara_rules(rules_dir, bundle_dir)
+        results['load_yara_rules_bundle'] = measure(cold_bundle_load, 1)
+
+        def warm_loads():
+            for _ in range(100):
+                common.load_yara_rules(rules_dir)
+        results['load_yara_rules_warm'] = measure(warm_loads, 100)
+
+        def hashing():
+            for body in bodies:
+                encoded = body.encode('utf-8')
+                hashlib.md5(encoded).hexdigest()
+                hashlib.sha256(encoded).hexdigest()
+        results['hashing'] = measure(hashing, len(bodies))
+        results['hashing']['mb_per_sec'] = sum(len(b) for b in bodies) / results['hashing']['total_sec'] / 1e6
+
+        listing = corpus.make_listing(pastes)
+        results['prepare_paste_items'] = measure(lambda: common.prepare_paste_items(copy.deepcopy(listing)),
+                                                 len(listing))
+
+        def post_process():
+            resultcache._result_cache = None
+            for paste in pastes:
+                paste_data = {'pasteid': paste['pasteid'], 'confname': 'pastebin', 'pastesite': 'pastebin.com',
+                              'syntax': paste['syntax']}
+                pastescanner.post_process_paste(paste_data, conf, paste['body'])
+        results['post_process_paste'] = measure(post_process, len(pastes))
+
+        with PasteStubServer(pastes, latency_sec=args.latency_ms / 1000.0) as server:
+            stream_records = corpus.make_stream_records(pastes, scrape_url=server.scrape_url)
+
+            def end_to_end():
+                resultcache._result_cache = None
+                paste_data_records = common.unpack_ddb_paste_records(stream_records)
+                for paste_data, raw_paste_data, error in fetcher.fetch_pastes(paste_data_records, conf,
+                                                                              pastescanner.fetch_paste):
+                    if error is None:
+                        pastescanner.post_process_paste(paste_data, conf, raw_paste_data)
+            results['end_to_end'] = measure(end_to_end, len(stream_records), repeat=1)
+
+        return results
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+def compare(results, baseline_file):
+    """ Print the per-item time change of each benchmark against a saved baseline """
+    with open(baseline_file, 'r') as f:
+        baseline = json.load(f)
+    print(f"\nCompared to {baseline_file} (commit {baseline.get('commit')}):")
+    for name, stats in results.items():
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        change = (stats['per_item_us'] - before['per_item_us']) / before['per_item_us'] * 100
+        print(f"{name:<28} {before['per_item_us']:>12.2f} -> {stats['per_item_us']:>12.2f} us/item  {change:+7.1f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the PasteHunter serverless scan pipeline")
+    parser.add_argument('--pastes', type=int, default=1000, help="number of synthetic pastes")
+    parser.add_argument('--min-size', type=int, default=40, help="minimum paste size in characters")
+    parser.add_argument('--max-size', type=int, default=200000, help="maximum paste size in characters")
+    parser.add_argument('--keyword-rate', type=float, default=0.05, help="share of pastes with rule keywords")
+    parser.add_argument('--duplicate-rate', type=float, default=0.1, help="share of reposted paste bodies")
+    parser.add_argument('--latency-ms', type=float, default=20, help="stand-in server response latency")
+    parser.add_argument('--rules', help="Yara rule folder to use instead of the built-in benchmark rules")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default='bench_results.json', help="JSON results file")
+    parser.add_argument('--compare', help="JSON results file of an earlier run to compare against")
+    args = parser.parse_args()
+
+    results = run(args)
+
+    print(f"{'benchmark':<28} {'items':>8} {'total s':>10} {'us/item':>12}")
+    for name, stats in results.items():
+        print(f"{name:<28} {stats['items']:>8} {stats['total_sec']:>10.4f} {stats['per_item_us']:>12.2f}")
+
+    report = {
+        'commit': git_commit(),
+        'created': datetime.datetime.utcnow().isoformat(),
+        'params': vars(args),
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+""" Local stand-in for the Pastebin scraping API, serving paste bodies and listings from memory """
+import json
+import time
+import threading
+import http.server
+from urllib.parse import urlparse, parse_qs
+
+class PasteStubServer:
+    """
+    Serves '/api_scrape_item.php?i=<id>' with the body of the paste and '/api_scraping.php?limit=<n>' with a listing
+
+    :param pastes: list of {'pasteid', 'body'} dictionaries
+    :param latency_sec: delay added to every response, to model the round trip to the paste site
+    :param listing: optional list of listing entries returned by the scraping endpoint
+    """
+
+    def __init__(self, pastes, latency_sec=0.0, listing=None):
+        self.bodies = {paste['pasteid']: paste['body'].encode('utf-8') for paste in pastes}
+        self.latency_sec = latency_sec
+        self.listing = listing or []
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}'.format(self._server.server_port)
+
+    @property
+    def scrape_url(self):
+        return self.url + '/api_scrape_item.php?i={0}'
+
+    def _handler(self):
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                with stub._lock:
+                    stub.requests += 1
+                if stub.latency_sec:
+                    time.sleep(stub.latency_sec)
+
+                request = urlparse(self.path)
+                query = parse_qs(request.query)
+                if request.path == '/api_scraping.php':
+                    limit = int(query.get('limit', ['50'])[0])
+                    body = json.dumps(stub.listing[:limit]).encode('utf-8')
+                    content_type = 'application/json'
+                else:
+                    body = stub.bodies.get(query.get('i', [''])[0])
+                    content_type = 'text/plain; charset=utf-8'
+                    if body is None:
+                        self.send_response(404)
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
@@ -1,16 +1,43 @@
 import pprint
 import os
+import argparse
 import sys
 import yara
 import logging
 import shutil
 import code.common as common
+import yaraprofiler
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("buildutil")
 logger.setLevel(logging.INFO)
 
+# Yara rule bundles split from the first pass rules, none by default: a bundle without gates that skip most pastes
+# only adds a Yara scan per paste over the single 'index.yar' rule set. A gate may only skip pastes the rules of its
+# bundle cannot match, e.g. 'min_size' 3 for base64.yar whose shortest string is the "UEs" zip signature.
+# Settings are recopied from the sample on every build, so custom bundles go here, see README 'Rule bundles'.
+SERVERLESS_YARA_BUNDLES = {}
+
 def main():
+    parser = argparse.ArgumentParser(description="PasteHunter serverless build utility")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('build', help="update settings, generate the Yara index and bundle (default)")
+    profile_parser = subparsers.add_parser('profile', help="profile the cost of each Yara rule on a paste corpus")
+    profile_parser.add_argument('--corpus', required=True, help="folder of paste files to scan")
+    profile_parser.add_argument('--limit', type=int, help="maximum number of pastes to read from the corpus")
+    profile_parser.add_argument('--timeout', type=int, default=10, help="Yara match timeout per paste in seconds")
+    profile_parser.add_argument('--report', default='yara_profile.json', help="JSON report output file")
+    profile_parser.add_argument('--top', type=int, default=10, help="number of slowest files and rules to log")
+    profile_parser.add_argument('--budget-ms', type=float,
+                                help="write 'index.recommended.yar' without rule files above this mean cost per paste")
+    args = parser.parse_args()
+
+    if args.command == 'profile':
+        profile(args)
+    else:
+        build()
+
+def build():
 
     logger.info("Starting build process")
     serverless_config = common.parse_serverless_config()
@@ -34,19 +61,47 @@ def main():
     print_config_summary(pastehunter_config)
     logger.info("PasteHunter config values updated and saved")
 
-    # generate the index.yar file prior to build
+    # generate the index.yar file prior to build, plus one index per rule bundle when bundles are configured
     yara_rule_path = os.path.join(serverless_config['pastehunter_root'], pastehunter_config['yara']['rule_path'])
-    common.yara_index(yara_rule_path, pastehunter_config['yara']['blacklist'], pastehunter_config['yara']['test_rules'])
-    logger.info("Yara rules index generated")
-
-    # confirm Yara syntax is valid
-    try:
-        rules = common.load_yara_rules(yara_rule_path)
-        logger.info("Yara rules compiled successfully")
-    except Exception as e:
-        logger.info("Error validating Yara file syntax.")
-        logger.info(e)
-        sys.exit(1)        
+    index_names = common.yara_index(yara_rule_path, pastehunter_config['yara']['blacklist'],
+                                    pastehunter_config['yara']['test_rules'], pastehunter_config['yara'].get('bundles'))
+    logger.info(f"Yara rules index generated: {index_names}")
+
+    for index_name in index_names:
+        # confirm Yara syntax is valid
+        try:
+            rules = common.load_yara_rules(yara_rule_path, index_name=index_name)
+            logger.info(f"Yara rules compiled successfully for {index_name}")
+        except Exception as e:
+            logger.info("Error validating Yara file syntax.")
+            logger.info(e)
+            sys.exit(1)        
+
+        # keep the compiled rules so the Lambda functions can skip compilation on cold start
+        manifest = common.save_yara_bundle(rules, yara_rule_path, serverless_config['yara_bundle_path'],
+                                           pastehunter_config['yara']['blacklist'],
+                                           pastehunter_config['yara']['test_rules'], index_name)
+        logger.info(f"Precompiled Yara bundle v{manifest['version']} saved with {len(manifest['sources'])} rule files")
+
+def profile(args):
+    """ Profile each included Yara rule file and rule on a local paste corpus and report the slowest ones """
+    serverless_config = common.parse_serverless_config()
+    yara_rule_path = serverless_config['yara_rule_path']
+
+    pastes = yaraprofiler.load_corpus(args.corpus, args.limit)
+    if len(pastes) == 0:
+        logger.info(f"Error: no pastes found in corpus folder {args.corpus}. Exitting.")
+        sys.exit(1)
+
+    report = yaraprofiler.profile_rule_files(yara_rule_path, pastes, args.timeout)
+    yaraprofiler.log_report(report, args.top)
+    yaraprofiler.save_report(report, args.report)
+    logger.info(f"Profile report saved to {args.report}")
+
+    if args.budget_ms is not None:
+        index_file = os.path.join(yara_rule_path, common.YARA_RECOMMENDED_INDEX_FILE)
+        excluded = yaraprofiler.write_recommended_index(report, index_file, args.budget_ms)
+        logger.info(f"Recommended index saved to {index_file}, excluded rule files: {excluded}")
 
 def print_config_summary(conf):
     logger.info("Inputs enabled status")
@@ -70,6 +125,14 @@ def update_setting_values(conf):
     conf['inputs']['slexy']['enabled'] = False
     conf['inputs']['stackexchange']['enabled'] = False
 
+    # content fetch limits per paste site host, kept within the Pastebin Pro scraping limits
+    conf['inputs']['pastebin']['fetch_concurrency'] = 4
+    conf['inputs']['pastebin']['fetch_rate_per_sec'] = 5.0
+
+    # rule bundles, unless the sample settings already define them
+    if SERVERLESS_YARA_BUNDLES:
+        conf['yara'].setdefault('bundles', SERVERLESS_YARA_BUNDLES)
+
     # outputs
     conf['outputs']['elastic_output']['enabled'] = False
     conf['outputs']['json_output']['enabled'] = False
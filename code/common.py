@@ -1,16 +1,36 @@
 import os
+import re
 import sys
 import hashlib
 import time
 import json
 import logging
-import yara
-import requests
+import functools
+import threading
 import datetime
 from urllib.parse import unquote_plus
 
 logger = logging.getLogger("pastehunter")
 
+# yara is imported by the functions compiling or loading rules only, the scraper never scans
+
+YARA_INCLUDE_RE = re.compile(r'^\s*include\s+"([^"]+)"')
+
+# process level cache of compiled Yara rules, keyed on index file path -> (fingerprint, rules)
+_yara_rules_cache = {}
+_yara_cache_stats = {'hits': 0, 'misses': 0, 'compiles': 0, 'bundle_loads': 0, 'compile_time_sec': 0.0}
+_yara_rules_lock = threading.Lock()
+_serverless_config = None
+
+YARA_BUNDLE_VERSION = 1
+YARA_BUNDLE_FILE = 'yara_rules.bin'
+YARA_MANIFEST_FILE = 'yara_rules.manifest.json'
+YARA_FIRST_PASS_BUNDLE = 'first_pass'
+# generated bundle index files; the dotted prefix cannot clash with rule files such as 'index_leaks.yar'
+YARA_BUNDLE_INDEX_PREFIX = 'index.bundle.'
+# index written by the rule profiler without the rule files above the cost budget, see yaraprofiler
+YARA_RECOMMENDED_INDEX_FILE = 'index.recommended.yar'
+
 def parse_serverless_config():
     """ Returns PasteHunter serverless specific configuration; separate from PasteHunter project config values
         Depnds on environment variables being set:
@@ -25,6 +45,7 @@ def parse_serverless_config():
     config['pastehunter_settings_file'] = os.path.join(config['code_root'], "settings.json")
     config['pastehunter_default_settings_file'] = os.path.join(config['pastehunter_root'], "settings.json.sample")
     config['yara_rule_path'] = os.path.join(config['pastehunter_root'], pastehunter_config['yara']['rule_path'])
+    config['yara_bundle_path'] = config['code_root']
     
     return config
 
@@ -50,75 +71,442 @@ def _parse_config(conf_file = 'settings.json'):
 
     return conf
 
-def prepare_paste_items(pastes):
-    """ Prepare 'raw' list of Pastebin paste items for insert to DynamoDB table """
+def _paste_epoch(paste):
+    """ Epoch seconds of a paste item without a Pastebin 'date': StackExchange creation date or the ISO timestamp """
+    if 'creation_date' in paste:
+        return int(paste['creation_date'])
+    timestamp = paste.get('@timestamp')
+    if timestamp:
+        created = datetime.datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+        if created.tzinfo is None:
+            # the PasteHunter inputs format their timestamps from UTC epochs
+            created = created.replace(tzinfo=datetime.timezone.utc)
+        return int(created.timestamp())
+    return int(time.time())
+
+def prepare_paste_items(pastes, confname=None):
+    """ Prepare 'raw' list of paste items of a PasteHunter input for insert to DynamoDB table
+
+        Items of inputs other than Pastebin are brought to the table schema: the 'key' partition key, plus the
+        'date' and 'size' attributes PASTE_ITEM_SCHEMA requires.
+
+        :param confname: name of the input, set on items the input script did not tag with a 'confname'
+    """
     
     new_pastes = []
-    int_values = ['date', 'size']
+    # 'expire' is declared as a number in PASTE_ITEM_SCHEMA, the scraping API lists it as a string
+    int_values = ['date', 'size', 'expire']
     str_values = ['title', 'user', 'syntax']
     
     for paste in pastes:
+        if confname is not None:
+            paste.setdefault('confname', confname)
+
+        # Pastebin listings carry the table key, other inputs are keyed by input so their ids cannot collide;
+        # the files of a gist share the gist id and so are stored as a single item
+        if 'key' not in paste:
+            paste['key'] = '{0}#{1}'.format(paste.get('confname'), paste['pasteid'])
+        if 'date' not in paste:
+            paste['date'] = _paste_epoch(paste)
+        if 'size' not in paste:
+            paste['size'] = len(paste.get('body') or '')
+        if 'syntax' not in paste and paste.get('language'):
+            paste['syntax'] = paste['language'].lower()
+
         # make sure date values are int, not string
         for key in int_values:
             if key in paste:
                 paste[key] = int(paste[key])
         
-        # DynamoDB does not accept empty/null string values
+        # DynamoDB does not accept empty/null string values; gists list their 'user' as null
         for key in str_values:         
-            if key in paste and len(paste[key]) == 0:
+            if key in paste and not paste[key]:
                 del paste[key]
+        for key in [key for key, value in paste.items() if value is None]:
+            del paste[key]
 
         new_pastes.append(paste)
         
     return new_pastes
 
-def yara_index(rule_path, blacklist, test_rules):
-    """ Generate 'index.yar' file for all Yara rule files in the given folder based on PasteHunter rules """
-    index_file = os.path.join(rule_path, 'index.yar')
-    with open(index_file, 'w') as yar:
-        for filename in os.listdir(rule_path):
-            if filename.endswith('.yar') and filename != 'index.yar':
-                if filename == 'blacklist.yar':
-                    if blacklist:
-                        logger.info("Enable Blacklist Rules")
-                    else:
-                        continue
-                if filename == 'test_rules.yar':
-                    if test_rules:
-                        logger.info("Enable Test Rules")
-                    else:
-                        continue
+def yara_index(rule_path, blacklist, test_rules, bundles=None):
+    """ Generate 'index.yar' file for all Yara rule files in the given folder based on PasteHunter rules
+
+        :param bundles: optional PasteHunter 'yara.bundles' setting; when given an additional index file is written
+                        for each bundle, plus a first pass index holding every rule file not assigned to a bundle
+        :returns: list of the generated index file names
+    """
+    rule_files = []
+    for filename in os.listdir(rule_path):
+        if filename.endswith('.yar') and not is_generated_index(filename):
+            if filename == 'blacklist.yar':
+                if blacklist:
+                    logger.info("Enable Blacklist Rules")
+                else:
+                    continue
+            if filename == 'test_rules.yar':
+                if test_rules:
+                    logger.info("Enable Test Rules")
+                else:
+                    continue
+            rule_files.append(filename)
+
+    indexes = {'index.yar': rule_files}
+    if bundles:
+        assigned = set()
+        for name, bundle in bundles.items():
+            bundle_files = [f for f in bundle['rules'] if f in rule_files]
+            indexes[yara_bundle_index_name(name)] = bundle_files
+            assigned.update(bundle_files)
+        # every rule file not routed to a bundle is part of the first pass, so no rule is ever left out
+        indexes[yara_bundle_index_name(YARA_FIRST_PASS_BUNDLE)] = [f for f in rule_files if f not in assigned]
+
+    for index_name, filenames in indexes.items():
+        with open(os.path.join(rule_path, index_name), 'w') as yar:
+            for filename in filenames:
                 include = 'include "{0}"\n'.format(filename)
                 yar.write(include)
 
-def load_yara_rules(rule_path=None):
-    """ Load the 'index.yar' file from the given path and return a Yara Rules object for the referenced rules"""
+    return list(indexes.keys())
+
+def is_generated_index(filename):
+    """ Check if a rule folder file is one of the index files generated by yara_index() or the rule profiler """
+    return (filename in ('index.yar', YARA_RECOMMENDED_INDEX_FILE)
+            or (filename.startswith(YARA_BUNDLE_INDEX_PREFIX) and filename.endswith('.yar')))
+
+def yara_bundle_index_name(bundle_name):
+    """ Return the index file name of a rule bundle """
+    return f"{YARA_BUNDLE_INDEX_PREFIX}{bundle_name}.yar"
+
+def _cached_serverless_config():
+    """ Resolve the serverless config once per container """
+    global _serverless_config
+
+    if _serverless_config is None:
+        _serverless_config = parse_serverless_config()
+
+    return _serverless_config
+
+def yara_include_files(rule_file):
+    """ Return the given rule file plus every rule file it includes, following nested 'include' statements """
+    rule_files = []
+    pending = [os.path.abspath(rule_file)]
+
+    while pending:
+        current = pending.pop()
+        if current in rule_files:
+            continue
+        rule_files.append(current)
+
+        with open(current, 'r', errors='replace') as yar:
+            for line in yar:
+                include = YARA_INCLUDE_RE.match(line)
+                if include:
+                    pending.append(os.path.join(os.path.dirname(current), include.group(1)))
+
+    return rule_files
+
+def yara_rules_fingerprint(index_file):
+    """ Return a SHA256 fingerprint of the content of the index file and all of the rule files it includes
+
+        Rule files are identified by their path relative to the index file, so the fingerprint of a rule tree
+        does not change when it is moved, e.g. from the build machine to the Lambda package.
+    """
+    index_file = os.path.abspath(index_file)
+    rule_root = os.path.dirname(index_file)
+    fingerprint = hashlib.sha256()
+
+    for rule_file in sorted(os.path.relpath(f, rule_root) for f in yara_include_files(index_file)):
+        fingerprint.update(rule_file.replace(os.sep, '/').encode('utf-8'))
+        with open(os.path.join(rule_root, rule_file), 'rb') as yar:
+            fingerprint.update(hashlib.sha256(yar.read()).digest())
+
+    return fingerprint.hexdigest()
+
+def _yara_rules_stat(rule_files):
+    """ Return the (path, modification time, size) of each rule file, or None if one of them is missing """
+    stat = []
+    for rule_file in rule_files:
+        try:
+            st = os.stat(rule_file)
+        except OSError:
+            return None
+        stat.append((rule_file, st.st_mtime_ns, st.st_size))
+    return tuple(stat)
+
+def _yara_bundle_files(bundle_path, index_name):
+    """ Return the (bundle, manifest) file paths for the precompiled rules of an index file """
+    if index_name == 'index.yar':
+        return os.path.join(bundle_path, YARA_BUNDLE_FILE), os.path.join(bundle_path, YARA_MANIFEST_FILE)
+
+    stem = os.path.splitext(index_name)[0]
+    return (os.path.join(bundle_path, f"yara_rules.{stem}.bin"),
+            os.path.join(bundle_path, f"yara_rules.{stem}.manifest.json"))
+
+def save_yara_bundle(rules, rule_path, bundle_path, blacklist, test_rules, index_name='index.yar'):
+    """ Save compiled Yara rules plus a manifest describing the rule sources they were compiled from
+
+        :param rules: compiled Yara Rules object
+        :param rule_path: folder holding the 'index.yar' file the rules were compiled from
+        :param bundle_path: destination folder for the bundle and manifest files
+        :param blacklist: PasteHunter 'yara.blacklist' setting used to generate the index
+        :param test_rules: PasteHunter 'yara.test_rules' setting used to generate the index
+        :param index_name: name of the index file the rules were compiled from
+        :returns: the manifest dictionary
+    """
+    import yara
+
+    index_file = os.path.abspath(os.path.join(rule_path, index_name))
+    rule_root = os.path.dirname(index_file)
+
+    sources = {}
+    for rule_file in yara_include_files(index_file):
+        with open(rule_file, 'rb') as yar:
+            sources[os.path.relpath(rule_file, rule_root)] = hashlib.sha256(yar.read()).hexdigest()
+
+    manifest = {
+        'version': YARA_BUNDLE_VERSION,
+        'yara_version': yara.__version__,
+        'created': datetime.datetime.utcnow().isoformat(),
+        'fingerprint': yara_rules_fingerprint(index_file),
+        'blacklist': blacklist,
+        'test_rules': test_rules,
+        'sources': sources,
+    }
+
+    bundle_file, manifest_file = _yara_bundle_files(bundle_path, index_name)
+    rules.save(bundle_file)
+    with open(manifest_file, 'w') as f:
+        json.dump(manifest, fp=f, indent=2, sort_keys=True)
+
+    return manifest
+
+def load_yara_bundle(bundle_path, fingerprint, index_name='index.yar'):
+    """ Load precompiled Yara rules from the bundle folder if its manifest matches the current rule sources
+
+        :param bundle_path: folder holding the bundle and manifest files
+        :param fingerprint: fingerprint of the current rule sources, see yara_rules_fingerprint()
+        :param index_name: name of the index file the bundle was compiled from
+        :returns: a Yara Rules object, or None if there is no usable bundle
+    """
+    import yara
+
+    bundle_file, manifest_file = _yara_bundle_files(bundle_path, index_name)
+    if not os.path.exists(manifest_file) or not os.path.exists(bundle_file):
+        return None
+
+    manifest = _parse_config(manifest_file)
+    if manifest is None:
+        return None
+
+    if manifest.get('version') != YARA_BUNDLE_VERSION or manifest.get('yara_version') != yara.__version__:
+        logger.info("Yara bundle was built with a different bundle or Yara version, ignoring it")
+        return None
+
+    if manifest.get('fingerprint') != fingerprint:
+        logger.info("Yara bundle does not match the current rule sources, ignoring it")
+        return None
+
+    try:
+        return yara.load(bundle_file)
+    except Exception as e:
+        logger.error("Unable to load Yara bundle: {0}".format(e))
+        return None
+
+def yara_rules_version(rule_path=None):
+    """ Return the fingerprint of the rules last loaded from the given path, used to version derived scan results """
+    if rule_path is None:
+        rule_path = _cached_serverless_config()['yara_rule_path']
+
+    cached = _yara_rules_cache.get(os.path.abspath(os.path.join(rule_path, 'index.yar')))
+    return cached[0] if cached is not None else None
+
+def get_yara_cache_stats():
+    """ Return a copy of the compiled Yara rules cache counters (hits, misses, compile time) """
+    return dict(_yara_cache_stats)
+
+def clear_yara_rules_cache():
+    """ Drop all cached compiled Yara rules and reset the cache counters """
+    _yara_rules_cache.clear()
+    for key in _yara_cache_stats:
+        _yara_cache_stats[key] = type(_yara_cache_stats[key])()
+
+def load_yara_rules(rule_path=None, bundle_path=None, index_name='index.yar'):
+    """ Load the 'index.yar' file from the given path and return a Yara Rules object for the referenced rules
+
+        Compiled rules are cached at the process level so warm Lambda invocations reuse them. The rule files are
+        only hashed again when one of them was modified since, and the rules are only recompiled when the content
+        fingerprint of the included rule files changes. On a cache miss the precompiled bundle produced by
+        buildutil is used when its manifest matches the rule sources.
+    """
     
     if rule_path is None:
-        c = parse_serverless_config()
+        c = _cached_serverless_config()
+        rule_path = c['yara_rule_path']
+        if bundle_path is None:
+            bundle_path = c['yara_bundle_path']
+
+    index_file = os.path.abspath(os.path.join(rule_path, index_name))
+    cached = _yara_rules_cache.get(index_file)
+    if cached is not None and cached[2] is not None and _yara_rules_stat(f for f, _, _ in cached[2]) == cached[2]:
+        _yara_cache_stats['hits'] += 1
+        return cached[1]
+
+    # stat before hashing, so a rule file modified while it is read is hashed again on the next call
+    stat = _yara_rules_stat(yara_include_files(index_file))
+    fingerprint = yara_rules_fingerprint(index_file)
+    if cached is not None and cached[0] == fingerprint:
+        _yara_cache_stats['hits'] += 1
+        _yara_rules_cache[index_file] = (fingerprint, cached[1], stat)
+        return cached[1]
+
+    # compile under a lock so concurrent scan workers share a single compilation
+    with _yara_rules_lock:
+        cached = _yara_rules_cache.get(index_file)
+        if cached is not None and cached[0] == fingerprint:
+            _yara_cache_stats['hits'] += 1
+            return cached[1]
+
+        _yara_cache_stats['misses'] += 1
+        start = time.perf_counter()
+        rules = None
+        if bundle_path is not None:
+            rules = load_yara_bundle(bundle_path, fingerprint, index_name)
+
+        if rules is not None:
+            elapsed = time.perf_counter() - start
+            _yara_cache_stats['bundle_loads'] += 1
+            logger.info(f"Loaded precompiled Yara rules from {bundle_path} in {elapsed:.3f} sec")
+        else:
+            import yara
+            rules = yara.compile(index_file)
+            elapsed = time.perf_counter() - start
+            _yara_cache_stats['compiles'] += 1
+            _yara_cache_stats['compile_time_sec'] += elapsed
+            logger.info(f"Compiled Yara rules from {index_file} in {elapsed:.3f} sec")
+
+        # only the latest fingerprint is kept per index file
+        _yara_rules_cache[index_file] = (fingerprint, rules, stat)
+        return rules
+
+def load_yara_rule_bundles(bundles, rule_path=None, bundle_path=None):
+    """ Load the first pass rules and every configured rule bundle, see yara_index()
+
+        :param bundles: PasteHunter 'yara.bundles' setting, bundle name -> {'rules', 'syntax', 'min_size',
+                        'max_size', 'requires'}; the optional keys gate when the bundle runs
+        :returns: tuple of ([(bundle name, Yara Rules, bundle settings)] with the first pass first, rule set version)
+    """
+    if rule_path is None:
+        c = _cached_serverless_config()
         rule_path = c['yara_rule_path']
+        if bundle_path is None:
+            bundle_path = c['yara_bundle_path']
+
+    tiers = [(YARA_FIRST_PASS_BUNDLE, {})] + list(bundles.items())
+
+    loaded = []
+    version = hashlib.sha256(json.dumps(bundles, sort_keys=True).encode('utf-8'))
+    for name, bundle in tiers:
+        index_name = yara_bundle_index_name(name)
+        rules = load_yara_rules(rule_path, bundle_path, index_name)
+        version.update(_yara_rules_cache[os.path.abspath(os.path.join(rule_path, index_name))][0].encode('utf-8'))
+        loaded.append((name, rules, bundle))
 
-    index_file = os.path.join(rule_path, 'index.yar')
-    rules = yara.compile(index_file)
-    return rules
+    return loaded, version.hexdigest()
+
+@functools.lru_cache(maxsize=4096)
+def _epoch_to_isoformat(value):
+    """ Convert a DynamoDB number string holding epoch seconds to an ISO format date, memoized per value """
+    return datetime.datetime.fromtimestamp(int(value)).isoformat()
+
+# declared schema of the paste items stored by the scrapers: (attribute, DynamoDB type, converter, required)
+PASTE_ITEM_SCHEMA = (
+    ('pasteid', 'S', None, True),
+    ('scrape_url', 'S', None, True),
+    ('date', 'N', _epoch_to_isoformat, True),
+    ('size', 'N', int, True),
+    ('expire', 'N', int, False),
+    ('syntax', 'S', None, False),
+    ('title', 'S', None, False),
+    ('user', 'S', None, False),
+    ('key', 'S', None, False),
+    ('full_url', 'S', None, False),
+    ('confname', 'S', None, False),
+    ('pastesite', 'S', None, False),
+    # StackExchange questions carry their body, there is no raw content URL to fetch
+    ('body', 'S', None, False),
+)
+
+def build_item_decoder(schema):
+    """ Build a function turning a DynamoDB attribute-value map into a plain dictionary for the given schema
+
+        :param schema: sequence of (attribute, DynamoDB type, converter or None, required) tuples
+        :returns: decoder function taking the attribute-value map; raises KeyError on missing required attributes
+    """
+    fields = tuple(schema)
+
+    def decode(image):
+        item = {}
+        for name, ddb_type, convert, required in fields:
+            attribute = image.get(name)
+            if attribute is None:
+                if required:
+                    raise KeyError(name)
+                continue
+            value = attribute[ddb_type]
+            item[name] = value if convert is None else convert(value)
+        return item
+
+    return decode
+
+_decode_paste_item = build_item_decoder(PASTE_ITEM_SCHEMA)
+
+# attributes the scan of a paste depends on; other changes, e.g. a new listing timestamp, need no rescan
+PASTE_CONTENT_ATTRIBUTES = ('scrape_url', 'size', 'body')
+
+def _paste_content_changed(dynamodb):
+    """ Check whether a MODIFY stream record changed an attribute the scan depends on """
+    old_image = dynamodb.get('OldImage')
+    if old_image is None:
+        # streams without old images cannot tell, so the paste is scanned again
+        return True
+    new_image = dynamodb['NewImage']
+    return any(old_image.get(name) != new_image.get(name) for name in PASTE_CONTENT_ATTRIBUTES)
 
 def unpack_ddb_paste_records(records):
-    logger.info("Unpacking len(records) records from DDB")
+    """ Decode the paste items of DynamoDB stream records
+
+        INSERT records are decoded from their 'NewImage', MODIFY records only when they changed one of the
+        PASTE_CONTENT_ATTRIBUTES. REMOVE records carry no paste to scan and are skipped, as are records missing a
+        required attribute.
+    """
+    logger.info(f"Unpacking {len(records)} records from DDB")
 
     cleaned_records = []
 
     for record in records:
-        if record['eventName'] == 'INSERT':
-            ddb_item = record['dynamodb']['NewImage']
-
-            rec = {}
-            rec['pasteid'] = ddb_item['pasteid']['S']
-            rec['scrape_url'] = ddb_item['scrape_url']['S']
-            rec['date'] = datetime.datetime.fromtimestamp(int(ddb_item['date']['N'])).isoformat()
-            rec['size'] = int(ddb_item['size']['N'])
-            rec['syntax'] = ddb_item['syntax']['S']
-            rec['expire'] = int(ddb_item['expire']['N'])
-            cleaned_records.append(rec)
+        event_name = record['eventName']
+        if event_name == 'MODIFY' and not _paste_content_changed(record['dynamodb']):
+            continue
+        if event_name == 'INSERT' or event_name == 'MODIFY':
+            try:
+                cleaned_records.append(_decode_paste_item(record['dynamodb']['NewImage']))
+            except KeyError as e:
+                logger.error("Unable to decode paste record, missing attribute {0}".format(e))
+        elif event_name == 'REMOVE':
+            continue
+        else:
+            logger.debug(f"Ignoring DDB stream record with event name {event_name}")
 
     return cleaned_records
 
+def ddb_record_sequence_numbers(records):
+    """ Map the paste id of each DynamoDB stream record to the sequence number of its first record in the batch """
+    sequence_numbers = {}
+
+    for record in records:
+        pasteid = record['dynamodb'].get('NewImage', {}).get('pasteid', {}).get('S')
+        if pasteid is not None:
+            sequence_numbers.setdefault(pasteid, record['dynamodb']['SequenceNumber'])
+
+    return sequence_numbers
@@ -0,0 +1,69 @@
+import time
+import random
+import logging
+
+logger = logging.getLogger("pastehunter")
+
+# DynamoDB limit for the number of put requests in a single BatchWriteItem call
+DDB_BATCH_SIZE = 25
+DDB_MAX_RETRIES = 5
+DDB_RETRY_BASE_DELAY_SEC = 0.05
+DDB_THROTTLE_ERRORS = ('ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded')
+
+def _backoff(attempt, base_delay):
+    """ Exponential backoff with full jitter """
+    time.sleep(random.uniform(0, base_delay * (2 ** attempt)))
+
+def batch_write_items(ddb, table_name, items, key='pasteid', max_retries=DDB_MAX_RETRIES,
+                      base_delay=DDB_RETRY_BASE_DELAY_SEC):
+    """
+    Write items to a DynamoDB table in batches, deduplicated by key and retrying unprocessed items with backoff
+
+    :param ddb: boto3 DynamoDB service resource
+    :param table_name: name of the destination table
+    :param items: list of prepared items, see common.prepare_paste_items()
+    :param key: item attribute used to drop duplicates within the write
+    :param max_retries: maximum number of retries for a batch with unprocessed items
+    :param base_delay: backoff delay in seconds before the first retry
+    :returns: dictionary with 'written', 'duplicates', 'throttled' and 'failed' item counts
+    """
+    from botocore.exceptions import ClientError
+
+    stats = {'written': 0, 'duplicates': 0, 'throttled': 0, 'failed': 0}
+
+    unique_items = {}
+    for item in items:
+        if item[key] in unique_items:
+            stats['duplicates'] += 1
+        else:
+            unique_items[item[key]] = item
+    unique_items = list(unique_items.values())
+
+    for start in range(0, len(unique_items), DDB_BATCH_SIZE):
+        put_requests = [{'PutRequest': {'Item': item}} for item in unique_items[start:start + DDB_BATCH_SIZE]]
+
+        attempt = 0
+        while put_requests:
+            try:
+                response = ddb.batch_write_item(RequestItems={table_name: put_requests})
+                unprocessed = response.get('UnprocessedItems', {}).get(table_name, [])
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') not in DDB_THROTTLE_ERRORS:
+                    raise
+                unprocessed = put_requests
+
+            stats['written'] += len(put_requests) - len(unprocessed)
+            if not unprocessed:
+                break
+
+            stats['throttled'] += len(unprocessed)
+            if attempt >= max_retries:
+                logger.error(f"Giving up on {len(unprocessed)} unprocessed items for table {table_name}")
+                stats['failed'] += len(unprocessed)
+                break
+
+            _backoff(attempt, base_delay)
+            attempt += 1
+            put_requests = unprocessed
+
+    return stats
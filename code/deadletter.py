@@ -0,0 +1,118 @@
+import os
+import json
+import time
+import logging
+import threading
+
+logger = logging.getLogger("pastehunter")
+
+DEFAULT_MAX_ATTEMPTS = 3
+
+# folder for the local dead-letter store; an in-process store is used when not set
+DEAD_LETTER_DIR_ENV = 'PASTE_DEAD_LETTER_DIR'
+
+_dead_letter_store = None
+
+class MemoryDeadLetterStore:
+    """ In-process dead-letter store; failure counters survive warm invocations of the same container only """
+
+    def __init__(self):
+        self.attempts = {}
+        self.dead_letters = []
+        self._lock = threading.Lock()
+
+    def record_failure(self, key):
+        with self._lock:
+            self.attempts[key] = self.attempts.get(key, 0) + 1
+            return self.attempts[key]
+
+    def clear(self, key):
+        with self._lock:
+            self.attempts.pop(key, None)
+
+    def put(self, key, paste_data, error, attempts):
+        with self._lock:
+            self.attempts.pop(key, None)
+            self.dead_letters.append(_dead_letter(key, paste_data, error, attempts))
+
+class FileDeadLetterStore:
+    """ Local stand-in for a durable dead-letter queue; counters in a JSON file, dead letters in a JSON lines file """
+
+    def __init__(self, directory):
+        self.attempts_file = os.path.join(directory, 'attempts.json')
+        self.dead_letter_file = os.path.join(directory, 'dead_letters.jsonl')
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _read_attempts(self):
+        if not os.path.exists(self.attempts_file):
+            return {}
+        with open(self.attempts_file, 'r') as f:
+            return json.load(f)
+
+    def _write_attempts(self, attempts):
+        with open(self.attempts_file, 'w') as f:
+            json.dump(attempts, f)
+
+    def record_failure(self, key):
+        with self._lock:
+            attempts = self._read_attempts()
+            attempts[key] = attempts.get(key, 0) + 1
+            self._write_attempts(attempts)
+            return attempts[key]
+
+    def clear(self, key):
+        with self._lock:
+            attempts = self._read_attempts()
+            if attempts.pop(key, None) is not None:
+                self._write_attempts(attempts)
+
+    def put(self, key, paste_data, error, attempts):
+        with self._lock:
+            with open(self.dead_letter_file, 'a') as f:
+                f.write(json.dumps(_dead_letter(key, paste_data, error, attempts), default=str) + '\n')
+            counters = self._read_attempts()
+            if counters.pop(key, None) is not None:
+                self._write_attempts(counters)
+
+    @property
+    def dead_letters(self):
+        if not os.path.exists(self.dead_letter_file):
+            return []
+        with open(self.dead_letter_file, 'r') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+def _dead_letter(key, paste_data, error, attempts):
+    return {'key': key, 'paste': paste_data, 'error': repr(error), 'attempts': attempts, 'time': time.time()}
+
+def get_dead_letter_store():
+    """ Return the process level dead-letter store, using the backend selected by PASTE_DEAD_LETTER_DIR """
+    global _dead_letter_store
+
+    if _dead_letter_store is None:
+        directory = os.environ.get(DEAD_LETTER_DIR_ENV)
+        if directory:
+            _dead_letter_store = FileDeadLetterStore(directory)
+        else:
+            _dead_letter_store = MemoryDeadLetterStore()
+
+    return _dead_letter_store
+
+def handle_failure(store, key, paste_data, error, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """
+    Count a failed attempt for a record and sideline it to the dead-letter store once it runs out of attempts
+
+    :param store: the dead-letter store
+    :param key: unique record identifier, e.g. the stream sequence number
+    :param paste_data: the paste item metadata dictionary
+    :param error: the exception raised while processing the record
+    :param max_attempts: number of failed attempts after which the record is sidelined
+    :returns: True if the record should be retried, False if it was sidelined
+    """
+    attempts = store.record_failure(key)
+    if attempts < max_attempts:
+        return True
+
+    logger.error(f"Sidelining paste {paste_data.get('pasteid')} to dead-letter store after {attempts} attempts")
+    store.put(key, paste_data, error, attempts)
+    return False
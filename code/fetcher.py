@@ -0,0 +1,103 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+logger = logging.getLogger("pastehunter")
+
+DEFAULT_FETCH_WORKERS = 8
+DEFAULT_HOST_CONCURRENCY = 4
+# Pastebin Pro scraping allows a whitelisted IP a modest request rate; stay well under it by default
+DEFAULT_HOST_RATE_PER_SEC = 5.0
+
+# per-host limiters are kept at the process level so the rate limit also holds across warm invocations
+_host_limiters = {}
+_host_limiters_lock = threading.Lock()
+
+class HostLimiter:
+    """ Caps the number of concurrent requests and the request rate to a single host """
+
+    def __init__(self, concurrency, rate_per_sec):
+        self.concurrency = concurrency
+        self.rate_per_sec = rate_per_sec
+        self._semaphore = threading.BoundedSemaphore(concurrency)
+        self._interval = 1.0 / rate_per_sec if rate_per_sec else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def __enter__(self):
+        self._semaphore.acquire()
+        if self._interval:
+            # reserve the next free request slot, then wait for it outside the lock
+            with self._lock:
+                now = time.monotonic()
+                slot = max(now, self._next_slot)
+                self._next_slot = slot + self._interval
+            if slot > now:
+                time.sleep(slot - now)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._semaphore.release()
+        return False
+
+def get_host_limiter(host, concurrency=DEFAULT_HOST_CONCURRENCY, rate_per_sec=DEFAULT_HOST_RATE_PER_SEC):
+    """ Return the shared limiter for the given host, creating or replacing it if the limits changed """
+    with _host_limiters_lock:
+        limiter = _host_limiters.get(host)
+        if limiter is None or (limiter.concurrency, limiter.rate_per_sec) != (concurrency, rate_per_sec):
+            limiter = HostLimiter(concurrency, rate_per_sec)
+            _host_limiters[host] = limiter
+        return limiter
+
+def _limiter_for_paste(paste_data, conf):
+    """ Look up the host limiter for a paste based on its 'scrape_url' and the input specific fetch settings """
+    host = urlparse(paste_data.get('scrape_url', '')).netloc
+    input_conf = conf.get('inputs', {}).get(paste_data.get('confname'), {})
+    concurrency = input_conf.get('fetch_concurrency', DEFAULT_HOST_CONCURRENCY)
+    rate_per_sec = input_conf.get('fetch_rate_per_sec', DEFAULT_HOST_RATE_PER_SEC)
+    return get_host_limiter(host, concurrency, rate_per_sec)
+
+class FetchSkipped(Exception):
+    """ Reported for a paste whose fetch was not started because should_fetch() declined it """
+    pass
+
+def _limited_fetch(fetch_func, paste_data, conf, limiter, should_fetch):
+    with limiter:
+        if should_fetch is not None and not should_fetch(paste_data):
+            raise FetchSkipped(paste_data.get('pasteid'))
+        return fetch_func(paste_data, conf)
+
+def fetch_pastes(paste_data_records, conf, fetch_func, max_workers=DEFAULT_FETCH_WORKERS, should_fetch=None):
+    """
+    Fetch the content of all paste items concurrently, bounded per host by the input fetch settings
+
+    :param paste_data_records: list of paste item metadata dictionaries
+    :param conf: the PasteHunter configuration dictionary
+    :param fetch_func: callable(paste_data, conf) returning the raw paste content
+    :param max_workers: maximum number of fetches in flight across all hosts
+    :param should_fetch: optional callable(paste_data) checked right before each fetch starts; pastes it declines
+                         are reported with a FetchSkipped error. Fetches start in the order of paste_data_records
+    :returns: generator of (paste_data, raw_paste_data, error) tuples in order of fetch completion; error is the
+              exception raised by the fetch, in which case raw_paste_data is None
+    """
+    if len(paste_data_records) == 0:
+        return
+
+    workers = max(1, min(max_workers, len(paste_data_records)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for paste_data in paste_data_records:
+            limiter = _limiter_for_paste(paste_data, conf)
+            future = executor.submit(_limited_fetch, fetch_func, paste_data, conf, limiter, should_fetch)
+            futures[future] = paste_data
+
+        for future in as_completed(futures):
+            paste_data = futures[future]
+            try:
+                raw_paste_data, error = future.result(), None
+            except Exception as e:
+                logger.debug("Fetch failed for paste : {0} - {1}".format(paste_data.get('pasteid'), e))
+                raw_paste_data, error = None, e
+            yield paste_data, raw_paste_data, error
@@ -0,0 +1,208 @@
+import os
+import json
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import httpclient
+import largepaste
+
+logger = logging.getLogger("pastehunter")
+
+GIST_API_URL = 'https://api.github.com'
+# total bytes of file content scanned per gist
+GIST_MAX_BYTES = 1024 * 1024
+GIST_FETCH_WORKERS = 4
+# process level cache of gist responses, bounded by the size of the cached bodies
+GIST_CACHE_BYTES = int(os.environ.get('PASTE_GIST_CACHE_BYTES', 16 * 1024 * 1024))
+
+_gist_cache = None
+_gist_cache_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_gist_stats = {'api_requests': 0, 'not_modified': 0, 'file_requests': 0, 'file_cache_hits': 0,
+               'capped': 0, 'rate_limit_remaining': None}
+
+class GistNotFoundError(Exception):
+    """ Raised when the gist was deleted or made private """
+    pass
+
+class ConditionalCache:
+    """
+    LRU cache of response bodies with the ETag and Last-Modified validators they were served with
+
+    :param max_bytes: maximum total size of the cached bodies
+    """
+
+    def __init__(self, max_bytes=GIST_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        """ Return the cached (etag, last_modified, body) tuple for the URL, or None """
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None:
+                self._entries.move_to_end(url)
+            return entry
+
+    def put(self, url, etag, last_modified, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(url, None)
+            if previous is not None:
+                self.size -= len(previous[2])
+            self._entries[url] = (etag, last_modified, body)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted[2])
+
+    def __len__(self):
+        return len(self._entries)
+
+def get_gist_cache():
+    """ Return the process level gist response cache, shared by warm invocations """
+    global _gist_cache
+
+    with _gist_cache_lock:
+        if _gist_cache is None:
+            _gist_cache = ConditionalCache()
+
+    return _gist_cache
+
+def get_gist_stats():
+    """ Return the gist request, conditional request and cache counters """
+    with _stats_lock:
+        return dict(_gist_stats)
+
+def _count(name, value=1):
+    with _stats_lock:
+        _gist_stats[name] += value
+
+def _read_capped(response, limit):
+    """ Read at most limit bytes of a streamed response body """
+    chunks = []
+    size = 0
+    for chunk in response.iter_content(largepaste.STREAM_CHUNK_SIZE):
+        chunks.append(chunk)
+        size += len(chunk)
+        if size >= limit:
+            break
+    httpclient.count_bytes(min(size, limit), response.raw.tell() or size)
+    return b''.join(chunks)[:limit]
+
+def fetch_gist_metadata(gist_id, gists_conf, cache):
+    """
+    Fetch the gist from the API with a conditional request when an earlier response is cached
+
+    An unchanged gist is answered with '304 Not Modified', which GitHub does not count against the rate limit.
+
+    :param gist_id: the gist id
+    :param gists_conf: the PasteHunter 'inputs.gists' settings
+    :param cache: ConditionalCache holding earlier responses
+    :returns: the gist API response as a dictionary
+    :raises GistNotFoundError: when the gist no longer exists
+    """
+    url = '{0}/gists/{1}'.format(gists_conf.get('api_url', GIST_API_URL).rstrip('/'), gist_id)
+    headers = {'Accept': 'application/vnd.github.v3+json'}
+    if gists_conf.get('api_token'):
+        headers['Authorization'] = 'token {0}'.format(gists_conf['api_token'])
+
+    cached = cache.get(url)
+    if cached is not None:
+        etag, last_modified, _ = cached
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+    response = httpclient.get(url, headers=headers)
+    _count('api_requests')
+    remaining = response.headers.get('X-RateLimit-Remaining')
+    if remaining is not None:
+        with _stats_lock:
+            _gist_stats['rate_limit_remaining'] = int(remaining)
+
+    if response.status_code == 304 and cached is not None:
+        _count('not_modified')
+        return json.loads(cached[2])
+    if response.status_code == 404:
+        raise GistNotFoundError(gist_id)
+    response.raise_for_status()
+
+    cache.put(url, response.headers.get('ETag'), response.headers.get('Last-Modified'), response.content)
+    return response.json()
+
+def _fetch_file(raw_url, limit, cache):
+    """
+    Fetch the content of a gist file; raw URLs include the revision, so cached content is always current
+
+    :param raw_url: the raw URL of the file
+    :param limit: number of bytes needed, at most the size of the file
+    :param cache: ConditionalCache holding earlier responses
+    :returns: the first 'limit' bytes of the file
+    """
+    # content cached under a smaller byte cap is fetched again
+    cached = cache.get(raw_url)
+    if cached is not None and len(cached[2]) >= limit:
+        _count('file_cache_hits')
+        return cached[2][:limit]
+
+    response = httpclient.get(raw_url, stream=True)
+    try:
+        _count('file_requests')
+        response.raise_for_status()
+        content = _read_capped(response, limit)
+    finally:
+        response.close()
+
+    cache.put(raw_url, None, None, content)
+    return content
+
+def fetch_gist(gist_id, gists_conf):
+    """
+    Fetch the content of all files of a gist, concurrently and capped in total size
+
+    Files are taken in name order until the byte cap is reached, the last one possibly truncated. File content
+    included in the API response is used as is; truncated files are fetched from their raw URL.
+
+    :param gist_id: the gist id
+    :param gists_conf: the PasteHunter 'inputs.gists' settings; 'max_bytes' overrides the byte cap
+    :returns: the text of all files, separated by newlines
+    """
+    cache = get_gist_cache()
+    gist = fetch_gist_metadata(gist_id, gists_conf, cache)
+    max_bytes = gists_conf.get('max_bytes', GIST_MAX_BYTES)
+
+    # plan the content of every file within the byte cap before fetching any of them
+    plan = []
+    remaining = max_bytes
+    for name in sorted(gist.get('files', {})):
+        if remaining <= 0:
+            _count('capped')
+            logger.info(f"Gist {gist_id} exceeds {max_bytes} bytes, skipping file {name}")
+            continue
+        meta = gist['files'][name]
+        limit = min(meta.get('size', remaining), remaining)
+        remaining -= limit
+        if meta.get('truncated') or meta.get('content') is None:
+            plan.append((meta['raw_url'], limit))
+        else:
+            plan.append((meta['content'].encode('utf-8')[:limit], limit))
+
+    contents = [None] * len(plan)
+    fetches = [(i, source, limit) for i, (source, limit) in enumerate(plan) if isinstance(source, str)]
+    for i, (source, limit) in enumerate(plan):
+        if not isinstance(source, str):
+            contents[i] = source
+
+    if fetches:
+        with ThreadPoolExecutor(max_workers=min(GIST_FETCH_WORKERS, len(fetches))) as executor:
+            futures = [(i, executor.submit(_fetch_file, raw_url, limit, cache)) for i, raw_url, limit in fetches]
+            for i, future in futures:
+                contents[i] = future.result()
+
+    return '\n'.join(content.decode('utf-8', errors='replace') for content in contents)
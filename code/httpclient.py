@@ -0,0 +1,125 @@
+import logging
+import threading
+from contextlib import contextmanager
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger("pastehunter")
+
+# (connect, read) timeouts in seconds
+HTTP_TIMEOUT = (3.05, 15)
+HTTP_POOL_CONNECTIONS = 8
+HTTP_POOL_MAXSIZE = 16
+HTTP_HEADERS = {
+    'Accept-Encoding': 'gzip, deflate',
+    'User-Agent': 'PasteHunter-serverless',
+}
+
+# one session per container so keep-alive connections are reused across records and warm invocations
+_session = None
+_session_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_http_stats = {'requests': 0, 'errors': 0, 'bytes_received': 0, 'bytes_transferred': 0}
+
+def get_session():
+    """ Return the shared, connection pooling HTTP session, creating it on first use """
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers.update(HTTP_HEADERS)
+            _session = session
+
+    return _session
+
+class PooledRequests:
+    """ Stand-in for the 'requests' module of the PasteHunter input scripts, sending their GET requests through the
+        shared session; everything else is looked up on the 'requests' module
+    """
+
+    def get(self, url, **kwargs):
+        return get(url, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+_pooled_requests = PooledRequests()
+
+@contextmanager
+def pooled_requests(module):
+    """
+    Send the 'requests.get()' calls of a module importing 'requests' through the shared session while the block runs
+
+    The module attribute is restored afterwards, so other users of the module are only affected during the block.
+
+    :param module: module that imported 'requests', e.g. a PasteHunter input script
+    """
+    if getattr(module, 'requests', None) is not requests:
+        yield
+        return
+
+    module.requests = _pooled_requests
+    try:
+        yield
+    finally:
+        module.requests = requests
+
+def get(url, timeout=HTTP_TIMEOUT, **kwargs):
+    """
+    GET request through the shared session with connect/read timeouts enforced
+
+    :param url: the URL to request
+    :param timeout: (connect, read) timeout tuple in seconds
+    :returns: the requests Response object; with stream=True the caller reports the bytes read, see count_bytes()
+    """
+    try:
+        response = get_session().get(url, timeout=timeout, **kwargs)
+    except Exception:
+        with _stats_lock:
+            _http_stats['requests'] += 1
+            _http_stats['errors'] += 1
+        raise
+
+    with _stats_lock:
+        _http_stats['requests'] += 1
+
+    if not kwargs.get('stream'):
+        received = len(response.content)
+        # compressed size on the wire when the server reports it, otherwise the decoded size
+        count_bytes(received, int(response.headers.get('Content-Length', received)))
+
+    return response
+
+def count_bytes(received, transferred):
+    """ Add decoded and on the wire byte counts of a response body to the shared session stats """
+    with _stats_lock:
+        _http_stats['bytes_received'] += received
+        _http_stats['bytes_transferred'] += transferred
+
+def get_http_stats():
+    """ Return request, connection reuse and byte counters for the shared session """
+    with _stats_lock:
+        stats = dict(_http_stats)
+
+    connections = 0
+    if _session is not None:
+        for adapter in set(_session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is not None:
+                    connections += pool.num_connections
+
+    stats['connections_opened'] = connections
+    stats['connections_reused'] = max(0, stats['requests'] - stats['errors'] - connections)
+    return stats
+
+def reset_http_stats():
+    """ Reset the request and byte counters; open connections are kept """
+    with _stats_lock:
+        for key in _http_stats:
+            _http_stats[key] = 0
@@ -0,0 +1,107 @@
+import os
+import hashlib
+import logging
+import tempfile
+import weakref
+import httpclient
+
+logger = logging.getLogger("pastehunter")
+
+# bodies above this size are spooled to a temporary file instead of being held in memory
+LARGE_PASTE_THRESHOLD = int(os.environ.get('PASTE_LARGE_THRESHOLD_BYTES', 1024 * 1024))
+# the 'raw_paste' value stored with scan results is truncated to this size
+STORED_BODY_LIMIT = int(os.environ.get('PASTE_STORED_BODY_LIMIT_BYTES', 256 * 1024))
+STREAM_CHUNK_SIZE = 64 * 1024
+
+class LargePaste:
+    """ Paste body spooled to a temporary file, hashed in a single pass while it was downloaded """
+
+    def __init__(self, path, size, md5, sha256, head, encoding):
+        self.path = path
+        self.size = size
+        self.md5 = md5
+        self.sha256 = sha256
+        self.head = head
+        self.encoding = encoding
+        # the spool file is removed once the paste is closed or garbage collected
+        self._finalizer = weakref.finalize(self, _remove_file, path)
+
+    def text(self, limit=STORED_BODY_LIMIT):
+        """ Return the leading part of the body as text """
+        return self.head[:limit].decode(self.encoding, errors='replace')
+
+    def read_text(self):
+        """ Read the whole body from the spool file as text """
+        with open(self.path, 'rb') as f:
+            return f.read().decode(self.encoding, errors='replace')
+
+    def match(self, rules, **kwargs):
+        """ Run Yara rules against the spool file, leaving the mapping of the file to Yara """
+        return rules.match(filepath=self.path, **kwargs)
+
+    def close(self):
+        self._finalizer()
+
+    def __len__(self):
+        return self.size
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def fetch_paste_body(url, threshold=LARGE_PASTE_THRESHOLD):
+    """
+    Stream a paste body, spooling it to a temporary file once it grows beyond the threshold
+
+    :param url: the raw paste URL
+    :param threshold: body size in bytes above which the body is spooled to disk
+    :returns: the body as text, or a LargePaste for bodies above the threshold
+    """
+    response = httpclient.get(url, stream=True)
+    try:
+        encoding = response.encoding or 'utf-8'
+        chunks = []
+        size = 0
+        spool = None
+        md5 = sha256 = None
+        head = b''
+
+        for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+            size += len(chunk)
+            if spool is None:
+                chunks.append(chunk)
+                if size <= threshold:
+                    continue
+
+                # switch to the spool file and hash what was buffered so far
+                spool = tempfile.NamedTemporaryFile(prefix='paste-', delete=False)
+                md5 = hashlib.md5()
+                sha256 = hashlib.sha256()
+                head = b''.join(chunks)[:STORED_BODY_LIMIT]
+                for buffered in chunks:
+                    md5.update(buffered)
+                    sha256.update(buffered)
+                    spool.write(buffered)
+                chunks = None
+            else:
+                md5.update(chunk)
+                sha256.update(chunk)
+                spool.write(chunk)
+
+        httpclient.count_bytes(size, response.raw.tell() or size)
+    except Exception:
+        if spool is not None:
+            spool.close()
+            _remove_file(spool.name)
+        raise
+    finally:
+        response.close()
+
+    if spool is None:
+        return b''.join(chunks).decode(encoding, errors='replace')
+
+    spool.close()
+    logger.info(f"Spooled large paste of {size} bytes from {url}")
+    return LargePaste(spool.name, size, md5.hexdigest(), sha256.hexdigest(), head, encoding)
@@ -0,0 +1,163 @@
+import os
+import sys
+import json
+import time
+import random
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger("pastehunter")
+
+METRICS_NAMESPACE = 'PasteHunterServerless'
+# share of pastes emitting their own per-stage timing record
+METRICS_SAMPLE_RATE_ENV = 'PASTE_METRICS_SAMPLE_RATE'
+DEFAULT_SAMPLE_RATE = 0.01
+
+class StdoutSink:
+    """ Writes embedded metric format records as single JSON log lines, picked up by CloudWatch Logs """
+
+    def emit(self, record):
+        sys.stdout.write(json.dumps(record, separators=(',', ':')) + '\n')
+        sys.stdout.flush()
+
+class MemorySink:
+    """ Keeps emitted records in memory, for local testing """
+
+    def __init__(self):
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+_default_sink = StdoutSink()
+
+def set_default_sink(sink):
+    """ Replace the sink used by metrics created without an explicit sink """
+    global _default_sink
+    _default_sink = sink
+
+def embedded_metric_record(dimensions, values, units, properties=None):
+    """
+    Build an embedded metric format record
+
+    :param dimensions: dimension name -> value
+    :param values: metric name -> value
+    :param units: metric name -> CloudWatch unit
+    :param properties: extra, non metric values to log with the record
+    :returns: the record dictionary
+    """
+    record = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRICS_NAMESPACE,
+                'Dimensions': [list(dimensions.keys())],
+                'Metrics': [{'Name': name, 'Unit': units.get(name, 'None')} for name in values],
+            }],
+        },
+    }
+    record.update(dimensions)
+    record.update(properties or {})
+    record.update(values)
+    return record
+
+class PasteMetrics:
+    """ Stage timings of a single sampled paste """
+
+    def __init__(self, pasteid):
+        self.pasteid = pasteid
+        self.stages = {}
+
+class InvocationMetrics:
+    """
+    Per-invocation stage timings and counters of a handler, emitted as one embedded metric format record
+
+    :param function_name: handler name used as the metric dimension
+    :param sink: record sink, the stdout sink by default
+    :param sample_rate: share of pastes emitting a per-paste record, PASTE_METRICS_SAMPLE_RATE by default
+    """
+
+    def __init__(self, function_name, sink=None, sample_rate=None):
+        self.function_name = function_name
+        self.sink = sink or _default_sink
+        if sample_rate is None:
+            sample_rate = float(os.environ.get(METRICS_SAMPLE_RATE_ENV, DEFAULT_SAMPLE_RATE))
+        self.sample_rate = sample_rate
+        self.stages = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def timer(self, stage, paste_metrics=None):
+        """ Add the time spent in the block to the stage total, and to the sampled paste if given """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.add_time(stage, elapsed)
+            if paste_metrics is not None:
+                paste_metrics.stages[stage] = paste_metrics.stages.get(stage, 0.0) + elapsed
+
+    def add_time(self, stage, elapsed):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + elapsed
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def sample_paste(self, pasteid):
+        """ Return a PasteMetrics collector for the paste if it is sampled, otherwise None """
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return PasteMetrics(pasteid)
+        return None
+
+    def emit_paste(self, paste_metrics, size=None):
+        """ Emit the stage timings of a sampled paste """
+        if paste_metrics is None:
+            return
+        values = {f"paste_{stage}_ms": elapsed * 1000 for stage, elapsed in paste_metrics.stages.items()}
+        units = {name: 'Milliseconds' for name in values}
+        properties = {'pasteid': paste_metrics.pasteid}
+        if size is not None:
+            properties['paste_size'] = size
+        self.sink.emit(embedded_metric_record({'FunctionName': self.function_name}, values, units, properties))
+
+    def flush(self):
+        """ Emit the invocation record with the stage totals and counters """
+        with self._lock:
+            values = {f"{stage}_ms": elapsed * 1000 for stage, elapsed in self.stages.items()}
+            units = {name: 'Milliseconds' for name in values}
+            for name, value in self.counters.items():
+                values[name] = value
+                units[name] = 'Bytes' if name.startswith('bytes') else 'Count'
+        values['invocation_ms'] = (time.perf_counter() - self._start) * 1000
+        units['invocation_ms'] = 'Milliseconds'
+        self.sink.emit(embedded_metric_record({'FunctionName': self.function_name}, values, units))
+
+class NullMetrics:
+    """ Metrics stand-in that records nothing, used when no metrics are passed """
+
+    @contextmanager
+    def timer(self, stage, paste_metrics=None):
+        yield
+
+    def add_time(self, stage, elapsed):
+        pass
+
+    def count(self, name, value=1):
+        pass
+
+    def sample_paste(self, pasteid):
+        return None
+
+    def emit_paste(self, paste_metrics, size=None):
+        pass
+
+    def flush(self):
+        pass
+
+NULL_METRICS = NullMetrics()
@@ -0,0 +1,261 @@
+import os
+import json
+import time
+import random
+import logging
+import threading
+import payload
+
+logger = logging.getLogger("pastehunter")
+
+# Kinesis Data Firehose PutRecordBatch limits
+FIREHOSE_MAX_BATCH_RECORDS = 500
+FIREHOSE_MAX_BATCH_BYTES = 4 * 1024 * 1024
+FIREHOSE_MAX_RECORD_BYTES = 1000 * 1024
+OUTPUT_MAX_RETRIES = 3
+OUTPUT_RETRY_BASE_DELAY_SEC = 0.1
+
+# 'firehose:<delivery stream name>', 'file:<path to JSON lines file>' or 'memory'; no output when not set
+OUTPUT_STREAM_ENV = 'PASTE_OUTPUT_STREAM'
+
+# compact separators and raw UTF-8 keep the scanned pastes small on the wire
+_encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False, default=str)
+
+_delivery_stream = None
+
+def encode_document(document):
+    """ Serialize an output document as a newline terminated compact JSON line """
+    return (_encoder.encode(document) + '\n').encode('utf-8')
+
+def truncate_document(document, max_bytes):
+    """
+    Serialize an output document over the size limit again with its paste body truncated to fit
+
+    Compressed bodies are decoded and stored truncated as plain text; the scan results are always kept whole.
+
+    :param document: JSON serializable output document, see payload.encode_raw_paste() for the body attributes
+    :param max_bytes: maximum size of the serialized document
+    :returns: the serialized truncated document, or None if it does not fit even without its body
+    """
+    if not document.get('raw_paste'):
+        return None
+
+    text = payload.decode_raw_paste(document)
+    document = {name: value for name, value in document.items() if name != 'raw_paste_encoding'}
+    document['raw_paste_truncated'] = True
+
+    # escaped characters take several bytes, so search for the longest body prefix that fits
+    fitting = None
+    low, high = 0, len(text)
+    while low <= high:
+        middle = (low + high) // 2
+        document['raw_paste'] = text[:middle]
+        data = encode_document(document)
+        if len(data) <= max_bytes:
+            fitting = data
+            low = middle + 1
+        else:
+            high = middle - 1
+    return fitting
+
+class FirehoseDeliveryStream:
+    """ Kinesis Data Firehose delivery stream; the boto3 client is created on first use """
+
+    def __init__(self, name):
+        self.name = name
+        self._client = None
+
+    def put_record_batch(self, records):
+        """
+        Put a batch of records
+
+        :param records: list of record payloads as bytes
+        :returns: list with the error code of every record, None for records that were stored
+        """
+        if self._client is None:
+            import boto3
+            self._client = boto3.client('firehose')
+
+        response = self._client.put_record_batch(DeliveryStreamName=self.name,
+                                                 Records=[{'Data': record} for record in records])
+        return [result.get('ErrorCode') for result in response['RequestResponses']]
+
+class MemoryDeliveryStream:
+    """
+    Local stand-in for a delivery stream keeping the put records in memory
+
+    :param failure_rate: share of records rejected with a 'ServiceUnavailableException', to exercise retries
+    """
+
+    def __init__(self, failure_rate=0.0):
+        self.failure_rate = failure_rate
+        self.records = []
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _accept(self, record):
+        self.records.append(record)
+
+    def put_record_batch(self, records):
+        if len(records) > FIREHOSE_MAX_BATCH_RECORDS or sum(len(r) for r in records) > FIREHOSE_MAX_BATCH_BYTES:
+            raise ValueError("Record batch exceeds the PutRecordBatch limits")
+
+        errors = []
+        with self._lock:
+            self.calls += 1
+            for record in records:
+                if len(record) > FIREHOSE_MAX_RECORD_BYTES:
+                    raise ValueError("Record exceeds the Firehose record size limit")
+                if self.failure_rate and random.random() < self.failure_rate:
+                    errors.append('ServiceUnavailableException')
+                else:
+                    self._accept(record)
+                    errors.append(None)
+        return errors
+
+class FileDeliveryStream(MemoryDeliveryStream):
+    """ Local stand-in for a delivery stream appending the put records to a JSON lines file """
+
+    def __init__(self, path, failure_rate=0.0):
+        super().__init__(failure_rate)
+        self.path = path
+
+    def _accept(self, record):
+        with open(self.path, 'ab') as f:
+            f.write(record)
+
+def get_delivery_stream():
+    """ Return the process level delivery stream selected by the PASTE_OUTPUT_STREAM variable, or None """
+    global _delivery_stream
+
+    if _delivery_stream is None:
+        backend = os.environ.get(OUTPUT_STREAM_ENV)
+        if not backend:
+            return None
+        if backend.startswith('firehose:'):
+            _delivery_stream = FirehoseDeliveryStream(backend[len('firehose:'):])
+        elif backend.startswith('file:'):
+            _delivery_stream = FileDeliveryStream(backend[len('file:'):])
+        else:
+            _delivery_stream = MemoryDeliveryStream()
+
+    return _delivery_stream
+
+class OutputBuffer:
+    """
+    Buffers output documents and sends them in batch puts
+
+    Documents are aggregated into newline delimited records up to the record size limit, and records are sent in
+    batches bounded by the record count and byte size limits of a batch put. Only the rejected records of a batch
+    are retried.
+
+    :param delivery_stream: destination with a put_record_batch(records) method, see FirehoseDeliveryStream
+    :param max_batch_records: maximum number of records per batch put
+    :param max_batch_bytes: maximum number of bytes per batch put
+    :param max_record_bytes: maximum size of an aggregated record
+    :param max_retries: maximum number of retries for rejected records
+    :param base_delay: backoff delay in seconds before the first retry
+    """
+
+    def __init__(self, delivery_stream, max_batch_records=FIREHOSE_MAX_BATCH_RECORDS,
+                 max_batch_bytes=FIREHOSE_MAX_BATCH_BYTES, max_record_bytes=FIREHOSE_MAX_RECORD_BYTES,
+                 max_retries=OUTPUT_MAX_RETRIES, base_delay=OUTPUT_RETRY_BASE_DELAY_SEC):
+        self.delivery_stream = delivery_stream
+        self.max_batch_records = max_batch_records
+        self.max_batch_bytes = max_batch_bytes
+        self.max_record_bytes = max_record_bytes
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.stats = {'documents': 0, 'records': 0, 'bytes': 0, 'calls': 0, 'retried': 0, 'failed': 0,
+                      'oversized': 0}
+        # aggregated record being filled, then the sealed records waiting for the next batch put
+        self._record = bytearray()
+        self._record_keys = []
+        self._pending = []
+        self._pending_bytes = 0
+
+    def add(self, key, document):
+        """
+        Buffer a document, sending a batch when the buffered records reach the batch limits
+
+        :param key: identifier reported back when the document could not be delivered
+        :param document: JSON serializable output document
+        :returns: list of keys of documents that failed delivery in a batch sent by this call
+        """
+        data = encode_document(document)
+        if len(data) > self.max_record_bytes:
+            self.stats['oversized'] += 1
+            size = len(data)
+            data = truncate_document(document, self.max_record_bytes)
+            if data is None:
+                logger.error(f"Output document {key} of {size} bytes exceeds the record size limit without its body")
+                self.stats['failed'] += 1
+                return [key]
+            logger.warning(f"Output document {key} of {size} bytes exceeds the record size limit, truncated its body")
+
+        self.stats['documents'] += 1
+        failed = []
+        if len(self._record) + len(data) > self.max_record_bytes:
+            failed = self._seal()
+        self._record += data
+        self._record_keys.append(key)
+        return failed
+
+    def _seal(self):
+        """ Move the aggregated record to the pending batch, sending the batch first if the record does not fit """
+        failed = []
+        if (len(self._pending) + 1 > self.max_batch_records
+                or self._pending_bytes + len(self._record) > self.max_batch_bytes):
+            failed = self._send()
+        self._pending.append((bytes(self._record), self._record_keys))
+        self._pending_bytes += len(self._record)
+        self._record = bytearray()
+        self._record_keys = []
+        return failed
+
+    def _send(self):
+        """ Put the pending records, retrying the rejected ones with backoff; returns the keys that failed """
+        batch = self._pending
+        self._pending = []
+        self._pending_bytes = 0
+
+        attempt = 0
+        while batch:
+            self.stats['calls'] += 1
+            try:
+                errors = self.delivery_stream.put_record_batch([record for record, _ in batch])
+            except Exception as e:
+                logger.error(f"Output batch put failed: {e}")
+                errors = [type(e).__name__] * len(batch)
+
+            rejected = [entry for entry, error in zip(batch, errors) if error is not None]
+            self.stats['records'] += len(batch) - len(rejected)
+            self.stats['bytes'] += sum(len(record) for (record, _), error in zip(batch, errors) if error is None)
+            if not rejected:
+                return []
+
+            if attempt >= self.max_retries:
+                keys = [key for _, keys in rejected for key in keys]
+                logger.error(f"Giving up on {len(keys)} output documents after {attempt} retries")
+                self.stats['failed'] += len(keys)
+                return keys
+
+            self.stats['retried'] += len(rejected)
+            time.sleep(random.uniform(0, self.base_delay * (2 ** attempt)))
+            attempt += 1
+            batch = rejected
+
+        return []
+
+    def flush(self):
+        """
+        Send all buffered documents
+
+        :returns: list of keys of documents that failed delivery
+        """
+        failed = []
+        if self._record_keys:
+            failed = self._seal()
+        if self._pending:
+            failed += self._send()
+        return failed
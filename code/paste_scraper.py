@@ -0,0 +1,146 @@
+import os
+import time
+import logging
+import importlib
+import threading
+import boto3
+from concurrent.futures import ThreadPoolExecutor
+import common
+import ddbwriter
+import httpclient
+import scrapestate
+import metrics as pipeline_metrics
+
+# paste items of all inputs go to the one table streamed to the collector
+table_name = os.environ.get('PASTE_TABLE_NAME') or os.environ.get('PASTEBIN_TABLE_NAME')
+# optional comma separated list restricting the enabled inputs polled by this function
+SCRAPER_INPUTS_ENV = 'PASTE_SCRAPER_INPUTS'
+
+# every run writes to the paste table, so the resource is created during the init phase
+_ddb = boto3.resource('dynamodb')
+# PasteHunter input modules, imported once per container
+_input_modules = {}
+_input_modules_lock = threading.Lock()
+
+logger = logging.getLogger("pastehunter")
+
+def enabled_inputs(conf, names=None):
+    """
+    Return the names of the inputs enabled in the PasteHunter config
+
+    :param conf: PasteHunter config
+    :param names: optional list of input names to restrict the result to
+    :returns: sorted list of input names
+    """
+    inputs = [name for name, input_conf in conf.get('inputs', {}).items() if input_conf.get('enabled')]
+    if names:
+        inputs = [name for name in inputs if name in names]
+    return sorted(inputs)
+
+def load_input_module(name, input_conf):
+    """
+    Import the PasteHunter input script of an input
+
+    :param name: input name in the PasteHunter config
+    :param input_conf: the PasteHunter 'inputs.<name>' settings, 'module' names the script
+    :returns: the input module, with a 'recent_pastes(conf, input_history)' function
+    """
+    module_name = 'PasteHunter.' + input_conf.get('module', 'inputs.' + name)
+    with _input_modules_lock:
+        module = _input_modules.get(module_name)
+        if module is None:
+            module = importlib.import_module(module_name)
+            _input_modules[module_name] = module
+
+    return module
+
+def _next_state(pastes, listed_ids, state, limit):
+    """ Drop the pastes stored by earlier runs and return them with the scraper state for the next run """
+    if limit is not None and all('date' in paste for paste in pastes):
+        return scrapestate.filter_new_pastes(pastes, listed_ids, state, limit)
+
+    # inputs without paste dates or listing limit only rely on the ids of the previous listing
+    return pastes, {'seen_ids': list(listed_ids) if listed_ids else state.get('seen_ids', [])}
+
+def poll_input(name, conf, state_store):
+    """
+    List the recent pastes of one input
+
+    :param name: input name in the PasteHunter config
+    :param conf: PasteHunter config; the listing limit of the input is updated from its scraper state
+    :param state_store: scraper state store, see scrapestate.get_state_store()
+    :returns: tuple of (prepared new paste items, scraper state to save once they are stored, stats dictionary)
+    """
+    start = time.perf_counter()
+    input_conf = conf['inputs'][name]
+    state = state_store.load(name)
+
+    limit = state.get('limit', input_conf.get('paste_limit'))
+    if limit is not None:
+        input_conf['paste_limit'] = limit
+
+    module = load_input_module(name, input_conf)
+    # the input scripts call requests.get() directly, which opens a new connection on every call
+    with httpclient.pooled_requests(module):
+        pastes, listed_ids = module.recent_pastes(conf, state.get('seen_ids', []))
+    pastes, state = _next_state(pastes, listed_ids, state, limit)
+    prepared_pastes = common.prepare_paste_items(pastes, confname=name)
+
+    stats = {'listed': len(listed_ids), 'new': len(prepared_pastes),
+             'latency_ms': (time.perf_counter() - start) * 1000}
+    logger.info(f"Input {name} listed {stats['listed']} pastes, {stats['new']} new in {stats['latency_ms']:.0f} ms")
+    return prepared_pastes, state, stats
+
+def main(event, context):
+    """
+    Poll every enabled PasteHunter input concurrently and store their new paste items in one batched write
+
+    A failing input does not stop the others; its scraper state is left unchanged so the next run lists it again.
+    """
+    metrics = pipeline_metrics.InvocationMetrics('paste_scraper')
+
+    conf = common.parse_pastehunter_config()
+    if not conf:
+        raise Exception("Error: failed to parse config settings file")
+
+    selected = [name for name in os.environ.get(SCRAPER_INPUTS_ENV, '').split(',') if name]
+    inputs = enabled_inputs(conf, selected)
+    state_store = scrapestate.get_state_store()
+
+    polled = {}
+    input_stats = {}
+    if inputs:
+        with metrics.timer('fetch'), ThreadPoolExecutor(max_workers=len(inputs)) as executor:
+            futures = {name: executor.submit(poll_input, name, conf, state_store) for name in inputs}
+            for name, future in futures.items():
+                try:
+                    pastes, state, stats = future.result()
+                except Exception as e:
+                    logger.error(f"Input {name} failed: {e}")
+                    input_stats[name] = {'listed': 0, 'new': 0, 'error': str(e)}
+                    metrics.count(f"{name}_errors")
+                    continue
+                polled[name] = (pastes, state)
+                input_stats[name] = stats
+                metrics.add_time(f"fetch_{name}", stats['latency_ms'] / 1000)
+                metrics.count(f"{name}_listed", stats['listed'])
+                metrics.count(f"{name}_new", stats['new'])
+
+    prepared_pastes = [paste for pastes, _ in polled.values() for paste in pastes]
+    write_stats = {'written': 0, 'duplicates': 0, 'throttled': 0, 'failed': 0}
+    if prepared_pastes:
+        with metrics.timer('output'):
+            write_stats = ddbwriter.batch_write_items(_ddb, table_name, prepared_pastes, key='key')
+        logger.info(f"Stored pastes: {write_stats}")
+
+    # the write is not attributed per input, so no high-water mark moves while any paste failed to store
+    if write_stats['failed'] == 0:
+        for name, (_, state) in polled.items():
+            state_store.save(name, state)
+
+    metrics.count('pastes_new', len(prepared_pastes))
+    for name, value in write_stats.items():
+        metrics.count(f"pastes_{name}", value)
+    metrics.flush()
+
+    return {'status_code': 200, 'paste_count': len(prepared_pastes), 'inputs': input_stats, **write_stats}
@@ -1,25 +1,183 @@
-import os
-import json
+import time
 import logging
-import requests
-import boto3
 import common
+import deadletter
+import fetcher
 import pastescanner
-import PasteHunter.inputs.pastebin as pb
-
-ddb = boto3.resource('dynamodb')
-table = ddb.Table(os.environ['PASTEBIN_TABLE_NAME'])
-_lambda = boto3.client('lambda')
+import retryqueue
+import scheduler
+import scanpool
+import httpclient
+import outputsink
+import metrics as pipeline_metrics
 
 logger = logging.getLogger("pastehunter-serverless")
 
 def main(event, context):
-    conf = common.parse_config()
+    deadline = scheduler.Deadline(context)
+    metrics = pipeline_metrics.InvocationMetrics('pastebin_collector')
+    http_stats = httpclient.get_http_stats()
+
+    conf = common.parse_pastehunter_config()
     if not conf:
         raise Exception("Error: failed to parse config settings file")
 
     # reproduce the original format of the paste item to preserve existing logic for retrieval and post processing
-    paste_data_records = common.unpack_ddb_paste_records(event['Records'])
+    with metrics.timer('decode'):
+        paste_data_records = common.unpack_ddb_paste_records(event['Records'])
     for paste_data in paste_data_records:
+        paste_data.setdefault('confname', 'pastebin')
+        paste_data.setdefault('pastesite', 'pastebin.com')
+
+    # pick up deferred pastes from earlier invocations whose retry is due
+    retry_queue = retryqueue.get_retry_queue()
+    retry_attempts = {}
+    for paste_data, attempt in retry_queue.pop_due():
+        paste_data_records.append(paste_data)
+        retry_attempts[paste_data['pasteid']] = attempt
+
+    # failures are isolated per record: a failed stream record counts a failed attempt for itself only
+    sequence_numbers = common.ddb_record_sequence_numbers(event['Records'])
+    dead_letter_store = deadletter.get_dead_letter_store()
+    failed_sequence_numbers = []
+    # a paste may come in several records of the batch, which share the sequence number of the first one
+    handled_sequence_numbers = set()
+
+    def record_failed(paste_data, error):
+        sequence_number = sequence_numbers.get(paste_data['pasteid'])
+        if sequence_number in handled_sequence_numbers:
+            return
+        if sequence_number is None:
+            # deferred retries are not part of the stream batch and cannot be replayed by it
+            dead_letter_store.put(f"retry#{paste_data['pasteid']}", paste_data, error,
+                                  retry_attempts.get(paste_data['pasteid'], 1))
+        else:
+            handled_sequence_numbers.add(sequence_number)
+            if deadletter.handle_failure(dead_letter_store, sequence_number, paste_data, error):
+                failed_sequence_numbers.append(sequence_number)
+
+    # fetch the records of the batch concurrently and hand each paste to the scan pool as soon as its content arrives;
+    # only the records estimated to fit before the deadline are taken, in sequence order, then fetched by priority
+    record_order = {id(paste_data): i for i, paste_data in enumerate(paste_data_records)}
+    paste_data_records, unprocessed = scheduler.plan_batch(paste_data_records, deadline, sequence_numbers)
+    scan_executor = scanpool.get_scan_executor()
+    # load the compiled rules once before the scan workers share them
+    with metrics.timer('rule_load'):
+        pastescanner.load_rule_tiers(conf)
+
+    def timed_fetch(paste_data, conf):
+        with metrics.timer('fetch'):
+            return pastescanner.fetch_paste(paste_data, conf)
+
+    def scan_before_deadline(paste_data, raw_paste_data):
+        if not deadline.allows(paste_data):
+            if hasattr(raw_paste_data, 'close'):
+                raw_paste_data.close()
+            raise scheduler.DeadlineReached(paste_data['pasteid'])
+        return pastescanner.post_process_paste(paste_data, conf, raw_paste_data, metrics)
+
+    scans = []
+    scanned_count = 0
+    deferred_count = 0
+    for paste_data, raw_paste_data, error in fetcher.fetch_pastes(paste_data_records, conf, timed_fetch,
+                                                                  should_fetch=deadline.allows):
+        if isinstance(error, fetcher.FetchSkipped):
+            unprocessed.append(paste_data)
+            continue
+        elif isinstance(error, pastescanner.PasteNotReadyError):
+            # not ready yet is retried with backoff on the retry queue, without spending attempts of the stream
+            # record; pastes out of retries are dead-lettered
+            attempt = retry_attempts.get(paste_data['pasteid'], 0) + 1
+            if retryqueue.defer_paste(retry_queue, paste_data, attempt,
+                                      base_delay=pastescanner.PASTEBIN_CACHE_RETRY_PERIOD_SEC,
+                                      max_attempts=pastescanner.PASTEBIN_CACHE_RETRY_COUNT):
+                deferred_count += 1
+            else:
+                record_failed(paste_data, error)
+            continue
+        elif error is not None:
+            logger.error("Unable to fetch raw paste : {0} - {1}".format(paste_data['pasteid'], error))
+            record_failed(paste_data, error)
+            continue
+
+        future = scan_executor.submit(scan_before_deadline, paste_data, raw_paste_data)
+        scans.append((record_order[id(paste_data)], paste_data, future))
+
+    # reassemble the scan results in record order; pastes with matches are buffered for the output stream
+    delivery_stream = outputsink.get_delivery_stream()
+    output_buffer = outputsink.OutputBuffer(delivery_stream) if delivery_stream is not None else None
+    # scanned pastes are kept per record and identified to the output buffer by their position and paste id
+    scanned = []
+    failed_outputs = []
+    for _, paste_data, future in sorted(scans, key=lambda scan: scan[0]):
+        try:
+            future.result()
+        except scheduler.DeadlineReached:
+            unprocessed.append(paste_data)
+            continue
+        except Exception as e:
+            logger.error("Unable to post process paste : {0} - {1}".format(paste_data['pasteid'], e))
+            record_failed(paste_data, e)
+            continue
+
+        scanned_count += 1
+        scanned.append(paste_data)
+        if output_buffer is not None and 'YaraRule' in paste_data:
+            with metrics.timer('output'):
+                failed_outputs += output_buffer.add((len(scanned) - 1, paste_data['pasteid']), paste_data)
+
+    if output_buffer is not None:
+        with metrics.timer('output'):
+            failed_outputs += output_buffer.flush()
+        for name, value in output_buffer.stats.items():
+            metrics.count('bytes_output' if name == 'bytes' else f"output_{name}", value)
+
+    # undelivered pastes are retried through the stream like failed scans
+    for index, _ in failed_outputs:
+        record_failed(scanned[index], Exception("Output delivery failed"))
+    for paste_data in scanned:
+        sequence_number = sequence_numbers.get(paste_data['pasteid'])
+        if sequence_number is not None and sequence_number not in handled_sequence_numbers:
+            dead_letter_store.clear(sequence_number)
+
+    failed_count = len(failed_sequence_numbers)
+    # checkpoint the pastes cut off by the deadline: stream records are reported back without counting as a failed
+    # attempt; deferred retries go back on the retry queue
+    for paste_data in unprocessed:
+        if paste_data['pasteid'] in sequence_numbers:
+            failed_sequence_numbers.append(sequence_numbers[paste_data['pasteid']])
+        else:
+            retry_queue.put(paste_data, retry_attempts.get(paste_data['pasteid'], 1), time.time())
+    if unprocessed:
+        logger.warning(f"Deadline reached, checkpointed {len(unprocessed)} unprocessed pastes")
+
+    # Lambda resumes the batch from the lowest reported sequence number and replays every later record,
+    # including the pastes scanned after it
+    checkpoint = min(failed_sequence_numbers, key=int) if failed_sequence_numbers else None
+    replayed_count = 0
+    if checkpoint is not None:
+        replayed_count = sum(1 for paste_data in scanned if paste_data['pasteid'] in sequence_numbers
+                             and int(sequence_numbers[paste_data['pasteid']]) > int(checkpoint))
+    if replayed_count:
+        logger.warning(f"{replayed_count} scanned pastes follow the checkpoint and will be replayed")
+
+    fetched_stats = httpclient.get_http_stats()
+    metrics.count('records', len(event['Records']))
+    metrics.count('pastes_scanned', scanned_count)
+    metrics.count('pastes_deferred', deferred_count)
+    metrics.count('pastes_failed', failed_count)
+    metrics.count('pastes_unprocessed', len(unprocessed))
+    metrics.count('pastes_replayed', replayed_count)
+    metrics.count('bytes_fetched', fetched_stats['bytes_received'] - http_stats['bytes_received'])
+    metrics.count('bytes_transferred', fetched_stats['bytes_transferred'] - http_stats['bytes_transferred'])
+    metrics.flush()
 
-        
\ No newline at end of file
+    return {
+        'status_code': 200,
+        'paste_count': scanned_count,
+        'deferred_count': deferred_count,
+        'unprocessed_count': len(unprocessed),
+        'failed_count': failed_count,
+        'replayed_count': replayed_count,
+        'batchItemFailures': [{'itemIdentifier': checkpoint}] if checkpoint is not None else [],
+    }
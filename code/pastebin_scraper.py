@@ -1,32 +1,53 @@
 import os
 import json
 import logging
-import requests
 import boto3
 import common
+import ddbwriter
+import scrapestate
+import metrics as pipeline_metrics
 import PasteHunter.inputs.pastebin as pb
 
-ddb = boto3.resource('dynamodb')
 table_name = os.environ['PASTEBIN_TABLE_NAME']
-table = ddb.Table(table_name)
-#_lambda = boto3.client('lambda')
+# every run writes to the paste table, so the resource is created during the init phase
+_ddb = boto3.resource('dynamodb')
 
 logger = logging.getLogger("pastehunter-serverless")
 
 def main(event, context):
-    conf = common.parse_config()
+    metrics = pipeline_metrics.InvocationMetrics('pastebin_scraper')
+
+    conf = common.parse_pastehunter_config()
     if not conf:
         raise Exception("Error: failed to parse config settings file")
     
-    # we ignore history but it is required for PB inputs script
-    dummy_history = []
-    pastes, _ = pb.recent_pastes(conf, dummy_history)
+    # pastes seen by the previous run are skipped by the PB inputs script through its history argument
+    state_store = scrapestate.get_state_store()
+    state = state_store.load('pastebin')
+    limit = state.get('limit', conf['inputs']['pastebin']['paste_limit'])
+    conf['inputs']['pastebin']['paste_limit'] = limit
+    with metrics.timer('fetch'):
+        pastes, listed_ids = pb.recent_pastes(conf, state.get('seen_ids', []))
+    pastes, state = scrapestate.filter_new_pastes(pastes, listed_ids, state, limit)
 
+    write_stats = {'written': 0, 'duplicates': 0, 'throttled': 0, 'failed': 0}
     if len(pastes) > 0:
         logger.debug(f"Received {len(pastes)} from pastebin.com")
         
-        prepared_pastes = common.prepare_paste_items(pastes)
-        for paste in prepared_pastes:
-            table.put_item(Item=paste, ConditionExpression='attribute_not_exists(Id)')
+        with metrics.timer('decode'):
+            prepared_pastes = common.prepare_paste_items(pastes)
+        with metrics.timer('output'):
+            write_stats = ddbwriter.batch_write_items(_ddb, table_name, prepared_pastes)
+        logger.info(f"Stored pastes: {write_stats}")
+
+    # only move the high-water mark once the pastes below it are stored
+    if write_stats['failed'] == 0:
+        state_store.save('pastebin', state)
     
-    return {'status_code': 200, 'paste_count': len(pastes)}
\ No newline at end of file
+    metrics.count('pastes_listed', len(listed_ids))
+    metrics.count('pastes_new', len(pastes))
+    for name, value in write_stats.items():
+        metrics.count(f"pastes_{name}", value)
+    metrics.flush()
+
+    return {'status_code': 200, 'paste_count': len(pastes), **write_stats}
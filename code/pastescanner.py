@@ -5,28 +5,55 @@ import hashlib
 import time
 import json
 import logging
-import yara
 import requests
 import datetime
 from urllib.parse import unquote_plus
-from common import load_yara_rules
+import resultcache
+import largepaste
+import gists
+import postregistry
+import payload
+import metrics as pipeline_metrics
+from common import load_yara_rules, load_yara_rule_bundles, yara_rules_version
 
 logger = logging.getLogger("pastehunter")
 
 PASTEBIN_CACHE_RETRY_PERIOD_SEC = 5
 PASTEBIN_CACHE_RETRY_COUNT = 3
+PASTEBIN_FETCH_ATTEMPTS = 3
+PASTEBIN_NOT_READY_MESSAGE = "File is not ready for scraping yet. Try again in 1 minute."
 
-def paste_scanner(paste_data, conf):
+class PasteNotReadyError(Exception):
+    """ Raised when the paste site has not cached the paste content yet and the fetch should be retried later """
+    pass
+
+def paste_scanner(paste_data, conf, raw_paste_data=None):
     """ 
     Modified version of the original 'paste_scanner()' function from the original PasteHunter project 
     
     :param paste_data: the paste item metadata dictionary
     :param conf: the PasteHunter configuration dictionary
-    :returns: None
+    :param raw_paste_data: the already fetched paste content; fetched here when not given
+    :returns: the post processed paste item
     """
 
     logger.debug("Found New {0} paste {1}".format(paste_data['pastesite'], paste_data['pasteid']))
 
+    if raw_paste_data is None:
+        raw_paste_data = fetch_paste(paste_data, conf)
+
+    final_paste = post_process_paste(paste_data, conf, raw_paste_data)
+    return final_paste
+
+def fetch_paste(paste_data, conf):
+    """
+    Retrieve the raw content of a paste item using the retriever for its paste site
+
+    :param paste_data: the paste item metadata dictionary
+    :param conf: the PasteHunter configuration dictionary
+    :returns: the raw paste data, or None if no retriever is implemented for the paste site
+    """
+    raw_paste_data = None
     if paste_data['confname'] == 'pastebin':
         raw_paste_data = pastebin_scanner(paste_data, conf)
     elif paste_data['confname'] == 'gists':
@@ -35,9 +62,9 @@ def paste_scanner(paste_data, conf):
         raw_paste_data = stackexchange_scanner(paste_data, conf)
     else:
         # not implemented
-        logger.debug("Paste scanner not implemented for pastesite = {paste_data['confname']}")
+        logger.debug(f"Paste scanner not implemented for pastesite = {paste_data['confname']}")
 
-    final_paste = post_process_paste(paste_data, conf, raw_paste_data)
+    return raw_paste_data
 
 def pastebin_scanner(paste_data, conf):
     """
@@ -45,15 +72,18 @@ def pastebin_scanner(paste_data, conf):
 
     :param paste_data: PasteBin paste item metadata dictionary
     :param conf: the PasteHunter configuration dictionary
-    :returns: the raw paste data from Pastebin.com
+    :returns: the raw paste data from Pastebin.com, as a LargePaste for bodies above the large paste threshold
+    :raises PasteNotReadyError: when Pastebin has not cached the paste yet; the caller defers the retry
     """
     logger.debug(f"Processing paste as 'pastebin' item for pastid = {paste_data['pasteid']}")
 
+    raw_paste_data = ""
     retry_count = 0
-    while retry_count < PASTEBIN_CACHE_RETRY_COUNT:
+    while retry_count < PASTEBIN_FETCH_ATTEMPTS:
+        raw_paste_data = None
         try:
             raw_paste_uri = paste_data['scrape_url']
-            raw_paste_data = requests.get(raw_paste_uri).text
+            raw_paste_data = largepaste.fetch_paste_body(raw_paste_uri)
 
         # Cover fetch site SSLErrors
         except requests.exceptions.SSLError as e:
@@ -62,23 +92,28 @@ def pastebin_scanner(paste_data, conf):
         
         # General Exception 
         except Exception as e:
+            # the caller retries failed fetches and dead-letters them once out of attempts
             logger.error("Unable to scan raw paste : {0} - {1}".format(paste_data['pasteid'], e))
-            raw_paste_data = ""
+            if hasattr(raw_paste_data, 'close'):
+                raw_paste_data.close()
+            raise
 
         # Pastebin Cache
-        if raw_paste_data == "File is not ready for scraping yet. Try again in 1 minute.":
-            logger.info("Paste is still cached sleeping to try again")
-            time.sleep(PASTEBIN_CACHE_RETRY_PERIOD_SEC)
+        if raw_paste_data == PASTEBIN_NOT_READY_MESSAGE:
+            logger.info(f"Paste {paste_data['pasteid']} is still cached, deferring retry")
+            raise PasteNotReadyError(paste_data['pasteid'])
 
         retry_count += 1
         
         if raw_paste_data and len(raw_paste_data) > 0:
             return raw_paste_data
 
+    return raw_paste_data
+
 
 def gists_scanner(paste_data, conf):
     """
-    Github gists specific retriever that retrieves the paste item content based on the 'scrape_url' value
+    Github gists specific retriever that retrieves the content of all files of the gist with id 'pasteid'
 
     :param paste_data: PasteBin paste item metadata dictionary
     :param conf: the PasteHunter configuration dictionary
@@ -86,7 +121,11 @@ def gists_scanner(paste_data, conf):
     """
     logger.debug(f"Processing paste as 'gists' item for pastid = {paste_data['pasteid']}")
 
-    return ""
+    try:
+        return gists.fetch_gist(paste_data['pasteid'], conf['inputs'].get('gists', {}))
+    except gists.GistNotFoundError:
+        logger.info(f"Gist {paste_data['pasteid']} no longer exists")
+        return ""
 
 def stackexchange_scanner(paste_data, conf):
     """
@@ -110,32 +149,140 @@ def stackexchange_scanner(paste_data, conf):
         del paste_data['body']
     return raw_paste_data
 
-def post_process_paste(paste_data, conf, raw_paste_data):
+def load_rule_tiers(conf):
     """
-    Post processing includes checking paste against all active Yara rules for content of interest
+    Load the compiled rules as a list of tiers: the single 'index.yar' rule set, or the first pass rules
+    followed by the rule bundles configured in the PasteHunter 'yara.bundles' setting
 
-    :param paste_data: PasteBin paste item metadata dictionary
     :param conf: the PasteHunter configuration dictionary
-    :returns: None
+    :returns: tuple of ([(bundle name, Yara Rules, bundle settings)], rule set version)
     """
+    bundles = conf['yara'].get('bundles')
+    if bundles:
+        return load_yara_rule_bundles(bundles)
+
     rules = load_yara_rules()
-    try:
-        matches = rules.match(data=raw_paste_data)
-    except Exception as e:
-        logger.error("Unable to scan raw paste : {0} - {1}".format(paste_data['pasteid'], e))
-
-    results = []
-    for match in matches:
-        # For keywords get the word from the matched string
-        if match.rule == 'core_keywords' or match.rule == 'custom_keywords':
-            for s in match.strings:
-                rule_match = s[1].lstrip('$')
-                if rule_match not in results:
-                    results.append(rule_match)
-            results.append(str(match.rule))
-        # Else use the rule name
+    return [(None, rules, {})], yara_rules_version()
+
+def _bundle_selected(bundle, paste_data, size, first_pass_hits):
+    """ Check the optional syntax, size and first pass hit gates of a rule bundle """
+    if 'syntax' in bundle and paste_data.get('syntax') not in bundle['syntax']:
+        return False
+    if 'min_size' in bundle and size < bundle['min_size']:
+        return False
+    if 'max_size' in bundle and size > bundle['max_size']:
+        return False
+    if 'requires' in bundle and not any(rule in first_pass_hits for rule in bundle['requires']):
+        return False
+    return True
+
+def rule_tiers_signature(rule_tiers, paste_data):
+    """
+    Return the names of the gated rule bundles the paste metadata lets through, part of the result cache key
+
+    Only the syntax gate depends on paste metadata; the size and first pass hit gates depend on the content, which
+    the cache is already keyed on.
+
+    :param rule_tiers: list of (bundle name, Yara Rules, bundle settings), see load_rule_tiers()
+    :param paste_data: the paste item metadata dictionary
+    :returns: comma separated bundle names, empty for a single rule set
+    """
+    return ','.join(name for name, _, bundle in rule_tiers[1:]
+                    if 'syntax' not in bundle or paste_data.get('syntax') in bundle['syntax'])
+
+def match_rule_tiers(rule_tiers, paste_data, raw_paste_data, size=None):
+    """
+    Match a paste against the first rule tier, then against every following tier whose gates let it through
+
+    :param rule_tiers: list of (bundle name, Yara Rules, bundle settings), see load_rule_tiers()
+    :param paste_data: the paste item metadata dictionary
+    :param raw_paste_data: the paste content as text, or a LargePaste spooled to disk
+    :param size: size of the paste in bytes, checked by the size gates of the bundles
+    :returns: list of Yara matches
+    """
+    large_paste = isinstance(raw_paste_data, largepaste.LargePaste)
+    if size is None:
+        size = len(raw_paste_data) if large_paste else len(raw_paste_data.encode('utf-8'))
+
+    matches = []
+    first_pass_hits = None
+    for name, rules, bundle in rule_tiers:
+        if first_pass_hits is not None and not _bundle_selected(bundle, paste_data, size, first_pass_hits):
+            continue
+
+        if large_paste:
+            matches.extend(raw_paste_data.match(rules))
         else:
-            results.append(match.rule)
+            matches.extend(rules.match(data=raw_paste_data))
+
+        if first_pass_hits is None:
+            first_pass_hits = set(match.rule for match in matches)
+
+    return matches
+
+def post_process_paste(paste_data, conf, raw_paste_data, metrics=pipeline_metrics.NULL_METRICS):
+    """
+    Post processing includes checking paste against all active Yara rules for content of interest
+
+    :param paste_data: PasteBin paste item metadata dictionary
+    :param conf: the PasteHunter configuration dictionary
+    :param raw_paste_data: the paste content as text, or a LargePaste spooled to disk
+    :param metrics: invocation metrics receiving the rule load, hash, match and post process timings
+    :returns: the paste item with scan results
+    """
+    paste_metrics = metrics.sample_paste(paste_data['pasteid'])
+    with metrics.timer('rule_load', paste_metrics):
+        rule_tiers, rules_version = load_rule_tiers(conf)
+
+    # large pastes were hashed while streamed to disk and are scanned from the spool file
+    large_paste = isinstance(raw_paste_data, largepaste.LargePaste)
+    if large_paste:
+        encoded_paste_data = None
+        sha256 = raw_paste_data.sha256
+        size = raw_paste_data.size
+    else:
+        with metrics.timer('hash', paste_metrics):
+            encoded_paste_data = raw_paste_data.encode('utf-8')
+            sha256 = hashlib.sha256(encoded_paste_data).hexdigest()
+        size = len(encoded_paste_data)
+
+    # identical paste bodies are scanned once per compiled rule set version, post process configuration and
+    # selection of gated bundles
+    result_cache = resultcache.get_result_cache()
+    registry = postregistry.get_registry(conf)
+    signature = rule_tiers_signature(rule_tiers, paste_data)
+    cache_key = f"{sha256}-{registry.digest}-{signature}" if signature else f"{sha256}-{registry.digest}"
+    cached_result = result_cache.get(cache_key, rules_version)
+
+    cache_hit = cached_result is not None
+    if cache_hit:
+        metrics.count('result_cache_hits')
+        results = list(cached_result['results'])
+    else:
+        try:
+            with metrics.timer('match', paste_metrics):
+                matches = match_rule_tiers(rule_tiers, paste_data, raw_paste_data, size)
+        except Exception as e:
+            # a failed scan is neither cached nor reported as a paste without matches; the caller retries it
+            logger.error("Unable to scan raw paste : {0} - {1}".format(paste_data['pasteid'], e))
+            if large_paste:
+                raw_paste_data.close()
+            raise
+
+        results = []
+        for match in matches:
+            # For keywords get the word from the matched string
+            if match.rule == 'core_keywords' or match.rule == 'custom_keywords':
+                for s in match.strings:
+                    rule_match = s[1].lstrip('$')
+                    if rule_match not in results:
+                        results.append(rule_match)
+                results.append(str(match.rule))
+            # Else use the rule name
+            else:
+                results.append(match.rule)
+
+        cached_result = {'results': list(results), 'MD5': None, 'post_process': {}}
 
     # Store all OverRides other options. 
     paste_site = paste_data['confname']
@@ -155,17 +302,19 @@ def post_process_paste(paste_data, conf, raw_paste_data):
     # Post Process
 
     # If post module is enabled and the paste has a matching rule.
+    # Post module output only depends on the paste content, so cached output is re-attached on a cache hit.
     post_results = paste_data
-    for post_process, post_values in conf["post_process"].items():
-        if post_values["enabled"]:
-            if any(i in results for i in post_values["rule_list"]) or "ALL" in post_values["rule_list"]:
-                if not blacklisted:
-                    logger.info("Running Post Module {0} on {1}".format(post_values["module"], paste_data["pasteid"]))
-                    post_module = importlib.import_module(post_values["module"])
-                    post_results = post_module.run(results,
-                                                    raw_paste_data,
-                                                    paste_data
-                                                    )
+    if cache_hit:
+        post_results.update(cached_result['post_process'])
+    else:
+        metadata = dict(paste_data)
+        if not blacklisted and registry.select(results):
+            with metrics.timer('post_process', paste_metrics):
+                # post modules get the whole body; large pastes are only read into memory for them
+                paste_text = raw_paste_data.read_text() if large_paste else raw_paste_data
+                post_results = registry.run(results, paste_text, paste_data, encoded_paste_data)
+        cached_result['post_process'] = {k: v for k, v in post_results.items()
+                                         if k not in metadata or metadata[k] is not v}
 
     # Throw everything back to paste_data for ease.
     paste_data = post_results
@@ -181,14 +330,24 @@ def post_process_paste(paste_data, conf, raw_paste_data):
             
     if len(results) > 0:
 
-        encoded_paste_data = raw_paste_data.encode('utf-8')
-        md5 = hashlib.md5(encoded_paste_data).hexdigest()
-        sha256 = hashlib.sha256(encoded_paste_data).hexdigest()
-        paste_data['MD5'] = md5
+        if cached_result['MD5'] is None:
+            if large_paste:
+                cached_result['MD5'] = raw_paste_data.md5
+            else:
+                cached_result['MD5'] = hashlib.md5(encoded_paste_data).hexdigest()
+        paste_data['MD5'] = cached_result['MD5']
         paste_data['SHA256'] = sha256
-        paste_data['raw_paste'] = raw_paste_data
+        with metrics.timer('encode', paste_metrics):
+            payload.encode_raw_paste(paste_data, raw_paste_data, sha256, encoded_paste_data, payload.get_blob_store())
         paste_data['YaraRule'] = results
-        # Set the size for all pastes - This will override any size set by the source
-        paste_data['size'] = len(raw_paste_data)
+        # Set the size in bytes for all pastes - This will override any size set by the source
+        paste_data['size'] = size
+
+    if not cache_hit:
+        result_cache.put(cache_key, rules_version, cached_result)
+
+    if large_paste:
+        raw_paste_data.close()
 
+    metrics.emit_paste(paste_metrics, size)
     return paste_data
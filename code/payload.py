@@ -0,0 +1,194 @@
+import os
+import zlib
+import base64
+import logging
+import threading
+import largepaste
+
+logger = logging.getLogger("pastehunter")
+
+# bodies above this size are stored zlib compressed and base64 encoded in 'raw_paste'
+PAYLOAD_COMPRESS_THRESHOLD = int(os.environ.get('PASTE_PAYLOAD_COMPRESS_BYTES', 4 * 1024))
+# bodies above this size are moved to the blob store, leaving their SHA256 in 'raw_paste_ref'
+PAYLOAD_OFFLOAD_THRESHOLD = int(os.environ.get('PASTE_PAYLOAD_OFFLOAD_BYTES', 64 * 1024))
+PAYLOAD_COMPRESS_LEVEL = int(os.environ.get('PASTE_PAYLOAD_COMPRESS_LEVEL', 1))
+
+# 's3:<bucket>[/<prefix>]' or 'file:<folder>'; without a blob store large bodies are truncated as before
+BLOB_STORE_ENV = 'PASTE_BLOB_STORE'
+
+# values of the 'raw_paste_encoding' attribute; plain text bodies have no encoding attribute
+ENCODING_ZLIB = 'zlib'
+ENCODING_BLOB = 'blob'
+
+_blob_store = None
+
+class FileBlobStore:
+    """ Local stand-in for the blob store, one file per blob below the given folder """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def put(self, key, chunks):
+        # write to a temporary name first so readers never see a partial blob
+        path = self._path(key)
+        with open(path + '.tmp', 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(path + '.tmp', path)
+
+    def get(self, key):
+        with open(self._path(key), 'rb') as f:
+            return f.read()
+
+class S3BlobStore:
+    """ Blob store in an S3 bucket; the boto3 client is created on first use """
+
+    def __init__(self, bucket, prefix=''):
+        self.bucket = bucket
+        self.prefix = prefix
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3
+            self._client = boto3.client('s3')
+        return self._client
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.prefix + key)
+            return True
+        except Exception:
+            return False
+
+    def put(self, key, chunks):
+        self.client.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=b''.join(chunks))
+
+    def get(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)['Body'].read()
+
+class CachingBlobStore:
+    """ Remembers the blobs known to exist, so reposted bodies are not uploaded again by a warm container """
+
+    def __init__(self, store):
+        self.store = store
+        self._known = set()
+        self._lock = threading.Lock()
+
+    def put_once(self, key, chunks):
+        """ Store the blob unless it is known to exist; chunks is a callable returning the blob content chunks """
+        with self._lock:
+            if key in self._known:
+                return False
+        stored = not self.store.exists(key)
+        if stored:
+            self.store.put(key, chunks())
+        with self._lock:
+            self._known.add(key)
+        return stored
+
+    def get(self, key):
+        return self.store.get(key)
+
+def get_blob_store():
+    """ Return the process level blob store selected by the PASTE_BLOB_STORE variable, or None """
+    global _blob_store
+
+    if _blob_store is None:
+        backend = os.environ.get(BLOB_STORE_ENV)
+        if not backend:
+            return None
+        if backend.startswith('s3:'):
+            bucket, _, prefix = backend[len('s3:'):].partition('/')
+            _blob_store = CachingBlobStore(S3BlobStore(bucket, prefix + '/' if prefix else ''))
+        else:
+            _blob_store = CachingBlobStore(FileBlobStore(backend[len('file:'):]))
+
+    return _blob_store
+
+def _compressed_file_chunks(path, level):
+    compressor = zlib.compressobj(level)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(largepaste.STREAM_CHUNK_SIZE), b''):
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+    yield compressor.flush()
+
+def encode_raw_paste(paste_data, raw_paste_data, sha256, encoded_paste_data=None, blob_store=None,
+                     level=PAYLOAD_COMPRESS_LEVEL):
+    """
+    Store the paste body in the scan result, compressed or as a reference to the blob store depending on its size
+
+    :param paste_data: paste item scan result receiving the 'raw_paste', 'raw_paste_encoding', 'raw_paste_ref' and
+                       'raw_paste_truncated' attributes
+    :param raw_paste_data: the paste content as text, or a LargePaste spooled to disk
+    :param sha256: SHA256 of the body, used as the blob key
+    :param encoded_paste_data: the UTF-8 encoded body of a text paste, when already at hand
+    :param blob_store: CachingBlobStore for bodies above the offload threshold, see get_blob_store()
+    :param level: zlib compression level
+    """
+    large_paste = isinstance(raw_paste_data, largepaste.LargePaste)
+    if large_paste:
+        size = raw_paste_data.size
+    else:
+        if encoded_paste_data is None:
+            encoded_paste_data = raw_paste_data.encode('utf-8')
+        size = len(encoded_paste_data)
+
+    if size > PAYLOAD_OFFLOAD_THRESHOLD and blob_store is not None:
+        if large_paste:
+            chunks = lambda: _compressed_file_chunks(raw_paste_data.path, level)
+        else:
+            chunks = lambda: [zlib.compress(encoded_paste_data, level)]
+        blob_store.put_once(sha256, chunks)
+        paste_data['raw_paste_encoding'] = ENCODING_BLOB
+        paste_data['raw_paste_ref'] = sha256
+        return
+
+    # without a blob store large bodies are truncated as before
+    if large_paste or len(raw_paste_data) > largepaste.STORED_BODY_LIMIT:
+        paste_data['raw_paste_truncated'] = True
+        text = raw_paste_data.text() if large_paste else raw_paste_data[:largepaste.STORED_BODY_LIMIT]
+        encoded_paste_data = text.encode('utf-8')
+    else:
+        text = raw_paste_data
+
+    if len(encoded_paste_data) > PAYLOAD_COMPRESS_THRESHOLD:
+        compressed = zlib.compress(encoded_paste_data, level)
+        # base64 adds a third, only keep the compressed form when it is still smaller
+        if len(compressed) * 4 // 3 < len(encoded_paste_data):
+            paste_data['raw_paste_encoding'] = ENCODING_ZLIB
+            paste_data['raw_paste'] = base64.b64encode(compressed).decode('ascii')
+            return
+
+    paste_data['raw_paste'] = text
+
+def decode_raw_paste(paste_data, blob_store=None):
+    """
+    Return the paste body of a scan result as text, whatever its encoding
+
+    :param paste_data: paste item scan result, see encode_raw_paste()
+    :param blob_store: blob store holding offloaded bodies, the one selected by PASTE_BLOB_STORE by default
+    :returns: the body text, or None if the result carries no body
+    """
+    encoding = paste_data.get('raw_paste_encoding')
+    if encoding is None:
+        return paste_data.get('raw_paste')
+    if encoding == ENCODING_ZLIB:
+        return zlib.decompress(base64.b64decode(paste_data['raw_paste'])).decode('utf-8', errors='replace')
+    if encoding == ENCODING_BLOB:
+        if blob_store is None:
+            blob_store = get_blob_store()
+        if blob_store is None:
+            raise ValueError("Paste body was offloaded but no blob store is configured")
+        return zlib.decompress(blob_store.get(paste_data['raw_paste_ref'])).decode('utf-8', errors='replace')
+    raise ValueError(f"Unknown raw paste encoding {encoding}")
@@ -0,0 +1,110 @@
+import os
+import hashlib
+import logging
+import importlib
+from base64 import b64decode
+import numpy as np
+import common
+
+logger = logging.getLogger("pastehunter")
+
+# Serverless native replacement of the PasteHunter 'post_b64' module, see postregistry.NATIVE_POST_MODULES.
+# It gives the same fields as the original: the exe is decoded from the UTF-8 bytes already encoded for hashing, and
+# the gzip stream, which the original decompresses and then fails to '.encode' as bytes, is not decoded at all.
+# The candidate base64 streams the original leaves as a ToDo are found with a vectorized scan of the same bytes and
+# only added to the results when BASE64_SPANS_ENV is set, so the output schema is unchanged by default.
+
+# set to '1' to add the 'Base64 Spans' of every paste post processed by the module
+BASE64_SPANS_ENV = 'PASTE_BASE64_SPANS'
+
+# candidate spans follow the base64 pattern of the original ToDo:
+#   (?:[A-Za-z0-9+/]{4}){3,}(?:[A-Za-z0-9+/]{2}==|[A-Za-z0-9+/]{3}=)?
+BASE64_MIN_SPAN = 12
+# spans recorded per paste, in order of their position
+MAX_BASE64_SPANS = 100
+
+_BASE64_ALPHABET = np.zeros(256, dtype=np.int8)
+_BASE64_ALPHABET[np.frombuffer(b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/', dtype=np.uint8)] = 1
+
+# PasteHunter configuration holding the 'sandboxes' settings, parsed on first use
+_conf = None
+
+def get_conf():
+    """ Return the PasteHunter configuration, parsing it on first use like the original does on import """
+    global _conf
+    if _conf is None:
+        _conf = common.parse_pastehunter_config()
+    return _conf
+
+def base64_spans(encoded, limit=MAX_BASE64_SPANS):
+    """
+    Find the candidate base64 streams of a paste with a vectorized character class scan
+
+    Gives the matches of the base64 pattern above, found as runs of base64 alphabet bytes.
+
+    :param encoded: the UTF-8 encoded paste
+    :param limit: maximum number of spans returned
+    :returns: list of [byte offset, length] of the spans
+    """
+    if len(encoded) < BASE64_MIN_SPAN:
+        return []
+
+    # +1 where a run of alphabet bytes starts, -1 right after it ends
+    edges = np.diff(_BASE64_ALPHABET[np.frombuffer(encoded, dtype=np.uint8)], prepend=0, append=0)
+    starts = np.flatnonzero(edges == 1)
+    lengths = np.flatnonzero(edges == -1) - starts
+    long_runs = lengths >= BASE64_MIN_SPAN
+
+    spans = []
+    for start, length in zip(starts[long_runs].tolist(), lengths[long_runs].tolist()):
+        end = start + length
+        rest = length % 4
+        if rest == 2 and encoded[end:end + 2] == b'==':
+            spans.append([start, length + 2])
+        elif rest == 3 and encoded[end:end + 1] == b'=':
+            spans.append([start, length + 1])
+        else:
+            spans.append([start, length - rest])
+        if len(spans) >= limit:
+            break
+    return spans
+
+def run(results, raw_paste_data, paste_object, encoded=None):
+    """ Post process module entry point; 'encoded' is the UTF-8 encoded paste passed by the registry """
+    if encoded is None:
+        encoded = str(raw_paste_data).encode('utf-8', errors='surrogatepass')
+    # the original decodes the paste text, which fails unless it is ASCII
+    ascii_only = len(encoded) == len(raw_paste_data)
+
+    for rule in results:
+        if len(raw_paste_data) > 0:
+            if rule == 'b64_gzip':
+                logger.error("Unable to decompress gzip stream")
+
+            if rule == 'b64_exe':
+                try:
+                    if not ascii_only:
+                        raise ValueError("string argument should contain only ASCII characters")
+                    raw_exe = b64decode(encoded)
+                    paste_object["exe_size"] = len(raw_exe)
+                    paste_object["exe_md5"] = hashlib.md5(raw_exe).hexdigest()
+                    paste_object["exe_sha256"] = hashlib.sha256(raw_exe).hexdigest()
+
+                    # We are guessing that the sample has been submitted, and crafting a URL
+                    paste_object["VT"] = 'https://www.virustotal.com/#/file/{0}'.format(paste_object["exe_md5"])
+
+                    # If sandbox modules are enabled then submit the file
+                    for sandbox, sandbox_values in get_conf()["sandboxes"].items():
+                        if sandbox_values["enabled"]:
+                            logger.info("Uploading file {0} using {1}".format(paste_object["pasteid"],
+                                                                              sandbox_values["module"]))
+                            sandbox_module = importlib.import_module(sandbox_values["module"])
+                            paste_object = sandbox_module.upload_file(raw_exe, paste_object)
+
+                except Exception:
+                    logger.error("Unable to decode exe file")
+
+    if os.environ.get(BASE64_SPANS_ENV) == '1':
+        paste_object["Base64 Spans"] = base64_spans(encoded)
+
+    return paste_object
@@ -0,0 +1,38 @@
+import math
+import numpy as np
+
+# Serverless native replacement of the PasteHunter 'post_entropy' module, see postregistry.NATIVE_POST_MODULES.
+# The symbol histogram is built with NumPy from the UTF-8 bytes already encoded for hashing; the entropy sum is
+# taken over the symbols in order of first occurrence, like the Counter of the original, so results are identical.
+
+def shannon_entropy(text, encoded=None):
+    """
+    Shannon entropy of the characters of a text
+
+    :param text: the paste text
+    :param encoded: the UTF-8 encoded text, when already at hand
+    :returns: the entropy in bits per character, as computed by the PasteHunter 'post_entropy' module
+    """
+    text = str(text)
+    if encoded is None:
+        encoded = text.encode('utf-8', errors='surrogatepass')
+
+    if len(encoded) == len(text):
+        # ASCII only: the byte histogram is the character histogram
+        counts = np.bincount(np.frombuffer(encoded, dtype=np.uint8), minlength=128)
+        symbols = np.flatnonzero(counts)
+        first = [encoded.find(bytes((symbol,))) for symbol in symbols.tolist()]
+    else:
+        code_points = np.frombuffer(text.encode('utf-32-le', errors='surrogatepass'), dtype='<u4')
+        symbols, first, counts = np.unique(code_points, return_index=True, return_counts=True)
+        counts = dict(zip(symbols.tolist(), counts.tolist()))
+        first = first.tolist()
+
+    ordered = [int(counts[symbol]) for _, symbol in sorted(zip(first, symbols.tolist()))]
+    lns = float(len(text))
+    return -sum(count / lns * math.log(count / lns, 2) for count in ordered)
+
+def run(results, raw_paste_data, paste_object, encoded=None):
+    """ Post process module entry point; 'encoded' is the UTF-8 encoded paste passed by the registry """
+    paste_object["Shannon Entropy"] = shannon_entropy(raw_paste_data, encoded)
+    return paste_object
@@ -0,0 +1,108 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import importlib
+import threading
+
+logger = logging.getLogger("pastehunter")
+
+# serverless native replacements of PasteHunter post process modules, giving identical results; their run()
+# also takes the UTF-8 encoded paste produced for hashing
+NATIVE_POST_MODULES = {'postprocess.post_entropy': 'postentropy', 'postprocess.post_b64': 'postb64'}
+# set to '0' to run the original PasteHunter modules instead of their native replacements
+NATIVE_POST_ENV = 'PASTE_NATIVE_POST_PROCESS'
+
+# registries are built once per container for each distinct 'post_process' configuration
+_registries = {}
+_registries_lock = threading.Lock()
+
+class PostProcessRegistry:
+    """ Enabled post process modules imported up front, with an index from rule name to the modules it selects """
+
+    def __init__(self, post_process_conf):
+        # identifies the configuration the post processed results were produced with
+        self.digest = hashlib.sha256(json.dumps(post_process_conf, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+        self.modules = {}
+        self.rule_index = {}
+        self.run_always = []
+        self.native = set()
+        self.timings = {}
+        self._order = {}
+        self._timings_lock = threading.Lock()
+
+        for name, post_values in post_process_conf.items():
+            if not post_values.get("enabled"):
+                continue
+            module = None
+            native_name = NATIVE_POST_MODULES.get(post_values["module"])
+            if native_name is not None and os.environ.get(NATIVE_POST_ENV, '1') != '0':
+                try:
+                    module = importlib.import_module(native_name)
+                    self.native.add(name)
+                except ImportError as e:
+                    logger.info("Native Post Module {0} unavailable, using {1}: {2}".format(
+                        native_name, post_values["module"], e))
+            if module is None:
+                try:
+                    module = importlib.import_module(post_values["module"])
+                except Exception as e:
+                    logger.error("Unable to import Post Module {0}: {1}".format(post_values["module"], e))
+                    continue
+
+            self._order[name] = len(self._order)
+            self.modules[name] = module
+            self.timings[name] = {'calls': 0, 'total_sec': 0.0}
+            for rule in post_values["rule_list"]:
+                if rule == "ALL":
+                    self.run_always.append(name)
+                else:
+                    self.rule_index.setdefault(rule, []).append(name)
+
+    def select(self, results):
+        """ Return the names of the modules selected by the matched rules, in configuration order """
+        selected = set(self.run_always)
+        for rule in results:
+            selected.update(self.rule_index.get(rule, ()))
+        return sorted(selected, key=self._order.get)
+
+    def run(self, results, raw_paste_data, paste_data, encoded=None):
+        """ Run the selected modules on a paste and return the updated paste item
+
+            :param encoded: optional UTF-8 encoded paste, handed to the native modules
+        """
+        post_results = paste_data
+        for name in self.select(results):
+            logger.info("Running Post Module {0} on {1}".format(name, paste_data["pasteid"]))
+            start = time.perf_counter()
+            if name in self.native:
+                post_results = self.modules[name].run(results, raw_paste_data, paste_data, encoded=encoded)
+            else:
+                post_results = self.modules[name].run(results, raw_paste_data, paste_data)
+            elapsed = time.perf_counter() - start
+            with self._timings_lock:
+                timing = self.timings[name]
+                timing['calls'] += 1
+                timing['total_sec'] += elapsed
+        return post_results
+
+def get_registry(conf):
+    """ Return the post process registry for the configuration, building it on first use """
+    key = json.dumps(conf["post_process"], sort_keys=True)
+    with _registries_lock:
+        registry = _registries.get(key)
+        if registry is None:
+            registry = PostProcessRegistry(conf["post_process"])
+            _registries[key] = registry
+    return registry
+
+def get_post_process_stats():
+    """ Return per module call counts and total run time across all registries of the container """
+    stats = {}
+    for registry in list(_registries.values()):
+        for name, timing in registry.timings.items():
+            module_stats = stats.setdefault(name, {'calls': 0, 'total_sec': 0.0})
+            module_stats['calls'] += timing['calls']
+            module_stats['total_sec'] += timing['total_sec']
+    return stats
@@ -0,0 +1,121 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger("pastehunter")
+
+DEFAULT_CACHE_SIZE = 2048
+DEFAULT_CACHE_TTL_SEC = 3600
+
+RESULT_CACHE_SIZE_ENV = 'PASTE_RESULT_CACHE_SIZE'
+RESULT_CACHE_TTL_ENV = 'PASTE_RESULT_CACHE_TTL'
+# folder for the local shared cache stand-in; only the in-process cache is used when not set
+RESULT_CACHE_DIR_ENV = 'PASTE_RESULT_CACHE_DIR'
+
+_result_cache = None
+
+class LRUResultCache:
+    """ In-process scan result cache keyed on the paste content SHA256 (plus the selected rule bundles), with size
+        and TTL eviction
+    """
+
+    def __init__(self, max_entries=DEFAULT_CACHE_SIZE, ttl_sec=DEFAULT_CACHE_TTL_SEC, shared=None):
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self.shared = shared
+        self.stats = {'hits': 0, 'shared_hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0, 'invalidated': 0}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sha256, rules_version):
+        """ Return the cached scan result for the content hash, or None if missing, expired or for other rules """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(sha256)
+            if entry is not None:
+                version, expires, value = entry
+                if version != rules_version:
+                    del self._entries[sha256]
+                    self.stats['invalidated'] += 1
+                elif expires < now:
+                    del self._entries[sha256]
+                    self.stats['expired'] += 1
+                else:
+                    self._entries.move_to_end(sha256)
+                    self.stats['hits'] += 1
+                    return value
+
+        if self.shared is not None:
+            value = self.shared.get(sha256, rules_version)
+            if value is not None:
+                self._store(sha256, rules_version, value)
+                with self._lock:
+                    self.stats['shared_hits'] += 1
+                return value
+
+        with self._lock:
+            self.stats['misses'] += 1
+        return None
+
+    def put(self, sha256, rules_version, value):
+        """ Cache the scan result of the content hash for the given compiled rules version """
+        self._store(sha256, rules_version, value)
+        if self.shared is not None:
+            self.shared.put(sha256, rules_version, value)
+
+    def _store(self, sha256, rules_version, value):
+        with self._lock:
+            self._entries[sha256] = (rules_version, time.time() + self.ttl_sec, value)
+            self._entries.move_to_end(sha256)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+class FileResultCache:
+    """ Local stand-in for a shared result cache service, storing one JSON file per content hash """
+
+    def __init__(self, directory, ttl_sec=DEFAULT_CACHE_TTL_SEC):
+        self.directory = directory
+        self.ttl_sec = ttl_sec
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, sha256):
+        return os.path.join(self.directory, f"{sha256}.json")
+
+    def get(self, sha256, rules_version):
+        try:
+            with open(self._path(sha256), 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if entry['rules_version'] != rules_version or entry['expires'] < time.time():
+            return None
+        return entry['value']
+
+    def put(self, sha256, rules_version, value):
+        entry = {'rules_version': rules_version, 'expires': time.time() + self.ttl_sec, 'value': value}
+        try:
+            with open(self._path(sha256), 'w') as f:
+                json.dump(entry, f, default=str)
+        except (OSError, TypeError) as e:
+            logger.error("Unable to write shared result cache entry: {0}".format(e))
+
+def get_result_cache():
+    """ Return the process level result cache, configured from the PASTE_RESULT_CACHE_* variables """
+    global _result_cache
+
+    if _result_cache is None:
+        ttl_sec = int(os.environ.get(RESULT_CACHE_TTL_ENV, DEFAULT_CACHE_TTL_SEC))
+        shared = None
+        if os.environ.get(RESULT_CACHE_DIR_ENV):
+            shared = FileResultCache(os.environ[RESULT_CACHE_DIR_ENV], ttl_sec)
+        _result_cache = LRUResultCache(int(os.environ.get(RESULT_CACHE_SIZE_ENV, DEFAULT_CACHE_SIZE)), ttl_sec, shared)
+
+    return _result_cache
@@ -0,0 +1,106 @@
+import os
+import json
+import time
+import heapq
+import logging
+import sqlite3
+import threading
+
+logger = logging.getLogger("pastehunter")
+
+DEFAULT_RETRY_BASE_DELAY_SEC = 5
+DEFAULT_RETRY_MAX_ATTEMPTS = 3
+
+# 'memory' or 'sqlite:<path to database file>'
+RETRY_QUEUE_ENV = 'PASTE_RETRY_QUEUE'
+
+_retry_queue = None
+
+class MemoryRetryQueue:
+    """ In-process deferred retry queue; entries survive warm invocations of the same container only """
+
+    def __init__(self):
+        self._heap = []
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def put(self, paste_data, attempt, not_before):
+        with self._lock:
+            # the counter keeps heap ordering stable for equal due times without comparing the dicts
+            heapq.heappush(self._heap, (not_before, self._counter, attempt, paste_data))
+            self._counter += 1
+
+    def pop_due(self, now=None, limit=None):
+        now = time.time() if now is None else now
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now and (limit is None or len(due) < limit):
+                _, _, attempt, paste_data = heapq.heappop(self._heap)
+                due.append((paste_data, attempt))
+        return due
+
+    def __len__(self):
+        return len(self._heap)
+
+class SqliteRetryQueue:
+    """ Local stand-in for a durable delay queue service, backed by a sqlite database file """
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_file, check_same_thread=False)
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS retry_queue "
+                             "(id INTEGER PRIMARY KEY AUTOINCREMENT, not_before REAL, attempt INTEGER, paste TEXT)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS retry_queue_due ON retry_queue (not_before)")
+
+    def put(self, paste_data, attempt, not_before):
+        with self._lock, self._db:
+            self._db.execute("INSERT INTO retry_queue (not_before, attempt, paste) VALUES (?, ?, ?)",
+                             (not_before, attempt, json.dumps(paste_data)))
+
+    def pop_due(self, now=None, limit=None):
+        now = time.time() if now is None else now
+        with self._lock, self._db:
+            rows = self._db.execute("SELECT id, attempt, paste FROM retry_queue WHERE not_before <= ? "
+                                    "ORDER BY not_before, id LIMIT ?", (now, -1 if limit is None else limit)).fetchall()
+            self._db.executemany("DELETE FROM retry_queue WHERE id = ?", [(row[0],) for row in rows])
+        return [(json.loads(paste), attempt) for _, attempt, paste in rows]
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM retry_queue").fetchone()[0]
+
+def get_retry_queue():
+    """ Return the process level retry queue, using the backend selected by the PASTE_RETRY_QUEUE variable """
+    global _retry_queue
+
+    if _retry_queue is None:
+        backend = os.environ.get(RETRY_QUEUE_ENV, 'memory')
+        if backend.startswith('sqlite:'):
+            _retry_queue = SqliteRetryQueue(backend[len('sqlite:'):])
+        else:
+            _retry_queue = MemoryRetryQueue()
+
+    return _retry_queue
+
+def defer_paste(queue, paste_data, attempt, base_delay=DEFAULT_RETRY_BASE_DELAY_SEC,
+                max_attempts=DEFAULT_RETRY_MAX_ATTEMPTS):
+    """
+    Put a paste item on the retry queue with exponential backoff
+
+    :param queue: the retry queue
+    :param paste_data: the paste item metadata dictionary
+    :param attempt: number of the retry being scheduled, starting at 1
+    :param base_delay: delay before the first retry in seconds, doubled for every following attempt
+    :param max_attempts: maximum number of retries for a paste item
+    :returns: True if the retry was scheduled, False if the paste ran out of attempts
+    """
+    if attempt > max_attempts:
+        logger.info(f"Giving up on paste {paste_data.get('pasteid')} after {max_attempts} retries")
+        return False
+
+    delay = base_delay * (2 ** (attempt - 1))
+    queue.put(paste_data, attempt, time.time() + delay)
+    logger.debug(f"Deferred paste {paste_data.get('pasteid')} retry {attempt} by {delay} sec")
+    return True
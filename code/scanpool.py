@@ -0,0 +1,43 @@
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("pastehunter")
+
+# overrides the number of scan workers derived from the available cores
+SCAN_WORKERS_ENV = 'PASTE_SCAN_WORKERS'
+
+_scan_executor = None
+_scan_executor_lock = threading.Lock()
+
+def available_cores():
+    """ Return the number of cores this process may run on; Lambda assigns vCPUs in proportion to memory """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def scan_worker_count():
+    """ Return the number of scan workers, from PASTE_SCAN_WORKERS or the available cores """
+    workers = os.environ.get(SCAN_WORKERS_ENV)
+    if workers:
+        return max(1, int(workers))
+    return available_cores()
+
+def get_scan_executor():
+    """
+    Return the process level scan worker pool
+
+    Yara releases the GIL while matching, so worker threads share the compiled rules loaded once per container
+    and still run the matching on all cores. Process pools are not an option as Lambda provides no /dev/shm.
+    """
+    global _scan_executor
+
+    with _scan_executor_lock:
+        if _scan_executor is None:
+            workers = scan_worker_count()
+            logger.info(f"Starting scan pool with {workers} workers")
+            _scan_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='scan')
+
+    return _scan_executor
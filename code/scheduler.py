@@ -0,0 +1,120 @@
+import os
+import time
+import logging
+
+logger = logging.getLogger("pastehunter")
+
+# pastes expiring within this window are scanned before all others
+EXPIRY_URGENT_SEC = 3600
+# syntaxes that most often carry credentials and configuration dumps, scanned first within an expiry rank
+PRIORITY_SYNTAXES = frozenset(['text', 'bash', 'powershell', 'ini', 'json', 'yaml', 'xml', 'sql', 'php', 'python'])
+
+# time kept free before the Lambda deadline to report the batch and flush the output
+DEADLINE_RESERVE_MS_ENV = 'PASTE_DEADLINE_RESERVE_MS'
+DEFAULT_DEADLINE_RESERVE_MS = 1000
+# rough fetch plus scan throughput, used to keep large pastes from starting just before the deadline
+ESTIMATED_BYTES_PER_MS = 10000
+# rough fixed cost of a paste, the default Pastebin fetch rate allows 5 fetches per second
+ESTIMATED_PASTE_MS = 200
+
+class DeadlineReached(Exception):
+    """ Raised for a paste that was not started because the invocation is about to time out """
+    pass
+
+def paste_priority(paste_data, now=None):
+    """
+    Cheap priority of a paste item from its stream metadata; lower values are processed first
+
+    Pastes about to expire come first, then pastes that expire at all, then pastes that never expire. Within a
+    rank the syntaxes of interest come first, then smaller pastes as they finish sooner.
+
+    :param paste_data: paste item metadata dictionary, see common.unpack_ddb_paste_records()
+    :param now: current epoch seconds
+    :returns: sortable priority tuple
+    """
+    if now is None:
+        now = time.time()
+
+    expire = paste_data.get('expire') or 0
+    if expire <= 0:
+        expiry_rank = 2
+    elif expire <= now:
+        # already expired, the content is most likely gone
+        expiry_rank = 3
+    elif expire - now <= EXPIRY_URGENT_SEC:
+        expiry_rank = 0
+    else:
+        expiry_rank = 1
+
+    syntax_rank = 0 if paste_data.get('syntax', 'text') in PRIORITY_SYNTAXES else 1
+    return expiry_rank, syntax_rank, paste_data.get('size', 0)
+
+def prioritize(paste_data_records, now=None):
+    """ Return the paste items ordered by paste_priority() """
+    if now is None:
+        now = time.time()
+    return sorted(paste_data_records, key=lambda paste_data: paste_priority(paste_data, now))
+
+def estimated_ms(paste_data):
+    """ Return the rough time in milliseconds to fetch and scan a paste """
+    return ESTIMATED_PASTE_MS + paste_data.get('size', 0) / ESTIMATED_BYTES_PER_MS
+
+def plan_batch(paste_data_records, deadline, sequence_numbers, now=None):
+    """
+    Select the pastes of a batch that fit before the deadline and order them by paste_priority()
+
+    Lambda resumes a stream batch from the lowest reported sequence number and replays every later record, so the
+    stream records are selected as a prefix in sequence order: a batch cut by the deadline then resumes after the
+    pastes already scanned instead of scanning them again. Deferred retries are not part of the stream and are
+    selected first. At least one paste is always selected so a batch cannot get stuck on its first record.
+
+    :param paste_data_records: list of paste item metadata dictionaries
+    :param deadline: Deadline of the invocation
+    :param sequence_numbers: dictionary of paste id -> stream sequence number, see common.ddb_record_sequence_numbers()
+    :param now: current epoch seconds
+    :returns: tuple of (selected pastes in priority order, pastes left for the next invocation in sequence order)
+    """
+    retries = [paste_data for paste_data in paste_data_records if paste_data['pasteid'] not in sequence_numbers]
+    stream = sorted((paste_data for paste_data in paste_data_records if paste_data['pasteid'] in sequence_numbers),
+                    key=lambda paste_data: int(sequence_numbers[paste_data['pasteid']]))
+
+    budget = deadline.budget_ms()
+    selected = []
+    left = []
+    for paste_data in retries + stream:
+        if budget is not None and selected and (left or estimated_ms(paste_data) > budget):
+            left.append(paste_data)
+            continue
+        selected.append(paste_data)
+        if budget is not None:
+            budget -= estimated_ms(paste_data)
+
+    return prioritize(selected, now), left
+
+class Deadline:
+    """
+    Tracks the remaining invocation time through the Lambda context
+
+    :param context: Lambda context object; without get_remaining_time_in_millis() there is no deadline
+    :param reserve_ms: time kept free at the end of the invocation, PASTE_DEADLINE_RESERVE_MS by default
+    """
+
+    def __init__(self, context, reserve_ms=None):
+        self._remaining = getattr(context, 'get_remaining_time_in_millis', None)
+        if reserve_ms is None:
+            reserve_ms = int(os.environ.get(DEADLINE_RESERVE_MS_ENV, DEFAULT_DEADLINE_RESERVE_MS))
+        self.reserve_ms = reserve_ms
+
+    def remaining_ms(self):
+        """ Return the remaining invocation time in milliseconds, or None without a deadline """
+        return self._remaining() if self._remaining is not None else None
+
+    def budget_ms(self):
+        """ Return the invocation time left before the reserve in milliseconds, or None without a deadline """
+        remaining = self.remaining_ms()
+        return remaining - self.reserve_ms if remaining is not None else None
+
+    def allows(self, paste_data):
+        """ Return True if the estimated_ms() of the paste still fits before the reserved end of the invocation """
+        budget = self.budget_ms()
+        return budget is None or estimated_ms(paste_data) <= budget
@@ -0,0 +1,124 @@
+import os
+import json
+import logging
+
+logger = logging.getLogger("pastehunter")
+
+# Pastebin scraping API accepts a listing limit of at most 250 items
+LISTING_LIMIT_MIN = 50
+LISTING_LIMIT_MAX = 250
+# band of the listing that should overlap with the previous run; below it pastes may have been missed
+TARGET_OVERLAP_MIN = 0.1
+TARGET_OVERLAP_MAX = 0.5
+
+# DynamoDB table holding the scraper state; a local JSON file is used when not set
+STATE_TABLE_ENV = 'SCRAPER_STATE_TABLE_NAME'
+STATE_FILE_ENV = 'SCRAPER_STATE_FILE'
+DEFAULT_STATE_FILE = '/tmp/pastehunter_scraper_state.json'
+
+_state_store = None
+
+class FileStateStore:
+    """ Local stand-in for the scraper state table, persisting all scraper states in a single JSON file """
+
+    def __init__(self, state_file):
+        self.state_file = state_file
+
+    def _read(self):
+        if not os.path.exists(self.state_file):
+            return {}
+        try:
+            with open(self.state_file, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error("Unable to read scraper state file: {0}".format(e))
+            return {}
+
+    def load(self, name):
+        return self._read().get(name, {})
+
+    def save(self, name, state):
+        states = self._read()
+        states[name] = state
+        with open(self.state_file, 'w') as f:
+            json.dump(states, f)
+
+class DynamoDBStateStore:
+    """ Scraper state persisted as one item per scraper in a DynamoDB table """
+
+    def __init__(self, table):
+        self.table = table
+
+    def load(self, name):
+        item = self.table.get_item(Key={'key': f"scraper_state#{name}"}).get('Item')
+        if item is None:
+            return {}
+        return json.loads(item['state'])
+
+    def save(self, name, state):
+        self.table.put_item(Item={'key': f"scraper_state#{name}", 'state': json.dumps(state)})
+
+def get_state_store():
+    """ Return the scraper state store selected by the SCRAPER_STATE_TABLE_NAME and SCRAPER_STATE_FILE variables """
+    global _state_store
+
+    if _state_store is None:
+        table_name = os.environ.get(STATE_TABLE_ENV)
+        if table_name:
+            import boto3
+            _state_store = DynamoDBStateStore(boto3.resource('dynamodb').Table(table_name))
+        else:
+            _state_store = FileStateStore(os.environ.get(STATE_FILE_ENV, DEFAULT_STATE_FILE))
+
+    return _state_store
+
+def next_listing_limit(limit, listed_count, overlap_count):
+    """
+    Adapt the listing limit to the overlap observed between two scraper runs
+
+    :param limit: listing limit used for the current run
+    :param listed_count: number of pastes in the current listing
+    :param overlap_count: number of listed pastes already seen by the previous run
+    :returns: the listing limit for the next run
+    """
+    if listed_count == 0:
+        return limit
+
+    overlap = overlap_count / listed_count
+    if overlap == 0:
+        # no overlap at all, the listing may have skipped pastes between runs
+        limit = limit * 2
+    elif overlap < TARGET_OVERLAP_MIN:
+        limit = int(limit * 1.25) + 1
+    elif overlap > TARGET_OVERLAP_MAX:
+        limit = int(limit * 0.75)
+
+    return max(LISTING_LIMIT_MIN, min(LISTING_LIMIT_MAX, limit))
+
+def filter_new_pastes(pastes, listed_ids, state, limit):
+    """
+    Drop pastes already stored by earlier runs, based on the persisted high-water mark and recently seen ids
+
+    :param pastes: pastes returned by the input, already filtered against state['seen_ids']
+    :param listed_ids: ids of all pastes in the listing, including the ones filtered by the input
+    :param state: scraper state from the previous run with 'high_water_mark' and 'seen_ids' keys
+    :param limit: listing limit used for the current run
+    :returns: tuple of (new pastes, updated scraper state)
+    """
+    high_water_mark = state.get('high_water_mark', 0)
+
+    new_pastes = [paste for paste in pastes if int(paste['date']) >= high_water_mark]
+    overlap_count = len(listed_ids) - len(new_pastes)
+
+    dates = [int(paste['date']) for paste in pastes]
+    new_state = {
+        'high_water_mark': max(dates + [high_water_mark]),
+        # the next listing can only overlap with this one, so its ids are all that needs remembering
+        'seen_ids': list(listed_ids) if listed_ids else state.get('seen_ids', []),
+        'limit': limit,
+    }
+    if 'high_water_mark' in state:
+        new_state['limit'] = next_listing_limit(limit, len(listed_ids), overlap_count)
+
+    logger.info(f"Listing had {len(listed_ids)} pastes, {overlap_count} already seen, next limit {new_state['limit']}")
+    return new_pastes, new_state
@@ -0,0 +1,11 @@
+import os
+import sys
+
+# Lambda handler modules import each other as top level modules from the 'code' folder
+CODE_ROOT = os.path.join(os.path.dirname(__file__), '..', '..', 'code')
+sys.path.insert(0, os.path.abspath(CODE_ROOT))
+# the build tools live in the repository root and import the handler modules through the 'code' package
+REPO_ROOT = os.path.join(os.path.dirname(__file__), '..', '..')
+sys.path.append(os.path.abspath(REPO_ROOT))
+# the scraper handlers create their boto3 resources on import; nothing is sent without a stubbed resource
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
@@ -0,0 +1,187 @@
+import os
+import shutil
+
+import pytest
+
+import common
+
+
+@pytest.fixture()
+def rule_path(tmp_path):
+    """ Minimal Yara rule folder with an 'index.yar' including a single rule file """
+    (tmp_path / 'keywords.yar').write_text('rule core_keywords { strings: $a = "hacked by" condition: $a }\n')
+    common.yara_index(str(tmp_path), blacklist=False, test_rules=False)
+    common.clear_yara_rules_cache()
+    return str(tmp_path)
+
+
+def test_load_yara_rules_cached(rule_path):
+    first = common.load_yara_rules(rule_path)
+    second = common.load_yara_rules(rule_path)
+
+    stats = common.get_yara_cache_stats()
+    assert first is second
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+    assert stats['compiles'] == 1
+
+
+def test_load_yara_rules_only_rehashes_modified_rule_files(rule_path, monkeypatch):
+    fingerprints = []
+    yara_rules_fingerprint = common.yara_rules_fingerprint
+    monkeypatch.setattr(common, 'yara_rules_fingerprint', lambda f: fingerprints.append(f) or yara_rules_fingerprint(f))
+
+    first = common.load_yara_rules(rule_path)
+    common.load_yara_rules(rule_path)
+    assert len(fingerprints) == 1
+
+    # a touched rule file is hashed again but the unchanged rules are not recompiled
+    keywords = os.path.join(rule_path, 'keywords.yar')
+    os.utime(keywords, ns=(0, os.stat(keywords).st_mtime_ns + 10 ** 9))
+    assert common.load_yara_rules(rule_path) is first
+    assert common.load_yara_rules(rule_path) is first
+    assert len(fingerprints) == 2
+    assert common.get_yara_cache_stats()['compiles'] == 1
+
+
+def test_load_yara_rules_recompiles_on_change(rule_path):
+    first = common.load_yara_rules(rule_path)
+    with open(os.path.join(rule_path, 'keywords.yar'), 'a') as yar:
+        yar.write('rule dox { strings: $a = "dox" condition: $a }\n')
+    second = common.load_yara_rules(rule_path)
+
+    assert first is not second
+    assert [m.rule for m in second.match(data='dox')] == ['dox']
+    assert common.get_yara_cache_stats()['compiles'] == 2
+
+
+def test_load_yara_rules_from_bundle(rule_path, tmp_path_factory):
+    bundle_path = str(tmp_path_factory.mktemp('bundle'))
+    rules = common.load_yara_rules(rule_path)
+    common.save_yara_bundle(rules, rule_path, bundle_path, blacklist=False, test_rules=False)
+    common.clear_yara_rules_cache()
+
+    bundled = common.load_yara_rules(rule_path, bundle_path)
+
+    stats = common.get_yara_cache_stats()
+    assert stats['bundle_loads'] == 1
+    assert stats['compiles'] == 0
+    assert [m.rule for m in bundled.match(data='hacked by')] == ['core_keywords']
+
+
+def test_load_yara_rules_from_bundle_after_moving_rules(rule_path, tmp_path_factory):
+    bundle_path = str(tmp_path_factory.mktemp('bundle'))
+    rules = common.load_yara_rules(rule_path)
+    common.save_yara_bundle(rules, rule_path, bundle_path, blacklist=False, test_rules=False)
+    common.clear_yara_rules_cache()
+    # the bundle is built on a dev machine and loaded from the rules copied into the Lambda package
+    moved_path = os.path.join(str(tmp_path_factory.mktemp('task')), 'rules')
+    shutil.copytree(rule_path, moved_path)
+
+    bundled = common.load_yara_rules(moved_path, bundle_path)
+
+    stats = common.get_yara_cache_stats()
+    assert stats['bundle_loads'] == 1
+    assert stats['compiles'] == 0
+    assert [m.rule for m in bundled.match(data='hacked by')] == ['core_keywords']
+
+
+def test_load_yara_rules_ignores_stale_bundle(rule_path, tmp_path_factory):
+    bundle_path = str(tmp_path_factory.mktemp('bundle'))
+    rules = common.load_yara_rules(rule_path)
+    common.save_yara_bundle(rules, rule_path, bundle_path, blacklist=False, test_rules=False)
+    common.clear_yara_rules_cache()
+    with open(os.path.join(rule_path, 'keywords.yar'), 'a') as yar:
+        yar.write('rule dox { strings: $a = "dox" condition: $a }\n')
+
+    common.load_yara_rules(rule_path, bundle_path)
+
+    stats = common.get_yara_cache_stats()
+    assert stats['bundle_loads'] == 0
+    assert stats['compiles'] == 1
+
+
+def _stream_record(event_name, **image):
+    return {'eventName': event_name, 'dynamodb': {'NewImage': image}}
+
+
+def test_unpack_ddb_paste_records_optional_fields():
+    records = [
+        _stream_record('INSERT', pasteid={'S': 'a'}, scrape_url={'S': 'https://x/a'}, date={'N': '0'},
+                       size={'N': '12'}, expire={'N': '0'}, syntax={'S': 'python'}),
+        # 'syntax' is removed by prepare_paste_items when empty
+        _stream_record('MODIFY', pasteid={'S': 'b'}, scrape_url={'S': 'https://x/b'}, date={'N': '0'},
+                       size={'N': '5'}),
+        _stream_record('REMOVE', pasteid={'S': 'c'}),
+    ]
+
+    pastes = common.unpack_ddb_paste_records(records)
+
+    assert [p['pasteid'] for p in pastes] == ['a', 'b']
+    assert pastes[0]['syntax'] == 'python'
+    assert pastes[0]['size'] == 12 and pastes[0]['expire'] == 0
+    assert 'syntax' not in pastes[1] and 'expire' not in pastes[1]
+
+
+def test_unpack_ddb_paste_records_only_rescans_modified_content():
+    image = {'pasteid': {'S': 'a'}, 'scrape_url': {'S': 'https://x/a'}, 'date': {'N': '0'}, 'size': {'N': '5'}}
+    records = [
+        {'eventName': 'MODIFY', 'dynamodb': {'OldImage': dict(image, date={'N': '1'}), 'NewImage': image}},
+        {'eventName': 'MODIFY', 'dynamodb': {'OldImage': dict(image, size={'N': '4'}), 'NewImage': image}},
+        {'eventName': 'MODIFY', 'dynamodb': {'OldImage': dict(image, body={'S': 'old'}), 'NewImage': image}},
+    ]
+
+    assert len(common.unpack_ddb_paste_records(records)) == 2
+
+
+def test_unpack_ddb_paste_records_skips_incomplete_records():
+    records = [_stream_record('INSERT', pasteid={'S': 'a'}, date={'N': '0'}, size={'N': '1'})]
+    assert common.unpack_ddb_paste_records(records) == []
+
+
+def test_yara_index_bundles(tmp_path):
+    (tmp_path / 'keywords.yar').write_text('rule core_keywords { strings: $a = "hacked by" condition: $a }\n')
+    (tmp_path / 'base64.yar').write_text('rule b64_exe { strings: $a = "TVqQAAMAAAAEAAAA" condition: $a }\n')
+    (tmp_path / 'blacklist.yar').write_text('rule blacklist { strings: $a = "spam" condition: $a }\n')
+    bundles = {'base64': {'rules': ['base64.yar'], 'min_size': 16}}
+
+    index_names = common.yara_index(str(tmp_path), blacklist=True, test_rules=False, bundles=bundles)
+    assert sorted(index_names) == ['index.bundle.base64.yar', 'index.bundle.first_pass.yar', 'index.yar']
+    assert (tmp_path / 'index.bundle.base64.yar').read_text() == 'include "base64.yar"\n'
+    first_pass = (tmp_path / 'index.bundle.first_pass.yar').read_text()
+    assert 'keywords.yar' in first_pass and 'blacklist.yar' in first_pass and 'base64.yar' not in first_pass
+
+    tiers, version = common.load_yara_rule_bundles(bundles, str(tmp_path))
+    assert [name for name, _, _ in tiers] == ['first_pass', 'base64']
+    assert version
+
+
+def test_yara_index_keeps_rule_files_named_like_indexes(tmp_path):
+    (tmp_path / 'index_leaks.yar').write_text('rule leaks { strings: $a = "leak" condition: $a }\n')
+    bundles = {'leaks': {'rules': ['index_leaks.yar']}}
+    common.yara_index(str(tmp_path), blacklist=False, test_rules=False, bundles=bundles)
+
+    # regenerating must not pick up the index files of the previous run
+    common.yara_index(str(tmp_path), blacklist=False, test_rules=False, bundles=bundles)
+
+    assert (tmp_path / 'index.yar').read_text() == 'include "index_leaks.yar"\n'
+    assert (tmp_path / 'index.bundle.leaks.yar').read_text() == 'include "index_leaks.yar"\n'
+    assert (tmp_path / 'index.bundle.first_pass.yar').read_text() == ''
+
+
+def test_prepare_paste_items_stores_numbers_the_decoder_expects():
+    listing = [{'key': 'a', 'pasteid': 'a', 'scrape_url': 'https://x/a', 'date': '1600000000', 'size': '12',
+                'expire': '0', 'syntax': 'text', 'title': '', 'user': ''}]
+
+    item = common.prepare_paste_items(listing)[0]
+
+    assert item['date'] == 1600000000 and item['size'] == 12 and item['expire'] == 0
+    assert 'title' not in item and 'user' not in item
+
+
+def test_prepare_paste_items_keeps_the_key_of_items_without_pasteid():
+    listing = [{'key': 'gist#abc', 'scrape_url': 'https://x/abc', 'date': '1600000000', 'size': '3'}]
+
+    item = common.prepare_paste_items(listing, confname='gists')[0]
+
+    assert item['key'] == 'gist#abc'
@@ -0,0 +1,62 @@
+from botocore.exceptions import ClientError
+
+import ddbwriter
+
+
+class FakeDynamoDB:
+    """ Stand-in for the boto3 DynamoDB resource that leaves items unprocessed on the first calls """
+
+    def __init__(self, unprocessed_calls=0, throttle_calls=0):
+        self.unprocessed_calls = unprocessed_calls
+        self.throttle_calls = throttle_calls
+        self.calls = []
+        self.items = {}
+
+    def batch_write_item(self, RequestItems):
+        (table_name, put_requests), = RequestItems.items()
+        self.calls.append(len(put_requests))
+        assert len(put_requests) <= ddbwriter.DDB_BATCH_SIZE
+
+        if self.throttle_calls:
+            self.throttle_calls -= 1
+            raise ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException'}}, 'BatchWriteItem')
+
+        unprocessed = []
+        if self.unprocessed_calls:
+            self.unprocessed_calls -= 1
+            put_requests, unprocessed = put_requests[:-2], put_requests[-2:]
+
+        for request in put_requests:
+            item = request['PutRequest']['Item']
+            self.items[item['pasteid']] = item
+        return {'UnprocessedItems': {table_name: unprocessed} if unprocessed else {}}
+
+
+def _pastes(ids):
+    return [{'pasteid': str(i), 'key': str(i), 'size': 10} for i in ids]
+
+
+def test_batch_write_dedupes_and_batches():
+    ddb = FakeDynamoDB()
+    stats = ddbwriter.batch_write_items(ddb, 'pastes', _pastes(list(range(60)) + [1, 2, 3]))
+
+    assert stats == {'written': 60, 'duplicates': 3, 'throttled': 0, 'failed': 0}
+    assert ddb.calls == [25, 25, 10]
+    assert len(ddb.items) == 60
+
+
+def test_batch_write_retries_unprocessed_and_throttled():
+    ddb = FakeDynamoDB(unprocessed_calls=1, throttle_calls=1)
+    stats = ddbwriter.batch_write_items(ddb, 'pastes', _pastes(range(10)), base_delay=0)
+
+    assert stats == {'written': 10, 'duplicates': 0, 'throttled': 12, 'failed': 0}
+    assert len(ddb.items) == 10
+
+
+def test_batch_write_gives_up_after_max_retries():
+    ddb = FakeDynamoDB(throttle_calls=10)
+    stats = ddbwriter.batch_write_items(ddb, 'pastes', _pastes(range(5)), max_retries=2, base_delay=0)
+
+    assert stats['written'] == 0
+    assert stats['failed'] == 5
+    assert ddb.calls == [5, 5, 5]
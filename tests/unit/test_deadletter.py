@@ -0,0 +1,34 @@
+import pytest
+
+import deadletter
+
+
+@pytest.fixture(params=['memory', 'file'])
+def store(request, tmp_path):
+    if request.param == 'file':
+        return deadletter.FileDeadLetterStore(str(tmp_path / 'dlq'))
+    return deadletter.MemoryDeadLetterStore()
+
+
+def test_handle_failure_sidelines_after_max_attempts(store):
+    paste = {'pasteid': 'a'}
+    error = ValueError('boom')
+
+    assert deadletter.handle_failure(store, '100', paste, error, max_attempts=3)
+    assert deadletter.handle_failure(store, '100', paste, error, max_attempts=3)
+    assert not deadletter.handle_failure(store, '100', paste, error, max_attempts=3)
+
+    assert len(store.dead_letters) == 1
+    assert store.dead_letters[0]['paste'] == paste
+    assert store.dead_letters[0]['attempts'] == 3
+    # counters restart for the same key once it has been sidelined
+    assert deadletter.handle_failure(store, '100', paste, error, max_attempts=3)
+
+
+def test_clear_resets_attempts(store):
+    paste = {'pasteid': 'a'}
+    deadletter.handle_failure(store, '100', paste, ValueError(), max_attempts=2)
+    store.clear('100')
+
+    assert deadletter.handle_failure(store, '100', paste, ValueError(), max_attempts=2)
+    assert store.dead_letters == []
@@ -0,0 +1,67 @@
+import threading
+import time
+
+import fetcher
+
+
+def _records(count, host='scrape.pastebin.com'):
+    return [{'pasteid': str(i), 'confname': 'pastebin', 'scrape_url': f'https://{host}/api_scrape_item.php?i={i}'}
+            for i in range(count)]
+
+
+def test_fetch_pastes_returns_all_records():
+    conf = {'inputs': {'pastebin': {'fetch_concurrency': 4, 'fetch_rate_per_sec': 0}}}
+    results = list(fetcher.fetch_pastes(_records(20), conf, lambda paste_data, conf: 'body ' + paste_data['pasteid']))
+
+    assert sorted(p['pasteid'] for p, _, _ in results) == sorted(str(i) for i in range(20))
+    assert all(raw == 'body ' + p['pasteid'] and error is None for p, raw, error in results)
+
+
+def test_fetch_pastes_respects_host_concurrency():
+    conf = {'inputs': {'pastebin': {'fetch_concurrency': 2, 'fetch_rate_per_sec': 0}}}
+    lock = threading.Lock()
+    state = {'active': 0, 'peak': 0}
+
+    def fetch(paste_data, conf):
+        with lock:
+            state['active'] += 1
+            state['peak'] = max(state['peak'], state['active'])
+        time.sleep(0.01)
+        with lock:
+            state['active'] -= 1
+        return ''
+
+    list(fetcher.fetch_pastes(_records(12, host='concurrency.test'), conf, fetch, max_workers=8))
+    assert state['peak'] == 2
+
+
+def test_fetch_pastes_isolates_errors():
+    conf = {'inputs': {'pastebin': {'fetch_rate_per_sec': 0}}}
+
+    def fetch(paste_data, conf):
+        if paste_data['pasteid'] == '1':
+            raise ValueError('boom')
+        return 'ok'
+
+    results = dict((p['pasteid'], (raw, error)) for p, raw, error in fetcher.fetch_pastes(_records(3), conf, fetch))
+    assert results['0'] == ('ok', None)
+    assert results['1'][0] is None and isinstance(results['1'][1], ValueError)
+    assert results['2'] == ('ok', None)
+
+
+def test_host_limiter_rate():
+    limiter = fetcher.HostLimiter(concurrency=4, rate_per_sec=50)
+    start = time.monotonic()
+    for _ in range(6):
+        with limiter:
+            pass
+    assert time.monotonic() - start >= 5 / 50.0
+
+
+def test_fetch_pastes_reports_declined_pastes_as_skipped():
+    conf = {'inputs': {'pastebin': {'fetch_rate_per_sec': 0}}}
+    results = list(fetcher.fetch_pastes(_records(6, host='skip.test'), conf, lambda paste_data, conf: '',
+                                        should_fetch=lambda paste_data: int(paste_data['pasteid']) < 4))
+
+    skipped = sorted(p['pasteid'] for p, _, error in results if isinstance(error, fetcher.FetchSkipped))
+    assert skipped == ['4', '5']
@@ -0,0 +1,93 @@
+import http.server
+import json
+import threading
+
+import pytest
+
+import gists
+
+
+class GistsApiHandler(http.server.BaseHTTPRequestHandler):
+    """ Stand-in for the gists API serving '/gists/<id>' with an ETag and the file contents from '/raw/<name>' """
+    protocol_version = 'HTTP/1.1'
+    files = {}
+    requests = []
+
+    def _send(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.requests.append((self.path, self.headers.get('If-None-Match')))
+        if self.path.startswith('/raw/'):
+            self._send(200, self.files[self.path[len('/raw/'):]].encode('utf-8'))
+        elif self.path == '/gists/abc':
+            etag = '"v1"'
+            if self.headers.get('If-None-Match') == etag:
+                self._send(304, headers={'ETag': etag})
+                return
+            host = 'http://{0}:{1}'.format(*self.server.server_address)
+            # the API inlines small files and marks large ones as truncated
+            files = {name: {'filename': name, 'size': len(content), 'raw_url': f"{host}/raw/{name}",
+                            'truncated': len(content) > 100, 'content': content[:100]}
+                     for name, content in self.files.items()}
+            self._send(200, json.dumps({'id': 'abc', 'files': files}).encode('utf-8'),
+                       {'ETag': etag, 'Content-Type': 'application/json', 'X-RateLimit-Remaining': '59'})
+        else:
+            self._send(404)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture()
+def api(monkeypatch):
+    GistsApiHandler.files = {'a.txt': 'small file', 'b.py': 'password = "x"\n' * 50, 'c.sh': 'echo ' * 100}
+    GistsApiHandler.requests = []
+    monkeypatch.setattr(gists, '_gist_cache', None)
+    srv = http.server.ThreadingHTTPServer(('127.0.0.1', 0), GistsApiHandler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield {'api_url': 'http://127.0.0.1:{0}'.format(srv.server_port)}
+    srv.shutdown()
+
+
+def test_all_files_are_fetched(api):
+    text = gists.fetch_gist('abc', api)
+
+    assert text == '\n'.join(GistsApiHandler.files[name] for name in sorted(GistsApiHandler.files))
+    assert sorted(path for path, _ in GistsApiHandler.requests) == ['/gists/abc', '/raw/b.py', '/raw/c.sh']
+
+
+def test_unchanged_gist_is_answered_from_cache(api):
+    first = gists.fetch_gist('abc', api)
+    GistsApiHandler.requests = []
+    stats = gists.get_gist_stats()
+
+    assert gists.fetch_gist('abc', api) == first
+    # only the conditional API request is made, the file contents come from the cache
+    assert GistsApiHandler.requests == [('/gists/abc', '"v1"')]
+    assert gists.get_gist_stats()['not_modified'] == stats['not_modified'] + 1
+
+
+def test_total_bytes_per_gist_are_capped(api):
+    text = gists.fetch_gist('abc', dict(api, max_bytes=300))
+
+    assert len(text.encode('utf-8')) <= 300 + 2
+    assert text.startswith('small file\npassword')
+
+
+def test_files_capped_by_a_smaller_budget_are_fetched_whole_later(api):
+    gists.fetch_gist('abc', dict(api, max_bytes=300))
+
+    text = gists.fetch_gist('abc', api)
+
+    assert text == '\n'.join(GistsApiHandler.files[name] for name in sorted(GistsApiHandler.files))
+
+
+def test_deleted_gist_raises(api):
+    with pytest.raises(gists.GistNotFoundError):
+        gists.fetch_gist('missing', api)
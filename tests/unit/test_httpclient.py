@@ -0,0 +1,44 @@
+import gzip
+import http.server
+import threading
+
+import pytest
+
+import httpclient
+
+
+class GzipHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = gzip.compress(b'paste ' * 1000)
+        self.send_response(200)
+        self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture()
+def server():
+    srv = http.server.ThreadingHTTPServer(('127.0.0.1', 0), GzipHandler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield 'http://127.0.0.1:{0}/'.format(srv.server_port)
+    srv.shutdown()
+
+
+def test_get_reuses_connections_and_counts_bytes(server):
+    httpclient.reset_http_stats()
+    before = httpclient.get_http_stats()['connections_opened']
+
+    for _ in range(3):
+        assert httpclient.get(server).text == 'paste ' * 1000
+
+    stats = httpclient.get_http_stats()
+    assert stats['requests'] == 3
+    assert stats['connections_opened'] - before == 1
+    assert stats['bytes_received'] == 3 * 6000
+    assert stats['bytes_transferred'] < stats['bytes_received']
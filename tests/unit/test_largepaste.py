@@ -0,0 +1,58 @@
+import hashlib
+import http.server
+import os
+import threading
+
+import pytest
+import yara
+
+import largepaste
+
+
+class BodyHandler(http.server.BaseHTTPRequestHandler):
+    """ Serves a body of the size given in the request path """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        size = int(self.path.strip('/'))
+        body = (b'0123456789abcdef' * (size // 16 + 1))[:size - 6] + b'secret'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture()
+def server():
+    srv = http.server.ThreadingHTTPServer(('127.0.0.1', 0), BodyHandler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield 'http://127.0.0.1:{0}/'.format(srv.server_port)
+    srv.shutdown()
+
+
+def test_small_body_is_returned_as_text(server):
+    body = largepaste.fetch_paste_body(server + '100', threshold=1024)
+    assert isinstance(body, str)
+    assert len(body) == 100
+
+
+def test_large_body_is_spooled_and_hashed(server):
+    paste = largepaste.fetch_paste_body(server + '300000', threshold=1024)
+    assert isinstance(paste, largepaste.LargePaste)
+
+    with open(paste.path, 'rb') as f:
+        content = f.read()
+    assert len(paste) == len(content) == 300000
+    assert paste.sha256 == hashlib.sha256(content).hexdigest()
+    assert paste.md5 == hashlib.md5(content).hexdigest()
+    assert paste.text(limit=16) == '0123456789abcdef'
+
+    rules = yara.compile(source='rule tail { strings: $a = "secret" condition: $a }')
+    assert [m.rule for m in paste.match(rules)] == ['tail']
+
+    paste.close()
+    assert not os.path.exists(paste.path)
@@ -0,0 +1,38 @@
+import metrics
+
+
+def test_flush_emits_stage_totals_and_counters():
+    sink = metrics.MemorySink()
+    invocation = metrics.InvocationMetrics('pastebin_collector', sink=sink, sample_rate=0)
+    with invocation.timer('fetch'):
+        pass
+    with invocation.timer('fetch'):
+        pass
+    invocation.count('pastes_scanned', 2)
+    invocation.count('bytes_fetched', 512)
+    invocation.flush()
+
+    assert len(sink.records) == 1
+    record = sink.records[0]
+    assert record['FunctionName'] == 'pastebin_collector'
+    assert record['pastes_scanned'] == 2
+    assert 'fetch_ms' in record and 'invocation_ms' in record
+    units = {m['Name']: m['Unit'] for m in record['_aws']['CloudWatchMetrics'][0]['Metrics']}
+    assert units['fetch_ms'] == 'Milliseconds'
+    assert units['bytes_fetched'] == 'Bytes'
+    assert units['pastes_scanned'] == 'Count'
+
+
+def test_sampled_paste_emits_own_record():
+    sink = metrics.MemorySink()
+    invocation = metrics.InvocationMetrics('pastebin_collector', sink=sink, sample_rate=1.0)
+    paste_metrics = invocation.sample_paste('abc123')
+    with invocation.timer('match', paste_metrics):
+        pass
+    invocation.emit_paste(paste_metrics, 10)
+
+    assert sink.records[0]['pasteid'] == 'abc123'
+    assert sink.records[0]['paste_size'] == 10
+    assert 'paste_match_ms' in sink.records[0]
+    assert invocation.sample_paste('x') is not None
+    assert metrics.InvocationMetrics('f', sink=sink, sample_rate=0).sample_paste('x') is None
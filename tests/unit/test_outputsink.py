@@ -0,0 +1,81 @@
+import json
+import random
+
+import outputsink
+import payload
+
+
+class FlakyStream(outputsink.MemoryDeliveryStream):
+    """ Rejects the first record of the first batch put """
+
+    def put_record_batch(self, records):
+        errors = super().put_record_batch(records)
+        if self.calls == 1:
+            self.records.pop(0)
+            errors[0] = 'ServiceUnavailableException'
+        return errors
+
+
+def _documents(records):
+    return [json.loads(line) for record in records for line in record.decode('utf-8').splitlines()]
+
+
+def test_documents_are_aggregated_into_bounded_records_and_batches():
+    stream = outputsink.MemoryDeliveryStream()
+    buffer = outputsink.OutputBuffer(stream, max_batch_records=3, max_record_bytes=200)
+
+    for i in range(20):
+        assert buffer.add(str(i), {'pasteid': str(i), 'raw_paste': 'x' * 50}) == []
+    assert buffer.flush() == []
+
+    assert [d['pasteid'] for d in _documents(stream.records)] == [str(i) for i in range(20)]
+    assert all(len(record) <= 200 for record in stream.records)
+    assert len(stream.records) < 20
+    assert buffer.stats['calls'] == stream.calls == -(-len(stream.records) // 3)
+    assert buffer.stats['records'] == len(stream.records)
+
+
+def test_only_rejected_records_are_retried():
+    stream = FlakyStream()
+    buffer = outputsink.OutputBuffer(stream, max_record_bytes=100, base_delay=0)
+
+    for i in range(5):
+        buffer.add(str(i), {'pasteid': str(i), 'raw_paste': 'x' * 60})
+    assert buffer.flush() == []
+
+    assert stream.calls == 2
+    assert buffer.stats['retried'] == 1
+    assert sorted(d['pasteid'] for d in _documents(stream.records)) == [str(i) for i in range(5)]
+
+
+def test_keys_of_undeliverable_documents_are_returned():
+    stream = outputsink.MemoryDeliveryStream(failure_rate=1.0)
+    buffer = outputsink.OutputBuffer(stream, max_retries=1, base_delay=0)
+
+    buffer.add('a', {'pasteid': 'a'})
+    buffer.add('b', {'pasteid': 'b'})
+
+    assert buffer.flush() == ['a', 'b']
+    assert buffer.stats['failed'] == 2
+
+
+def test_oversized_documents_are_sent_with_a_truncated_body():
+    stream = outputsink.MemoryDeliveryStream()
+    buffer = outputsink.OutputBuffer(stream, max_record_bytes=300)
+    compressed = {'pasteid': 'b', 'YaraRule': ['b64'], 'raw_paste': ''}
+    rng = random.Random(1)
+    payload.encode_raw_paste(compressed, 'é' + ''.join(rng.choice('abcdefghijklmnop') for _ in range(5000)), 'sha')
+    assert compressed['raw_paste_encoding'] == payload.ENCODING_ZLIB
+
+    assert buffer.add('a', {'pasteid': 'a', 'YaraRule': ['keys'], 'raw_paste': 'x\n' * 500}) == []
+    assert buffer.add('b', compressed) == []
+    assert buffer.add('c', {'pasteid': 'c', 'YaraRule': ['x' * 400], 'raw_paste': 'x'}) == ['c']
+    assert buffer.flush() == []
+
+    documents = _documents(stream.records)
+    assert [d['pasteid'] for d in documents] == ['a', 'b']
+    assert all(d['raw_paste_truncated'] and 'raw_paste_encoding' not in d for d in documents)
+    assert documents[0]['YaraRule'] == ['keys'] and documents[0]['raw_paste'].startswith('x\nx\n')
+    assert documents[1]['raw_paste'].startswith('é') and len(documents[1]['raw_paste']) > 100
+    assert all(len(record) <= 300 for record in stream.records)
+    assert buffer.stats['oversized'] == 3 and buffer.stats['failed'] == 1
@@ -0,0 +1,142 @@
+import sys
+import types
+
+import pytest
+from boto3.dynamodb.types import TypeSerializer
+
+import common
+import httpclient
+import metrics
+import paste_scraper
+import scrapestate
+
+
+# items as emitted by the PasteHunter input scripts
+PASTEBIN_ITEMS = [
+    {'scrape_url': 'https://scrape.pastebin.com/api_scrape_item.php?i=Ab12Cd34', 'full_url': 'https://pastebin.com/Ab12Cd34',
+     'date': '1600000020', 'key': 'Ab12Cd34', 'size': '2100', 'expire': '0', 'title': '', 'syntax': 'text', 'user': '',
+     'filename': 'Ab12Cd34', 'confname': 'pastebin', 'pasteid': 'Ab12Cd34', 'pastesite': 'pastebin.com',
+     '@timestamp': '2020-09-13T12:27:00'},
+]
+GIST_ITEMS = [
+    {'filename': 'config.py', 'type': 'application/x-python', 'language': 'Python', 'size': 934,
+     'confname': 'gists', '@timestamp': '2020-09-13T12:26:41Z', 'pasteid': 'aa5a315d61ae9438b18d', 'user': None,
+     'pastesite': 'gist.github.com',
+     'scrape_url': 'https://gist.githubusercontent.com/octo/aa5a315d61ae9438b18d/raw/57a7f0/config.py'},
+    {'filename': 'notes.txt', 'type': 'text/plain', 'language': None, 'size': 51,
+     'confname': 'gists', '@timestamp': '2020-09-13T12:26:41Z', 'pasteid': 'aa5a315d61ae9438b18d', 'user': None,
+     'pastesite': 'gist.github.com',
+     'scrape_url': 'https://gist.githubusercontent.com/octo/aa5a315d61ae9438b18d/raw/3f1c2a/notes.txt'},
+]
+STACKEXCHANGE_ITEMS = [
+    {'tags': ['python', 'boto3'], 'is_answered': False, 'view_count': 3, 'answer_count': 0, 'score': 0,
+     'last_activity_date': 1600000011, 'creation_date': 1600000011, 'question_id': 63870001,
+     'content_license': 'CC BY-SA 4.0', 'link': 'https://stackoverflow.com/questions/63870001/boto3-keys',
+     'title': 'boto3 keys', 'body': '<p>aws_secret_access_key = abc</p>', 'filename': '',
+     'confname': 'stackexchange', 'pasteid': '63870001', 'pastesite': 'stackoverflow',
+     'scrape_url': 'https://stackoverflow.com/questions/63870001/boto3-keys', 'username': 'someone',
+     '@timestamp': '2020-09-13T12:26:51'},
+]
+
+
+class ValidatingDynamoDB:
+    """ Table stand-in serializing items like boto3 and checking the 'key' partition key of the paste table """
+
+    def __init__(self):
+        self.images = {}
+        self._serializer = TypeSerializer()
+
+    def batch_write_item(self, RequestItems):
+        (_, put_requests), = RequestItems.items()
+        for request in put_requests:
+            item = request['PutRequest']['Item']
+            image = {name: self._serializer.serialize(value) for name, value in item.items()}
+            assert 'S' in image['key'] and image['key']['S']
+            self.images[item['key']] = image
+        return {'UnprocessedItems': {}}
+
+
+def _input_module(items, error=None):
+    def recent_pastes(conf, input_history):
+        if error:
+            raise error
+        listed = [dict(item) for item in items]
+        return [item for item in listed if item['pasteid'] not in input_history], \
+            sorted(set(item['pasteid'] for item in listed))
+    return types.SimpleNamespace(recent_pastes=recent_pastes)
+
+
+@pytest.fixture()
+def ddb(tmp_path, monkeypatch):
+    conf = {'inputs': {
+        'pastebin': {'enabled': True, 'module': 'inputs.pastebin', 'paste_limit': 100},
+        'gists': {'enabled': True, 'module': 'inputs.gists', 'api_limit': 100},
+        'stackexchange': {'enabled': True, 'module': 'inputs.stackexchange', 'site_list': ['stackoverflow']},
+        'slexy': {'enabled': True, 'module': 'inputs.slexy'},
+        'dumpz': {'enabled': False, 'module': 'inputs.dumpz'},
+    }}
+    modules = {
+        'PasteHunter.inputs.pastebin': _input_module(PASTEBIN_ITEMS),
+        'PasteHunter.inputs.gists': _input_module(GIST_ITEMS),
+        'PasteHunter.inputs.stackexchange': _input_module(STACKEXCHANGE_ITEMS),
+        'PasteHunter.inputs.slexy': _input_module([], error=ValueError('listing unavailable')),
+    }
+    table = ValidatingDynamoDB()
+    monkeypatch.setattr(paste_scraper.common, 'parse_pastehunter_config', lambda: conf)
+    monkeypatch.setattr(paste_scraper, '_input_modules', modules)
+    monkeypatch.setattr(paste_scraper, '_ddb', table)
+    monkeypatch.setattr(paste_scraper, 'table_name', 'pastes')
+    monkeypatch.setattr(scrapestate, '_state_store', scrapestate.FileStateStore(str(tmp_path / 'state.json')))
+    monkeypatch.setattr(metrics, '_default_sink', metrics.MemorySink())
+    monkeypatch.delenv(paste_scraper.SCRAPER_INPUTS_ENV, raising=False)
+    return table
+
+
+def test_main_stores_items_of_every_input_in_the_table_schema(ddb):
+    result = paste_scraper.main({}, None)
+
+    # the two files of the gist are stored as one item, keyed per input
+    assert sorted(ddb.images) == ['Ab12Cd34', 'gists#aa5a315d61ae9438b18d', 'stackexchange#63870001']
+    assert result['written'] == 3 and result['duplicates'] == 1
+    assert 'listing unavailable' in result['inputs']['slexy']['error']
+    assert result['inputs']['gists']['listed'] == 1 and 'latency_ms' in result['inputs']['gists']
+
+    # every stored item survives the collector's stream decoder
+    records = [{'eventName': 'INSERT', 'dynamodb': {'NewImage': image}} for image in ddb.images.values()]
+    pastes = {paste['pasteid']: paste for paste in common.unpack_ddb_paste_records(records)}
+    assert sorted(pastes) == ['63870001', 'Ab12Cd34', 'aa5a315d61ae9438b18d']
+    assert pastes['aa5a315d61ae9438b18d']['confname'] == 'gists'
+    assert pastes['aa5a315d61ae9438b18d']['syntax'] == 'python'
+    assert pastes['aa5a315d61ae9438b18d']['date'] == common._epoch_to_isoformat('1600000001')
+    assert pastes['63870001']['body'] == '<p>aws_secret_access_key = abc</p>'
+    assert pastes['63870001']['size'] == len('<p>aws_secret_access_key = abc</p>')
+    assert 'user' not in ddb.images['gists#aa5a315d61ae9438b18d']
+
+    state_store = scrapestate.get_state_store()
+    assert state_store.load('pastebin')['high_water_mark'] == 1600000020
+    assert state_store.load('gists') == {'seen_ids': ['aa5a315d61ae9438b18d']}
+    assert state_store.load('slexy') == {}
+
+
+def test_main_skips_pastes_listed_by_the_previous_run(ddb, monkeypatch):
+    paste_scraper.main({}, None)
+    monkeypatch.setenv(paste_scraper.SCRAPER_INPUTS_ENV, 'pastebin,gists')
+
+    result = paste_scraper.main({}, None)
+
+    assert result['paste_count'] == 0
+    assert sorted(result['inputs']) == ['gists', 'pastebin']
+
+
+def test_poll_input_uses_shared_session_during_the_call(monkeypatch, tmp_path):
+    seen = []
+    module = types.SimpleNamespace(requests=httpclient.requests)
+    module.recent_pastes = lambda conf, input_history: seen.append(module.requests) or ([], [])
+    monkeypatch.setitem(sys.modules, 'PasteHunter.inputs.test_site', module)
+    monkeypatch.setattr(paste_scraper, '_input_modules', {})
+    conf = {'inputs': {'test_site': {'enabled': True, 'module': 'inputs.test_site'}}}
+
+    paste_scraper.poll_input('test_site', conf, scrapestate.FileStateStore(str(tmp_path / 'state.json')))
+
+    assert isinstance(seen[0], httpclient.PooledRequests)
+    assert module.requests is httpclient.requests
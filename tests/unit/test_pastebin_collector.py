@@ -0,0 +1,139 @@
+import json
+
+import pytest
+
+import deadletter
+import metrics
+import outputsink
+import pastebin_collector
+import pastescanner
+import retryqueue
+
+
+CONF = {'inputs': {'pastebin': {'enabled': True, 'fetch_rate_per_sec': 1000}}, 'yara': {}}
+
+
+class Context:
+    def __init__(self, remaining_ms):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+def _event(*pasteids):
+    return {'Records': [
+        {'eventName': 'INSERT', 'dynamodb': {'SequenceNumber': str(100 * (i + 1)), 'NewImage': {
+            'pasteid': {'S': pasteid}, 'scrape_url': {'S': f"https://scrape.pastebin.com/{pasteid}"},
+            'date': {'N': '1600000000'}, 'size': {'N': '10'}}}}
+        for i, pasteid in enumerate(pasteids)
+    ]}
+
+
+def fake_fetch_paste(paste_data, conf):
+    if paste_data['pasteid'].startswith('notready'):
+        raise pastescanner.PasteNotReadyError(paste_data['pasteid'])
+    if paste_data['pasteid'].startswith('broken'):
+        raise ValueError('fetch failed')
+    return 'paste ' + paste_data['pasteid']
+
+
+def fake_post_process_paste(paste_data, conf, raw_paste_data, metrics=None):
+    if paste_data['pasteid'].startswith('match'):
+        paste_data['YaraRule'] = ['test_rule']
+    return paste_data
+
+
+@pytest.fixture()
+def collector(monkeypatch):
+    stream = outputsink.MemoryDeliveryStream()
+    sink = metrics.MemorySink()
+    monkeypatch.setattr(pastebin_collector.common, 'parse_pastehunter_config', lambda: CONF)
+    monkeypatch.setattr(pastescanner, 'load_rule_tiers', lambda conf: None)
+    monkeypatch.setattr(pastescanner, 'fetch_paste', fake_fetch_paste)
+    monkeypatch.setattr(pastescanner, 'post_process_paste', fake_post_process_paste)
+    monkeypatch.setattr(outputsink, '_delivery_stream', stream)
+    monkeypatch.setattr(deadletter, '_dead_letter_store', deadletter.MemoryDeadLetterStore())
+    monkeypatch.setattr(retryqueue, '_retry_queue', retryqueue.MemoryRetryQueue())
+    monkeypatch.setattr(metrics, '_default_sink', sink)
+    monkeypatch.delenv('PASTE_DEADLINE_RESERVE_MS', raising=False)
+    return stream, sink
+
+
+def _delivered(stream):
+    return [json.loads(line)['pasteid'] for record in stream.records for line in record.decode('utf-8').splitlines()]
+
+
+def test_failed_records_are_retried_from_the_first_and_dead_lettered(collector):
+    stream, sink = collector
+    event = _event('match_a', 'broken_b', 'clean_c', 'match_d')
+
+    for _ in range(deadletter.DEFAULT_MAX_ATTEMPTS - 1):
+        result = pastebin_collector.main(event, None)
+        assert result['batchItemFailures'] == [{'itemIdentifier': '200'}]
+    # the pastes after the checkpoint are scanned again on every replay
+    assert sink.records[-1]['pastes_replayed'] == 2
+
+    result = pastebin_collector.main(event, None)
+
+    assert result['batchItemFailures'] == []
+    dead_letters = deadletter.get_dead_letter_store().dead_letters
+    assert [(d['key'], d['paste']['pasteid']) for d in dead_letters] == [('200', 'broken_b')]
+    assert sorted(set(_delivered(stream))) == ['match_a', 'match_d']
+
+
+def test_not_ready_pastes_are_deferred_without_failing_the_stream_record(collector):
+    result = pastebin_collector.main(_event('clean_a', 'notready_b'), None)
+
+    assert result['batchItemFailures'] == []
+    assert result['deferred_count'] == 1
+    assert len(retryqueue.get_retry_queue()) == 1
+    assert deadletter.get_dead_letter_store().attempts == {}
+
+
+def test_not_ready_pastes_out_of_retries_are_dead_lettered(collector, monkeypatch, tmp_path):
+    queue = retryqueue.SqliteRetryQueue(str(tmp_path / 'retry.db'))
+    monkeypatch.setattr(retryqueue, '_retry_queue', queue)
+
+    result = pastebin_collector.main(_event('notready_a'), None)
+    assert result['deferred_count'] == 1 and result['batchItemFailures'] == []
+
+    # replay the deferred paste until it runs out of retries
+    for _ in range(pastescanner.PASTEBIN_CACHE_RETRY_COUNT):
+        (paste_data, attempt), = queue.pop_due(now=float('inf'))
+        queue.put(paste_data, attempt, 0)
+        pastebin_collector.main({'Records': []}, None)
+
+    assert len(queue) == 0
+    dead_letters = deadletter.get_dead_letter_store().dead_letters
+    assert [(d['key'], d['attempts']) for d in dead_letters] == \
+        [('retry#notready_a', pastescanner.PASTEBIN_CACHE_RETRY_COUNT)]
+
+
+def test_deadline_checkpoints_the_records_left(collector):
+    stream, _ = collector
+    context = Context(pastebin_collector.scheduler.DEFAULT_DEADLINE_RESERVE_MS +
+                      2 * pastebin_collector.scheduler.ESTIMATED_PASTE_MS + 10)
+
+    result = pastebin_collector.main(_event('match_a', 'match_b', 'match_c', 'match_d'), context)
+
+    assert result['paste_count'] == 2 and result['unprocessed_count'] == 2
+    assert result['batchItemFailures'] == [{'itemIdentifier': '300'}]
+    assert _delivered(stream) == ['match_a', 'match_b']
+
+
+def test_undelivered_output_is_retried(collector, monkeypatch):
+    monkeypatch.setattr(outputsink, '_delivery_stream', outputsink.MemoryDeliveryStream(failure_rate=1.0))
+
+    result = pastebin_collector.main(_event('clean_a', 'match_b'), None)
+
+    assert result['batchItemFailures'] == [{'itemIdentifier': '200'}]
+
+
+def test_undelivered_output_of_a_paste_in_several_records_is_retried_once(collector, monkeypatch):
+    monkeypatch.setattr(outputsink, '_delivery_stream', outputsink.MemoryDeliveryStream(failure_rate=1.0))
+
+    result = pastebin_collector.main(_event('clean_a', 'match_b', 'match_b'), None)
+
+    assert result['batchItemFailures'] == [{'itemIdentifier': '200'}]
+    assert deadletter.get_dead_letter_store().attempts == {'200': 1}
@@ -0,0 +1,208 @@
+import hashlib
+
+import pytest
+import yara
+
+import largepaste
+import pastescanner
+import common
+import postregistry
+import resultcache
+
+
+@pytest.fixture()
+def conf():
+    return {
+        'inputs': {'pastebin': {'store_all': False}},
+        'yara': {'blacklist': True},
+        'post_process': {},
+    }
+
+
+@pytest.fixture()
+def rules(monkeypatch):
+    """ Compiled keyword rules patched in as the default rule set, with a fresh result cache """
+    compiled = yara.compile(source='rule hacked { strings: $hacked = "hacked by" condition: any of them }')
+    state = {'version': 'v1', 'matches': 0}
+
+    class CountingRules:
+        def match(self, **kwargs):
+            state['matches'] += 1
+            return compiled.match(**kwargs)
+
+    monkeypatch.setattr(pastescanner, 'load_yara_rules', lambda: CountingRules())
+    monkeypatch.setattr(pastescanner, 'yara_rules_version', lambda: state['version'])
+    monkeypatch.setattr(resultcache, '_result_cache', resultcache.LRUResultCache(max_entries=16))
+    return state
+
+
+def _paste(pasteid):
+    return {'pasteid': pasteid, 'confname': 'pastebin', 'pastesite': 'pastebin.com'}
+
+
+def test_post_process_paste_reuses_cached_scan(rules, conf):
+    first = pastescanner.post_process_paste(_paste('a'), conf, 'site hacked by someone')
+    second = pastescanner.post_process_paste(_paste('b'), conf, 'site hacked by someone')
+
+    assert rules['matches'] == 1
+    assert second['pasteid'] == 'b'
+    assert second['YaraRule'] == first['YaraRule']
+    assert second['SHA256'] == first['SHA256'] and second['MD5'] == first['MD5']
+
+
+def test_post_process_paste_reruns_post_modules_when_their_configuration_changes(rules, conf):
+    pastescanner.post_process_paste(_paste('a'), conf, 'site hacked by someone')
+    conf['post_process'] = {
+        'post_entropy': {'enabled': True, 'module': 'postprocess.post_entropy', 'rule_list': ['ALL']},
+    }
+
+    second = pastescanner.post_process_paste(_paste('b'), conf, 'site hacked by someone')
+
+    assert rules['matches'] == 2
+    assert 'Shannon Entropy' in second
+
+
+def test_post_process_paste_raises_failed_scans_without_caching_them(rules, conf, monkeypatch):
+    def failing_match(*args):
+        raise yara.Error('internal error: 30')
+    match_rule_tiers = pastescanner.match_rule_tiers
+    monkeypatch.setattr(pastescanner, 'match_rule_tiers', failing_match)
+
+    with pytest.raises(yara.Error):
+        pastescanner.post_process_paste(_paste('a'), conf, 'site hacked by someone')
+    monkeypatch.setattr(pastescanner, 'match_rule_tiers', match_rule_tiers)
+
+    assert pastescanner.post_process_paste(_paste('a'), conf, 'site hacked by someone')['YaraRule'] == ['hacked']
+
+
+def test_post_process_paste_rescans_when_rules_change(rules, conf):
+    pastescanner.post_process_paste(_paste('a'), conf, 'site hacked by someone')
+    rules['version'] = 'v2'
+    pastescanner.post_process_paste(_paste('b'), conf, 'site hacked by someone')
+
+    assert rules['matches'] == 2
+    assert resultcache.get_result_cache().stats['invalidated'] == 1
+
+
+def test_post_process_registry_selects_modules_by_rule(rules, conf, tmp_path, monkeypatch):
+    (tmp_path / 'post_tag.py').write_text('def run(results, raw_paste_data, paste_object):\n'
+                                          '    paste_object["tagged"] = len(raw_paste_data)\n'
+                                          '    return paste_object\n')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    conf['post_process'] = {
+        'post_tag': {'enabled': True, 'module': 'post_tag', 'rule_list': ['hacked']},
+        'post_never': {'enabled': True, 'module': 'post_tag', 'rule_list': ['other_rule']},
+        'post_disabled': {'enabled': False, 'module': 'does_not_exist', 'rule_list': ['ALL']},
+    }
+
+    matched = pastescanner.post_process_paste(_paste('a'), conf, 'site hacked by someone')
+    unmatched = pastescanner.post_process_paste(_paste('b'), conf, 'nothing to see')
+
+    assert matched['tagged'] == len('site hacked by someone')
+    assert 'tagged' not in unmatched
+    stats = postregistry.get_post_process_stats()
+    assert stats['post_tag']['calls'] >= 1
+    assert 'post_never' in stats and 'post_disabled' not in stats
+
+
+def test_post_modules_get_the_whole_body_of_large_pastes(rules, conf, tmp_path, monkeypatch):
+    (tmp_path / 'post_length.py').write_text('def run(results, raw_paste_data, paste_object):\n'
+                                             '    paste_object["length"] = len(raw_paste_data)\n'
+                                             '    return paste_object\n')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    conf['post_process'] = {'post_length': {'enabled': True, 'module': 'post_length', 'rule_list': ['hacked']}}
+    text = 'é' * 200000 + ' site hacked by someone'
+    body = text.encode('utf-8')
+    (tmp_path / 'spool').write_bytes(body)
+    large = largepaste.LargePaste(str(tmp_path / 'spool'), len(body), hashlib.md5(body).hexdigest(),
+                                  hashlib.sha256(body).hexdigest(), body[:1024], 'utf-8')
+
+    large_result = pastescanner.post_process_paste(_paste('a'), conf, large)
+    text_result = pastescanner.post_process_paste(_paste('b'), conf, 'é hacked by')
+
+    assert large_result['length'] == len(text)
+    # sizes are byte counts whether the paste was spooled or not
+    assert large_result['size'] == len(body)
+    assert text_result['size'] == len('é hacked by'.encode('utf-8'))
+
+
+def test_match_rule_tiers_gates_bundles():
+    first_pass = yara.compile(source='rule hacked { strings: $a = "hacked by" condition: $a }')
+    b64 = yara.compile(source='rule b64_exe { strings: $a = "TVqQ" condition: $a }')
+    tiers = [
+        ('first_pass', first_pass, {}),
+        ('base64', b64, {'min_size': 10, 'syntax': ['text']}),
+        ('after_hack', b64, {'requires': ['hacked']}),
+    ]
+
+    def rules(paste_data, raw):
+        return [m.rule for m in pastescanner.match_rule_tiers(tiers, paste_data, raw)]
+
+    assert rules({'syntax': 'text'}, 'TVqQ plus padding') == ['b64_exe']
+    assert rules({'syntax': 'python'}, 'TVqQ plus padding') == []
+    assert rules({'syntax': 'text'}, 'TVqQ') == []
+    assert rules({'syntax': 'python'}, 'hacked by TVqQ') == ['hacked', 'b64_exe']
+
+
+def test_result_cache_keys_on_syntax_gated_bundles(conf, monkeypatch):
+    first_pass = yara.compile(source='rule hacked { strings: $a = "hacked by" condition: $a }')
+    b64 = yara.compile(source='rule b64_exe { strings: $a = "TVqQ" condition: $a }')
+    tiers = [('first_pass', first_pass, {}), ('base64', b64, {'syntax': ['text']})]
+    monkeypatch.setattr(pastescanner, 'load_rule_tiers', lambda conf: (tiers, 'v1'))
+    monkeypatch.setattr(resultcache, '_result_cache', resultcache.LRUResultCache(max_entries=16))
+    body = 'hacked by TVqQ plus padding'
+
+    python_paste = dict(_paste('a'), syntax='python')
+    text_paste = dict(_paste('b'), syntax='text')
+    assert pastescanner.post_process_paste(python_paste, conf, body)['YaraRule'] == ['hacked']
+    assert pastescanner.post_process_paste(text_paste, conf, body)['YaraRule'] == ['hacked', 'b64_exe']
+
+
+BUNDLE_RULE_FILES = {
+    'keywords.yar': 'rule hacked { strings: $a = "hacked by" nocase condition: $a }\n',
+    'base64.yar': 'rule b64_exe { strings: $a = /\\bTV(oA|pB|pQ|qA|qQ|ro)/ condition: $a at 0 }\n'
+                  'rule b64_zip { strings: $a = "UEs" condition: $a at 0 }\n',
+    'powershell.yar': 'rule powershell { strings: $a1 = "IEX" fullword nocase $a2 = "nop" fullword nocase '
+                      '$a3 = "invoke" fullword nocase $a4 = "Invoke-" fullword nocase '
+                      '$a5 = "hidden" fullword nocase condition: 4 of them }\n',
+}
+
+
+def test_match_rule_tiers_size_gated_bundles_find_every_match(tmp_path):
+    for filename, source in BUNDLE_RULE_FILES.items():
+        (tmp_path / filename).write_text(source)
+    # gates below the shortest possible match of each bundle
+    bundles = {'base64': {'rules': ['base64.yar'], 'min_size': 3},
+               'powershell': {'rules': ['powershell.yar'], 'min_size': 15}}
+    common.yara_index(str(tmp_path), blacklist=False, test_rules=False, bundles=bundles)
+    single = common.load_yara_rules(str(tmp_path))
+    tiers, _ = common.load_yara_rule_bundles(bundles, str(tmp_path))
+    evaluated = []
+
+    class CountingRules:
+        def __init__(self, name, rules):
+            self.name, self.rules = name, rules
+
+        def match(self, data):
+            evaluated.append(self.name)
+            return self.rules.match(data=data)
+
+    counted = [(name, CountingRules(name, rules), bundle) for name, rules, bundle in tiers]
+    pastes = ['UEs', 'TVqQAAMAAAAEAAAA', 'IEX nop Invoke-', 'site hacked by someone', 'hi', '']
+    for body in pastes:
+        expected = sorted(m.rule for m in single.match(data=body))
+        assert sorted(m.rule for m in pastescanner.match_rule_tiers(counted, {'syntax': 'text'}, body)) == expected
+
+    # pastes shorter than the shortest possible match of a bundle skip it
+    assert evaluated.count('first_pass') == 6
+    assert evaluated.count('base64') == 4
+    assert evaluated.count('powershell') == 3
+
+
+def test_pastebin_scanner_raises_the_fetch_error(monkeypatch):
+    def failing_fetch(url):
+        raise ConnectionError('connection reset')
+    monkeypatch.setattr(largepaste, 'fetch_paste_body', failing_fetch)
+
+    with pytest.raises(ConnectionError):
+        pastescanner.pastebin_scanner({'pasteid': 'a', 'scrape_url': 'https://scrape.pastebin.com/a'}, {})
@@ -0,0 +1,48 @@
+import hashlib
+
+import payload
+
+
+def _sha256(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def test_small_bodies_are_stored_as_text():
+    paste_data = {}
+    payload.encode_raw_paste(paste_data, 'short paste', _sha256('short paste'))
+
+    assert paste_data == {'raw_paste': 'short paste'}
+    assert payload.decode_raw_paste(paste_data) == 'short paste'
+
+
+def test_bodies_above_the_threshold_are_compressed():
+    body = 'password = hunter2\n' * 1000
+    paste_data = {}
+    payload.encode_raw_paste(paste_data, body, _sha256(body))
+
+    assert paste_data['raw_paste_encoding'] == payload.ENCODING_ZLIB
+    assert len(paste_data['raw_paste']) < len(body) / 10
+    assert payload.decode_raw_paste(paste_data) == body
+
+
+def test_large_bodies_are_offloaded_once_by_content_address(tmp_path):
+    store = payload.CachingBlobStore(payload.FileBlobStore(str(tmp_path)))
+    body = 'aws_secret_access_key ' * 10000
+    sha256 = _sha256(body)
+
+    first, repost = {}, {}
+    payload.encode_raw_paste(first, body, sha256, blob_store=store)
+    payload.encode_raw_paste(repost, body, sha256, blob_store=store)
+
+    assert first == repost == {'raw_paste_encoding': payload.ENCODING_BLOB, 'raw_paste_ref': sha256}
+    assert [p.name for p in tmp_path.iterdir()] == [sha256]
+    assert payload.decode_raw_paste(first, store) == body
+
+
+def test_large_bodies_are_truncated_without_a_blob_store():
+    body = 'x' * (payload.largepaste.STORED_BODY_LIMIT + 10)
+    paste_data = {}
+    payload.encode_raw_paste(paste_data, body, _sha256(body))
+
+    assert paste_data['raw_paste_truncated'] is True
+    assert payload.decode_raw_paste(paste_data) == body[:payload.largepaste.STORED_BODY_LIMIT]
@@ -0,0 +1,109 @@
+import base64
+import gzip
+import hashlib
+import re
+import sys
+
+import pytest
+
+import postb64
+import postregistry
+
+
+def _reference_run(results, raw_paste_data, paste_object, conf):
+    # the PasteHunter 'post_b64' module, with the configuration it parses on import passed in
+    for rule in results:
+        if len(raw_paste_data) > 0:
+            if rule == 'b64_gzip':
+                try:
+                    uncompressed = gzip.decompress(base64.b64decode(raw_paste_data))
+                    paste_object["decompressed_stream"] = uncompressed.encode('utf-8')
+                except Exception:
+                    pass
+            if rule == 'b64_exe':
+                try:
+                    raw_exe = base64.b64decode(raw_paste_data)
+                    paste_object["exe_size"] = len(raw_exe)
+                    paste_object["exe_md5"] = hashlib.md5(raw_exe).hexdigest()
+                    paste_object["exe_sha256"] = hashlib.sha256(raw_exe).hexdigest()
+                    paste_object["VT"] = 'https://www.virustotal.com/#/file/{0}'.format(paste_object["exe_md5"])
+                    for sandbox, sandbox_values in conf["sandboxes"].items():
+                        if sandbox_values["enabled"]:
+                            paste_object = SandboxModule.upload_file(raw_exe, paste_object)
+                except Exception:
+                    pass
+    return paste_object
+
+
+class SandboxModule:
+    @staticmethod
+    def upload_file(raw_exe, paste_object):
+        paste_object['sandbox_uploads'] = paste_object.get('sandbox_uploads', 0) + 1
+        return paste_object
+
+
+EXE = base64.b64encode(b'MZ\x90\x00\x03' + bytes(range(256)) * 4).decode('ascii')
+GZIP = base64.b64encode(gzip.compress(b'secret listing')).decode('ascii')
+
+
+@pytest.mark.parametrize('conf', [
+    {'sandboxes': {}},
+    {'sandboxes': {'cuckoo': {'enabled': False, 'module': 'sandbox'},
+                   'hybrid': {'enabled': True, 'module': 'sandbox'}}},
+    {},
+])
+@pytest.mark.parametrize('results, text', [
+    ([], EXE),
+    (['b64_exe'], EXE),
+    (['b64_exe'], EXE + '\n'),
+    (['b64_exe'], EXE[:-3]),
+    (['b64_exe', 'b64_exe'], 'TVqQ café'),
+    (['b64_exe'], ''),
+    (['b64_gzip'], GZIP),
+    (['b64_gzip', 'b64_exe', 'other_rule'], GZIP),
+])
+def test_run_matches_post_b64(results, text, conf, monkeypatch):
+    monkeypatch.delenv(postb64.BASE64_SPANS_ENV, raising=False)
+    monkeypatch.setattr(postb64, '_conf', conf)
+    monkeypatch.setitem(sys.modules, 'sandbox', SandboxModule)
+    expected = _reference_run(results, text, {'pasteid': 'a'}, conf)
+
+    assert postb64.run(results, text, {'pasteid': 'a'}) == expected
+    assert postb64.run(results, text, {'pasteid': 'a'}, encoded=text.encode('utf-8')) == expected
+
+
+BASE64_RE = re.compile(rb'(?:[A-Za-z0-9+/]{4}){3,}(?:[A-Za-z0-9+/]{2}==|[A-Za-z0-9+/]{3}=)?')
+
+
+@pytest.mark.parametrize('text', [
+    '',
+    'short',
+    'TVqQAAMAAAAEAAAA//8AALgAAAAAAAAAQAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA',
+    'key: aGVsbG8gd29ybGQh\ntwo pad: aGVsbG8gd29ybGQ= one pad: aGVsbG8gd29ybA== end',
+    'rest one aGVsbG8gd29ybGQhx= rest two aGVsbG8gd29ybGQhxy= café日本aGVsbG8gd29ybGQhxyz=',
+    'getElementById(x); document.querySelectorAll(".a") ' * 20,
+])
+def test_base64_spans_match_the_post_b64_pattern(text):
+    encoded = text.encode('utf-8')
+    expected = [[m.start(), m.end() - m.start()] for m in BASE64_RE.finditer(encoded)]
+
+    assert postb64.base64_spans(encoded) == expected[:postb64.MAX_BASE64_SPANS]
+
+
+def test_base64_spans_are_only_added_when_enabled(monkeypatch):
+    monkeypatch.setattr(postb64, '_conf', {'sandboxes': {}})
+    monkeypatch.setenv(postb64.BASE64_SPANS_ENV, '1')
+
+    paste_data = postb64.run([], 'key: aGVsbG8gd29ybGQh', {'pasteid': 'a'})
+
+    assert paste_data['Base64 Spans'] == [[5, 16]]
+
+
+def test_registry_uses_native_module_for_post_b64(monkeypatch):
+    monkeypatch.delenv(postregistry.NATIVE_POST_ENV, raising=False)
+    registry = postregistry.PostProcessRegistry({
+        'post_b64': {'enabled': True, 'module': 'postprocess.post_b64', 'rule_list': ['b64_exe']},
+    })
+
+    assert registry.modules['post_b64'] is postb64
+    assert registry.select(['core_keywords']) == []
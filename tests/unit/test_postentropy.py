@@ -0,0 +1,41 @@
+import math
+from collections import Counter
+
+import pytest
+
+import postentropy
+import postregistry
+
+
+def _reference_entropy(text):
+    p, lns = Counter(text), float(len(text))
+    return -sum(count / lns * math.log(count / lns, 2) for count in p.values())
+
+
+@pytest.mark.parametrize('text', [
+    '',
+    'a',
+    'aaaaabbbc',
+    'site hacked by someone\n' * 50,
+    'TVqQAAMAAAAEAAAA//8AALgAAAAAAAAAQAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA',
+    'café 日本語 \U0001f600 café',
+])
+def test_shannon_entropy_matches_post_entropy(text):
+    expected = _reference_entropy(text)
+
+    assert postentropy.shannon_entropy(text) == expected
+    assert postentropy.shannon_entropy(text, text.encode('utf-8')) == expected
+    assert type(postentropy.shannon_entropy(text)) is type(expected)
+
+
+def test_registry_uses_native_module(monkeypatch):
+    monkeypatch.delenv(postregistry.NATIVE_POST_ENV, raising=False)
+    registry = postregistry.PostProcessRegistry({
+        'post_entropy': {'enabled': True, 'module': 'postprocess.post_entropy', 'rule_list': ['ALL']},
+    })
+
+    paste_data = registry.run([], 'aaaaabbbc', {'pasteid': 'a'}, encoded=b'aaaaabbbc')
+
+    assert registry.modules['post_entropy'] is postentropy
+    assert paste_data['Shannon Entropy'] == _reference_entropy('aaaaabbbc')
+    assert set(paste_data) == {'pasteid', 'Shannon Entropy'}
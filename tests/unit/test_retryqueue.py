@@ -0,0 +1,34 @@
+import time
+
+import pytest
+
+import retryqueue
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def queue(request, tmp_path):
+    if request.param == 'sqlite':
+        return retryqueue.SqliteRetryQueue(str(tmp_path / 'retry.db'))
+    return retryqueue.MemoryRetryQueue()
+
+
+def test_pop_due_only_returns_due_items(queue):
+    now = time.time()
+    queue.put({'pasteid': 'late'}, 1, now + 60)
+    queue.put({'pasteid': 'due'}, 2, now - 1)
+
+    assert queue.pop_due(now) == [({'pasteid': 'due'}, 2)]
+    assert len(queue) == 1
+    assert queue.pop_due(now + 61) == [({'pasteid': 'late'}, 1)]
+    assert len(queue) == 0
+
+
+def test_defer_paste_backoff_and_max_attempts(queue):
+    start = time.time()
+    assert retryqueue.defer_paste(queue, {'pasteid': 'a'}, 1, base_delay=5, max_attempts=2)
+    assert retryqueue.defer_paste(queue, {'pasteid': 'b'}, 2, base_delay=5, max_attempts=2)
+    assert not retryqueue.defer_paste(queue, {'pasteid': 'c'}, 3, base_delay=5, max_attempts=2)
+
+    assert queue.pop_due(start + 4) == []
+    assert queue.pop_due(start + 6) == [({'pasteid': 'a'}, 1)]
+    assert queue.pop_due(start + 11) == [({'pasteid': 'b'}, 2)]
@@ -0,0 +1,62 @@
+import scheduler
+
+
+class Context:
+    def __init__(self, remaining_ms):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+def test_prioritize_scans_short_lived_pastes_first():
+    now = 1000000
+    pastes = [
+        {'pasteid': 'never', 'size': 10, 'syntax': 'text', 'expire': 0},
+        {'pasteid': 'expired', 'size': 10, 'syntax': 'text', 'expire': now - 1},
+        {'pasteid': 'day', 'size': 10, 'syntax': 'text', 'expire': now + 86400},
+        {'pasteid': 'ten_minutes_large', 'size': 50000, 'syntax': 'text', 'expire': now + 600},
+        {'pasteid': 'ten_minutes', 'size': 10, 'syntax': 'text', 'expire': now + 600},
+        {'pasteid': 'ten_minutes_other_syntax', 'size': 10, 'syntax': 'c', 'expire': now + 600},
+    ]
+
+    ordered = [p['pasteid'] for p in scheduler.prioritize(pastes, now)]
+
+    assert ordered == ['ten_minutes', 'ten_minutes_large', 'ten_minutes_other_syntax', 'day', 'never', 'expired']
+
+
+def test_deadline_keeps_the_reserve_free():
+    assert scheduler.Deadline(None).allows({'size': 10 ** 9})
+    assert scheduler.Deadline(Context(5000), reserve_ms=1000).allows({'size': 1000})
+    assert not scheduler.Deadline(Context(900), reserve_ms=1000).allows({'size': 1000})
+    # large pastes are not started when their estimated scan time exceeds the time left
+    assert not scheduler.Deadline(Context(1500), reserve_ms=1000).allows({'size': 10 ** 7})
+    # small pastes still take the fixed estimate per paste
+    assert not scheduler.Deadline(Context(1000 + scheduler.ESTIMATED_PASTE_MS - 1), reserve_ms=1000).allows({'size': 0})
+
+
+def test_plan_batch_selects_a_sequence_prefix_that_fits_the_deadline():
+    now = 1000000
+    pastes = [
+        {'pasteid': 'third', 'size': 10, 'syntax': 'text', 'expire': now + 600},
+        {'pasteid': 'first', 'size': 10, 'syntax': 'c', 'expire': 0},
+        {'pasteid': 'retry', 'size': 10, 'syntax': 'c', 'expire': 0},
+        {'pasteid': 'second', 'size': 10, 'syntax': 'text', 'expire': now + 600},
+    ]
+    sequence_numbers = {'first': '100', 'second': '200', 'third': '300'}
+    deadline = scheduler.Deadline(Context(1000 + 3 * scheduler.ESTIMATED_PASTE_MS + 10), reserve_ms=1000)
+
+    selected, left = scheduler.plan_batch(pastes, deadline, sequence_numbers, now)
+
+    # the selection is ordered by priority, the records left all follow it in the stream
+    assert [p['pasteid'] for p in selected] == ['second', 'retry', 'first']
+    assert [p['pasteid'] for p in left] == ['third']
+    # the deadline takes the same estimate: the first paste left would no longer fit
+    assert all(deadline.allows(p) for p in selected)
+    assert not scheduler.Deadline(Context(1010), reserve_ms=1000).allows(left[0])
+
+    selected, left = scheduler.plan_batch(pastes, scheduler.Deadline(Context(0), reserve_ms=1000), sequence_numbers)
+    assert [p['pasteid'] for p in selected] == ['retry'] and len(left) == 3
+
+    selected, left = scheduler.plan_batch(pastes, scheduler.Deadline(None), sequence_numbers, now)
+    assert [p['pasteid'] for p in selected] == ['second', 'third', 'retry', 'first'] and left == []
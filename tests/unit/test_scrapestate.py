@@ -0,0 +1,41 @@
+import scrapestate
+
+
+def _listing(ids_dates):
+    return [{'pasteid': pid, 'key': pid, 'date': str(date)} for pid, date in ids_dates]
+
+
+def test_filter_new_pastes_first_run_keeps_everything():
+    pastes = _listing([('c', 30), ('b', 20), ('a', 10)])
+    new_pastes, state = scrapestate.filter_new_pastes(pastes, ['c', 'b', 'a'], {}, 100)
+
+    assert new_pastes == pastes
+    assert state == {'high_water_mark': 30, 'seen_ids': ['c', 'b', 'a'], 'limit': 100}
+
+
+def test_filter_new_pastes_drops_pastes_below_high_water_mark():
+    state = {'high_water_mark': 30, 'seen_ids': ['c'], 'limit': 100}
+    # 'c' was already skipped by the input through its history, 'x' is older than the mark
+    pastes = _listing([('e', 40), ('d', 30), ('x', 5)])
+    new_pastes, state = scrapestate.filter_new_pastes(pastes, ['e', 'd', 'c', 'x'], state, 100)
+
+    assert [p['pasteid'] for p in new_pastes] == ['e', 'd']
+    assert state['high_water_mark'] == 40
+    assert state['seen_ids'] == ['e', 'd', 'c', 'x']
+
+
+def test_next_listing_limit_adapts_to_overlap():
+    assert scrapestate.next_listing_limit(100, 100, 0) == 200
+    assert scrapestate.next_listing_limit(200, 200, 0) == scrapestate.LISTING_LIMIT_MAX
+    assert scrapestate.next_listing_limit(100, 100, 5) == 126
+    assert scrapestate.next_listing_limit(100, 100, 30) == 100
+    assert scrapestate.next_listing_limit(100, 100, 90) == 75
+    assert scrapestate.next_listing_limit(60, 60, 59) == scrapestate.LISTING_LIMIT_MIN
+
+
+def test_file_state_store_round_trip(tmp_path):
+    store = scrapestate.FileStateStore(str(tmp_path / 'state.json'))
+    assert store.load('pastebin') == {}
+
+    store.save('pastebin', {'high_water_mark': 10, 'seen_ids': ['a'], 'limit': 100})
+    assert store.load('pastebin')['high_water_mark'] == 10
@@ -0,0 +1,119 @@
+import os
+import re
+import time
+import json
+import yara
+import logging
+import code.common as common
+
+logger = logging.getLogger("buildutil")
+
+RULE_START_RE = re.compile(r'^\s*((?:private|global)\s+)*rule\s+(\w+)', re.MULTILINE)
+IMPORT_RE = re.compile(r'^\s*import\s+"[^"]+"\s*$', re.MULTILINE)
+
+def split_rules(source):
+    """ Split Yara rule file source into (rule name, standalone source) pairs, carrying over the module imports """
+    imports = '\n'.join(IMPORT_RE.findall(source))
+    starts = list(RULE_START_RE.finditer(source))
+
+    rules = []
+    for i, start in enumerate(starts):
+        end = starts[i + 1].start() if i + 1 < len(starts) else len(source)
+        rules.append((start.group(2), imports + '\n' + source[start.start():end]))
+    return rules
+
+def load_corpus(corpus_path, limit=None):
+    """ Read every file below the corpus folder as one paste body """
+    pastes = []
+    for root, _, filenames in os.walk(corpus_path):
+        for filename in sorted(filenames):
+            with open(os.path.join(root, filename), 'rb') as f:
+                pastes.append(f.read())
+            if limit is not None and len(pastes) >= limit:
+                return pastes
+    return pastes
+
+def _profile_rules(rules, pastes, timeout):
+    """ Scan every paste with the compiled rules and collect timing, match and timeout counts """
+    stats = {'total_sec': 0.0, 'max_ms': 0.0, 'matches': 0, 'timeouts': 0}
+    for paste in pastes:
+        start = time.perf_counter()
+        try:
+            if rules.match(data=paste, timeout=timeout):
+                stats['matches'] += 1
+        except yara.TimeoutError:
+            stats['timeouts'] += 1
+        elapsed = time.perf_counter() - start
+        stats['total_sec'] += elapsed
+        stats['max_ms'] = max(stats['max_ms'], elapsed * 1000)
+
+    stats['mean_ms'] = stats['total_sec'] * 1000 / len(pastes) if pastes else 0.0
+    stats['match_rate'] = stats['matches'] / len(pastes) if pastes else 0.0
+    return stats
+
+def profile_rule_files(rule_path, pastes, timeout=10):
+    """
+    Profile every rule file included by 'index.yar' on its own, and every rule of each file on its own
+
+    :param rule_path: folder holding the 'index.yar' file
+    :param pastes: list of paste bodies to scan
+    :param timeout: Yara match timeout in seconds per paste
+    :returns: report dictionary with 'files' and 'rules' lists ranked by total scan time
+    """
+    index_file = os.path.abspath(os.path.join(rule_path, 'index.yar'))
+    rule_files = [f for f in common.yara_include_files(index_file) if f != index_file]
+
+    report = {'corpus': {'pastes': len(pastes), 'bytes': sum(len(p) for p in pastes)}, 'files': [], 'rules': []}
+    for rule_file in rule_files:
+        filename = os.path.relpath(rule_file, os.path.dirname(index_file))
+        logger.info(f"Profiling rule file {filename}")
+
+        file_stats = _profile_rules(yara.compile(filepath=rule_file), pastes, timeout)
+        file_stats['file'] = filename
+        report['files'].append(file_stats)
+
+        with open(rule_file, 'r', errors='replace') as yar:
+            source = yar.read()
+        for rule_name, rule_source in split_rules(source):
+            try:
+                rules = yara.compile(source=rule_source)
+            except yara.SyntaxError as e:
+                # rules referencing other rules only exist as part of their file
+                logger.info(f"Rule {rule_name} in {filename} cannot be profiled on its own: {e}")
+                continue
+            rule_stats = _profile_rules(rules, pastes, timeout)
+            rule_stats['rule'] = rule_name
+            rule_stats['file'] = filename
+            report['rules'].append(rule_stats)
+
+    report['files'].sort(key=lambda s: s['total_sec'], reverse=True)
+    report['rules'].sort(key=lambda s: s['total_sec'], reverse=True)
+    return report
+
+def write_recommended_index(report, index_file, budget_ms):
+    """ Write an index file including only the rule files whose mean scan cost per paste is within budget
+
+        The blacklist rules are always kept since they filter the results of all other rules.
+
+        :returns: list of the excluded rule files
+    """
+    excluded = [s['file'] for s in report['files']
+                if (s['mean_ms'] > budget_ms or s['timeouts'] > 0) and s['file'] != 'blacklist.yar']
+    with open(index_file, 'w') as yar:
+        for stats in sorted(report['files'], key=lambda s: s['file']):
+            if stats['file'] not in excluded:
+                yar.write('include "{0}"\n'.format(stats['file']))
+    return excluded
+
+def log_report(report, top=10):
+    logger.info(f"Profiled {report['corpus']['pastes']} pastes, {report['corpus']['bytes']} bytes")
+    for kind, name_key in (('files', 'file'), ('rules', 'rule')):
+        logger.info(f"Slowest {kind}:")
+        for stats in report[kind][:top]:
+            logger.info("> {0:<40} total {1:8.3f} s  mean {2:7.3f} ms  max {3:8.3f} ms  match rate {4:6.2%}  "
+                        "timeouts {5}".format(stats[name_key], stats['total_sec'], stats['mean_ms'], stats['max_ms'],
+                                              stats['match_rate'], stats['timeouts']))
+
+def save_report(report, report_file):
+    with open(report_file, 'w') as f:
+        json.dump(report, f, indent=2)